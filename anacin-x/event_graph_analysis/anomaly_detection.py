@@ -4,8 +4,11 @@ import argparse
 import pickle
 import json
 import os
+import csv
+import multiprocessing as mp
 import numpy as np
-from scipy.stats import chisquare, ks_2samp
+import psutil
+from scipy.stats import chisquare, kstwo
 
 import pprint
 
@@ -15,27 +18,36 @@ import ruptures as rpt
 import sys
 sys.path.append(".")
 
-from graph_kernel_postprocessing import flatten_distance_matrix
+from graph_kernel_postprocessing import ( flatten_distance_matrix,
+                                          stack_flattened_distance_matrices
+                                        )
 from utilities import timer
+from kdts_store import load_kdts
 
 """
 Return the critical value for the 2-sample Kolmogorov-Smirnov test given 
-the sample sizes of the two compared distributions
+the sample sizes of the two compared distributions, i.e., the statistic above
+which the (asymptotic, as in scipy's ks_2samp for large samples) p-value falls
+below alpha. Sample sizes may be arrays; the critical value is computed once per
+distinct effective sample size.
 """
-def ks_2samp_critical_value( n_samples_a, n_samples_b ):
-    pass
+def ks_2samp_critical_value( n_samples_a, n_samples_b, alpha=0.05 ):
+    n_a = np.asarray( n_samples_a, dtype=np.float64 )
+    n_b = np.asarray( n_samples_b, dtype=np.float64 )
+    with np.errstate( divide="ignore", invalid="ignore" ):
+        effective_n = np.round( n_a * n_b / ( n_a + n_b ) )
+    unique_n, inverse = np.unique( effective_n, return_inverse=True )
+    critical_values = np.full( len( unique_n ), np.nan )
+    valid = unique_n >= 1
+    critical_values[ valid ] = kstwo.isf( alpha, unique_n[ valid ] )
+    return critical_values[ inverse ].reshape( effective_n.shape )
 
 
 """
-Returns a list of pairwise kernel distances from a kernel distance matrix
+Returns an array of pairwise kernel distances from a kernel distance matrix
 """
 def get_flat_distances( distance_mat ):
-    distances = []
-    for i in range(len(distance_mat)):
-        for j in range(len(distance_mat)):
-            if i > j:
-                distances.append( distance_mat[i][j] )
-    return distances
+    return flatten_distance_matrix( distance_mat )
 
 """
 Groups distances into buckets where each bucket is an interval of [ low, high ]
@@ -56,8 +68,150 @@ def bucket_distances( distances, buckets ):
                     bucket_to_count[ bucket ] += 1
     return bucket_to_count
 
+class kernel_distance_series(object):
+    """
+    The kernel distance time series w/r/t a single kernel, stacked into one
+    ( n_slices x n_pairs ) array whose row i holds slice i's flattened pairwise
+    distances. Rows are NaN-padded if slices have different numbers of pairs.
+    Per-slice summaries are computed along the pair axis once and shared by
+    all policies run on the series.
+    """
+    def __init__(self, distances):
+        self.distances = np.asarray( distances, dtype=np.float64 )
+        self._padded = bool( np.isnan( self.distances ).any() )
+        self._medians = None
+        self._sorted_distributions = None
+
+    @classmethod
+    def from_distance_matrices(cls, kernel_distance_seq):
+        return cls( stack_flattened_distance_matrices( kernel_distance_seq ) )
+
+    def __len__(self):
+        return self.distances.shape[0]
+
+    def medians(self):
+        if self._medians is None:
+            median = np.nanmedian if self._padded else np.median
+            self._medians = median( self.distances, axis=1 )
+        return self._medians
+
+    def sorted_distributions(self):
+        if self._sorted_distributions is None:
+            self._sorted_distributions = sorted_distance_distributions( self.distances )
+        return self._sorted_distributions
+
+    def maxima(self):
+        return np.fmax.reduce( self.distances, axis=1 )
+
+    def get_signal(self):
+        """
+        Returns the distances as a ( n_slices x n_pairs ) signal for 
+        change-point detection, which requires every slice to have the same
+        number of pairs
+        """
+        if self._padded:
+            raise ValueError("Change-point detection requires the same number of distances in every slice")
+        return self.distances
+
+class sorted_distance_distributions(object):
+    """
+    Every slice's distances sorted once, from which the empirical CDF of any
+    slice, or of a group of slices pooled together, can be evaluated at any
+    points. Distances are replaced by their ranks among all distances, and rank
+    r of slice i by the key i * n_ranks + r, so that the keys of all slices 
+    form one sorted array that a single binary search covers for all slices.
+    """
+    def __init__(self, distances):
+        n_slices, n_pairs = distances.shape
+        valid = ~np.isnan( distances )
+        self.sizes = np.sum( valid, axis=1 )
+        values, ranks = np.unique( distances[ valid ], return_inverse=True )
+        # NaN padding ranks above all distances, so it sorts last
+        self._n_ranks = len( values ) + 1
+        rank_mat = np.full( distances.shape, self._n_ranks - 1, dtype=np.int64 )
+        rank_mat[ valid ] = ranks.ravel()
+        self.ranks = np.sort( rank_mat, axis=1 )
+        self._n_pairs = n_pairs
+        self._keys = ( self.ranks + np.arange( n_slices, dtype=np.int64 )[:,None] * self._n_ranks ).ravel()
+
+    def get_counts(self, slices, ranks):
+        """
+        Returns the number of distances of each slice that rank at most the
+        corresponding rank. slices and ranks are broadcast against each other.
+        """
+        slices = np.asarray( slices, dtype=np.int64 )
+        counts = np.searchsorted( self._keys, slices * self._n_ranks + ranks, side="right" ) - slices * self._n_pairs
+        return np.minimum( counts, self.sizes[ slices ] )
+
+    def get_ks_statistics(self, slices, groups, max_points=1<<24):
+        """
+        Computes the two-sample Kolmogorov-Smirnov statistic between each slice
+        and the pooled distances of the corresponding row of groups, a 
+        ( n_slices x group size ) array of slice indices. Returns the 
+        statistics and both samples' sizes; statistics involving an empty 
+        sample are NaN.
+        """
+        slices = np.asarray( slices, dtype=np.int64 )
+        groups = np.asarray( groups, dtype=np.int64 ).reshape( len( slices ), -1 )
+        group_sizes = np.sum( self.sizes[ groups ], axis=1 )
+        statistics = np.full( len( slices ), np.nan )
+        # The ECDFs' difference is largest at one of the samples' values. Slices
+        # are processed in chunks to bound the number of points held at once.
+        n_points = ( 1 + groups.shape[1] ) * self._n_pairs
+        chunk_size = max( 1, max_points // max( n_points, 1 ) )
+        for start in range( 0, len( slices ), chunk_size ):
+            chunk = slice( start, start + chunk_size )
+            s = slices[ chunk, None ]
+            g = groups[ chunk ]
+            points = np.concatenate( [ self.ranks[ s[:,0] ] ] + [ self.ranks[ g[:,j] ] for j in range( g.shape[1] ) ], axis=1 )
+            group_counts = sum( self.get_counts( g[:,j:j+1], points ) for j in range( g.shape[1] ) )
+            with np.errstate( divide="ignore", invalid="ignore" ):
+                differences = np.abs( self.get_counts( s, points ) / self.sizes[ s ] - group_counts / group_sizes[ chunk, None ] )
+            statistics[ chunk ] = np.max( differences, axis=1, initial=0.0 )
+        statistics[ ( self.sizes[ slices ] == 0 ) | ( group_sizes == 0 ) ] = np.nan
+        return statistics, self.sizes[ slices ], group_sizes
+
+"""
+Runs a fitted ruptures change-point detector and returns the indices of the
+slices ending each segment
+"""
+def get_change_point_slice_indices( algo, series, policy_params ):
+    n_change_points = policy_params[ "n_change_points" ]
+    penalty = policy_params[ "penalty" ]
+    epsilon = policy_params[ "epsilon" ]
+
+    # Get some properties about the distances needed by Ruptures
+    n_distributions, dim = series.distances.shape
+    sigma = np.std( series.distances )
+
+    # Find change-points
+    if n_change_points == "unknown":
+        if penalty == True and epsilon == False:
+            penalty_value = np.log( n_distributions ) * dim * sigma**2 
+            change_points = algo.predict( pen=penalty_value )
+        elif penalty == False and epsilon == True:
+            threshold = 3 * n_distributions * sigma**2
+            change_points = algo.predict( epsilon=threshold )
+        else:
+            raise ValueError("Invalid policy for window-based change-point detection: {}".format(policy_params))
+    else:
+        change_points = algo.predict( n_bkps=n_change_points )
+    
+    return [ cp-1 for cp in change_points ]
+
+"""
+Applies an anomaly detection policy to a kernel distance time series, given 
+either as a kernel_distance_series or as a sequence of per-slice distance
+matrices. Returns the positions of the flagged slices in the series.
+"""
 @timer
 def detect_anomalies( kernel_distance_seq, policy ):
+    if isinstance( kernel_distance_seq, kernel_distance_series ):
+        series = kernel_distance_seq
+    else:
+        series = kernel_distance_series.from_distance_matrices( kernel_distance_seq )
+    n_slices = len( series )
+
     # Unpack policy
     policy_name = policy["name"]
     policy_params = policy["params"]
@@ -67,204 +221,169 @@ def detect_anomalies( kernel_distance_seq, policy ):
     # anomalous. This is not really "anomaly detection" in any meaningful sense
     # But it suffices for testing the basic workflow
     if policy_name == "naive_max":
-        max_dist_slice_idx = 0
-        max_dist = 0
-        for slice_idx,distance_mat in enumerate( kernel_distance_seq ):
-            distances = get_flat_distances( distance_mat )
-            slice_max = max( distances)
-            if max_distance_in_slice > max_dist:
-                max_dist = slice_max
-                max_dist_slice_idx = slice_idx
-        return [ max_dist_slice_idx ]
+        maxima = series.maxima()
+        if n_slices == 0 or not np.nanmax( maxima, initial=0 ) > 0:
+            return [ 0 ]
+        return [ int( np.nanargmax( maxima ) ) ]
 
     # Detect anomalies based on whether the median kernel distance increases
-    # from slice to slice or not
+    # from slice to slice (by more than a threshold, if one is given) or not
     elif policy_name == "increasing_median":
-        threshold = policy_params["threshold"]
-        flagged_slice_indices = []
-        prev_median_distance = 0
-        curr_median_distance = 0
-        for slice_idx,distance_mat in enumerate( kernel_distance_seq ):
-            distances = get_flat_distances( distance_mat )
-            curr_median_distance = np.median( distances )
-            #if curr_median_distance > prev_median_distance:
-            if curr_median_distance - prev_median_distance > threshold:
-                flagged_slice_indices.append( slice_idx )
-            prev_median_distance = curr_median_distance
-        return flagged_slice_indices
+        threshold = policy_params.get( "threshold", 0 )
+        increases = np.diff( series.medians(), prepend=0 )
+        return np.flatnonzero( increases > threshold ).tolist()
     
+    # Flag slices whose distance distribution differs significantly from both
+    # that of the preceding and that of the following slices, each pooled over
+    # a window of window slices. Slices without a full window on either side
+    # are not tested.
     elif policy_name == "kolmogorov_smirnov":
-        flagged_slice_indices = []
-        prev_distribution = None
-        next_distribution = None
-        for slice_idx in range(len(kernel_distance_seq))[1:-1]:
-            prev_dist = flatten_distance_matrix(kernel_distance_seq[ slice_idx - 1 ])
-            curr_dist = flatten_distance_matrix(kernel_distance_seq[ slice_idx  ])
-            next_dist = flatten_distance_matrix(kernel_distance_seq[ slice_idx + 1 ])
-            ks2_stat_prev, p_val_prev = ks_2samp( prev_dist, curr_dist )
-            ks2_stat_next, p_val_next = ks_2samp( next_dist, curr_dist )
-            thresh = 0.0001
-            if p_val_prev < thresh and p_val_next < thresh:
-                flagged_slice_indices.append( slice_idx )
-        return flagged_slice_indices
+        window = policy_params.get( "window", 1 )
+        thresh = policy_params.get( "threshold", 0.0001 )
+        slices = np.arange( window, n_slices - window )
+        if len( slices ) == 0:
+            return []
+        lags = np.arange( 1, window + 1 )
+        distributions = series.sorted_distributions()
+        ks2_stat_prev, n_curr, n_prev = distributions.get_ks_statistics( slices, slices[:,None] - lags )
+        ks2_stat_next, _, n_next = distributions.get_ks_statistics( slices, slices[:,None] + lags )
+        # A p-value below thresh is a statistic above the critical value
+        with np.errstate( invalid="ignore" ):
+            differs_prev = ks2_stat_prev > ks_2samp_critical_value( n_prev, n_curr, thresh )
+            differs_next = ks2_stat_next > ks_2samp_critical_value( n_next, n_curr, thresh )
+        return slices[ differs_prev & differs_next ].tolist()
 
     # Flag slices if the median kernel distance exceeds a user-supplied 
     # threshold
     elif policy_name == "median_exceeds_threshold":
         threshold = policy_params[ "threshold" ]
-        flagged_slice_indices = []
-        for slice_idx,distance_mat in enumerate( kernel_distance_seq ):
-            distances = get_flat_distances( distance_mat )
-            median_distance = np.median( distances )
-            if median_distance > threshold:
-                flagged_slice_indices.append( slice_idx )
-        return flagged_slice_indices
+        return np.flatnonzero( series.medians() > threshold ).tolist()
         
     # Randomly choose slices. This isn't really an anomaly detection policy, but
     # we use it to check whether the distribution of callstacks from a random
     # sample of slices looks different than the distribution of callstacks from
     # the flagged slices
     elif policy_name == "random":
-        n_samples = policy_params["n_samples"]
-        n_slices = len(kernel_distance_seq)
-        n_generated = 0
-        flagged_slice_indices = set()
-        while n_generated < n_samples:
-            # generate uniform random number between 0 and n_slices-1
-            rand_slice_idx = np.random.randint( 0, n_slices, size=1 )[0]
-            if rand_slice_idx not in flagged_slice_indices:
-                flagged_slice_indices.add( rand_slice_idx )
-                n_generated += 1
-        return list( flagged_slice_indices )
+        n_samples = min( policy_params["n_samples"], n_slices )
+        return np.random.choice( n_slices, size=n_samples, replace=False ).tolist()
 
     elif policy_name == "all":
-        n_slices = len(kernel_distance_seq)
         return list( range( n_slices ) )
-    
 
     elif policy_name == "ruptures_binary_segmentation":
-        # Unpack policy
         model = policy_params[ "model" ]
-        #width = policy_params[ "width" ]
-        n_change_points = policy_params[ "n_change_points" ]
-        penalty = policy_params[ "penalty" ]
-        epsilon = policy_params[ "epsilon" ]
-
-        # Get list of distance distributions
-        distance_distribution_seq = []
-        for slice_idx,distance_mat in enumerate( kernel_distance_seq ):
-            distances = get_flat_distances( distance_mat )
-            distance_distribution_seq.append( distances )
-
-        # Get some properties about the distances needed by Ruptures
-        n_distributions = len( distance_distribution_seq )
-        dim = len( distances )
-        all_distances = []
-        for d in distance_distribution_seq:
-            all_distances += d
-        sigma = np.std( all_distances )
-
-        # Make into ndarray for ruptures
-        #signal = np.array( [ np.array(d) for d in distance_distribution_seq ] )
-        signal = np.array( [ np.array(d) for d in distance_distribution_seq ] )
-
-        # Set up model
-        algo = rpt.Binseg( model=model ).fit( signal )
-
-        # Find change-points
-        if n_change_points == "unknown":
-            if penalty == True and epsilon == False:
-                penalty_value = np.log( n_distributions ) * dim * sigma**2 
-                change_points = algo.predict( pen=penalty_value )
-            elif penalty == False and epsilon == True:
-                threshold = 3 * n_distributions * sigma**2
-                change_points = algo.predict( epsilon=threshold )
-            else:
-                raise ValueError("Invalid policy for window-based change-point detection: {}".format(policy_params))
-        else:
-            change_points = algo.predict( n_bkps=n_change_points )
-        
-        flagged_slice_indices = [ cp-1 for cp in change_points ]
-        return flagged_slice_indices
-
+        algo = rpt.Binseg( model=model ).fit( series.get_signal() )
+        return get_change_point_slice_indices( algo, series, policy_params )
 
     elif policy_name == "ruptures_window_based":
-        # Unpack policy
         model = policy_params[ "model" ]
         width = policy_params[ "width" ]
-        n_change_points = policy_params[ "n_change_points" ]
-        penalty = policy_params[ "penalty" ]
-        epsilon = policy_params[ "epsilon" ]
-
-        # Get list of distance distributions
-        distance_distribution_seq = []
-        for slice_idx,distance_mat in enumerate( kernel_distance_seq ):
-            distances = get_flat_distances( distance_mat )
-            distance_distribution_seq.append( distances )
-
-        # Get some properties about the distances needed by Ruptures
-        n_distributions = len( distance_distribution_seq )
-        dim = len( distances )
-        all_distances = []
-        for d in distance_distribution_seq:
-            all_distances += d
-        sigma = np.std( all_distances )
-
-        # Make into ndarray for ruptures
-        signal = np.array( [ np.array(d) for d in distance_distribution_seq ] )
-
-        # Set up model
-        algo = rpt.Window( width=width, model=model ).fit( signal )
-
-        # Find change-points
-        if n_change_points == "unknown":
-            if penalty == True and epsilon == False:
-                penalty_value = np.log( n_distributions ) * dim * sigma**2 
-                change_points = algo.predict( pen=penalty_value )
-            elif penalty == False and epsilon == True:
-                threshold = 3 * n_distributions * sigma**2
-                change_points = algo.predict( epsilon=threshold )
-            else:
-                raise ValueError("Invalid policy for window-based change-point detection: {}".format(policy_params))
-        else:
-            change_points = algo.predict( n_bkps=n_change_points )
-        
-        flagged_slice_indices = [ cp-1 for cp in change_points ]
-        return flagged_slice_indices
-    
-
+        algo = rpt.Window( width=width, model=model ).fit( series.get_signal() )
+        return get_change_point_slice_indices( algo, series, policy_params )
 
     else:
         raise NotImplementedError("Anomaly detection policy: {} is not implemented".format(policy_name))
     
 
+"""
+Returns a key for each policy: its name, suffixed with its position in the 
+policy file if several policies share that name
+"""
+def get_policy_keys( policies ):
+    names = [ policy["name"] for policy in policies ]
+    return [ name if names.count( name ) == 1 else "{}_{}".format( name, idx )
+             for idx,name in enumerate( names ) ]
+
+# Change-point fits dominate a sweep's run time, so they are started first
+_expensive_policies = [ "ruptures_binary_segmentation", "ruptures_window_based" ]
+
+# Kernel distance time series of the sweep, set before the worker pool is 
+# forked so that workers share them read-only rather than receiving copies
+_kernel_to_series = None
+
+def _detect_anomalies_task( task ):
+    kernel_key, policy_key, policy = task
+    return kernel_key, policy_key, detect_anomalies( _kernel_to_series[ kernel_key ], policy )
+
+"""
+Runs every policy on every kernel's distance time series, spread over a pool of
+n_workers processes (or in this process, if n_workers is 1). Returns a dict 
+mapping ( kernel key, policy key ) to flagged slice indices.
+"""
+def sweep_anomaly_detection( kernel_to_series, policies, n_workers=None ):
+    global _kernel_to_series
+    policy_keys = get_policy_keys( policies )
+    tasks = [ ( kernel_key, policy_key, policy ) 
+              for kernel_key in kernel_to_series 
+              for policy_key, policy in zip( policy_keys, policies ) ]
+    tasks.sort( key=lambda t: t[2]["name"] not in _expensive_policies )
+    # Per-slice medians and sorted distances are shared by several policies, 
+    # so they are computed once here rather than in every worker
+    uses_ks = any( policy["name"] == "kolmogorov_smirnov" for policy in policies )
+    for series in kernel_to_series.values():
+        series.medians()
+        if uses_ks:
+            series.sorted_distributions()
+
+    _kernel_to_series = kernel_to_series
+    try:
+        if n_workers is None:
+            n_workers = psutil.cpu_count( logical=True )
+        n_workers = min( n_workers, len( tasks ) )
+        if n_workers <= 1:
+            results = [ _detect_anomalies_task( t ) for t in tasks ]
+        else:
+            with mp.get_context( "fork" ).Pool( n_workers ) as pool:
+                results = list( pool.imap_unordered( _detect_anomalies_task, tasks ) )
+    finally:
+        _kernel_to_series = None
+    return { ( kernel_key, policy_key ) : flagged for kernel_key, policy_key, flagged in results }
+
+"""
+Writes the sweep's results as a CSV table with one row per kernel and policy
+"""
+def write_sweep_table( kernel_policy_to_flagged, output_path ):
+    with open( output_path, "w", newline="" ) as outfile:
+        writer = csv.writer( outfile )
+        writer.writerow( [ "kernel", "label", "n_iters", "policy", "n_flagged", "flagged_slices" ] )
+        for ( kernel_key, policy_key ), flagged in sorted( kernel_policy_to_flagged.items(), key=str ):
+            n_iters = kernel_key[2] if len( kernel_key ) > 2 else ""
+            writer.writerow( [ kernel_key[0], kernel_key[1], n_iters, policy_key, 
+                               len( flagged ), " ".join( str( idx ) for idx in sorted( flagged ) ) ] )
+
 @timer
-def main( kernel_distance_data_path, policy_file_path, output_path ):
+def main( kernel_distance_data_path, policy_file_path, output_path, chosen_kernel=None, n_workers=None ):
     # Read in kernel distance time series data
-    with open( kernel_distance_data_path, "rb" ) as infile:
-        slice_idx_to_data = pickle.load( infile )
+    slice_idx_to_data = load_kdts( kernel_distance_data_path )
 
     # Read in anomaly detection policies
     with open( policy_file_path, "r" ) as infile:
         anomaly_detection_policies = json.load( infile )
-
-    # Choose a kernel
-    chosen_kernel = ( "wlst", "logical_time", 40 )
-
-    # Filter down to a kernel distance time series w/r/t that kernel
-    kernel_distances_seq = []
-    for idx,kvp in enumerate( sorted(slice_idx_to_data.items()) ):
-        slice_idx,data = kvp
-        kernel_distances_seq.append( data["kernel_distance"][chosen_kernel] )
-
-    # Do a pass over the kernel distance time series for each policy
-    # For right now, we do an independent pass over the kernel distance data
-    # for each anomaly detection policy 
-    policy_to_flagged_slice_indices = {}
-    for policy in anomaly_detection_policies["policies"]:
-        flagged_indices = detect_anomalies( kernel_distances_seq, policy )
-        policy_key = policy["name"]
-        policy_to_flagged_slice_indices[ policy_key ] = flagged_indices
+    policies = anomaly_detection_policies["policies"]
+
+    # Stack each kernel's distance time series into a single array that every
+    # policy works on. The per-slice matrices are no longer needed afterwards.
+    slice_data_seq = [ data for _,data in sorted( slice_idx_to_data.items() ) ]
+    del slice_idx_to_data
+    kernel_keys = sorted( slice_data_seq[0]["kernel_distance"].keys(), key=str ) if len( slice_data_seq ) > 0 else []
+    kernel_to_series = {}
+    for kernel_key in kernel_keys:
+        kernel_to_series[ kernel_key ] = kernel_distance_series.from_distance_matrices( 
+            data["kernel_distance"][ kernel_key ] for data in slice_data_seq )
+    del slice_data_seq
+
+    # Choose the kernel whose results are written in the per-policy format 
+    # that downstream analyses read
+    if chosen_kernel is None:
+        default_kernel = ( "wlst", "logical_time", 40 )
+        chosen_kernel = default_kernel if default_kernel in kernel_to_series else kernel_keys[0]
+    elif chosen_kernel not in kernel_to_series:
+        raise ValueError("Kernel: {} not in kernel distance data".format( chosen_kernel ))
+
+    # Run each policy on each kernel's distance time series
+    kernel_policy_to_flagged = sweep_anomaly_detection( kernel_to_series, policies, n_workers )
+    policy_to_flagged_slice_indices = { policy_key : kernel_policy_to_flagged[ ( chosen_kernel, policy_key ) ]
+                                        for policy_key in get_policy_keys( policies ) }
 
     pprint.pprint( policy_to_flagged_slice_indices )
     #exit()
@@ -280,9 +399,24 @@ def main( kernel_distance_data_path, policy_file_path, output_path ):
         else:
             output_path = kdts_path + "/" + output_path 
     
-    # Write output
+    # Write output. Results for all kernels are written alongside, both as a
+    # pickled dict and as a table.
     with open( output_path, "wb" ) as outfile:
         pickle.dump( policy_to_flagged_slice_indices, outfile, pickle.HIGHEST_PROTOCOL )
+    stem = os.path.splitext( output_path )[0]
+    with open( stem + "_all_kernels.pkl", "wb" ) as outfile:
+        pickle.dump( kernel_policy_to_flagged, outfile, pickle.HIGHEST_PROTOCOL )
+    write_sweep_table( kernel_policy_to_flagged, stem + "_all_kernels.csv" )
+
+"""
+Parses a kernel key given on the command line, e.g., wlst logical_time 2
+"""
+def parse_kernel_key( kernel ):
+    if kernel is None:
+        return None
+    if len( kernel ) == 3:
+        return ( kernel[0], kernel[1], int( kernel[2] ) )
+    return tuple( kernel )
 
 if __name__ == "__main__":
     desc = "Performs anomaly detection on a time series of kernel distance data"
@@ -293,9 +427,15 @@ if __name__ == "__main__":
                         help="JSON file containing description of anomaly detection algorithms to run")
     parser.add_argument("-o", "--output_path", default=None,
                         action="store", type=str, required=False,
-                        help="Path to write anomaly detection results to. Optional.")
+                        help="Path to write anomaly detection results to. Every policy is run on every kernel in the data; the results for all kernels are also written to <path stem>_all_kernels.pkl and <path stem>_all_kernels.csv. Optional.")
+    parser.add_argument("-k", "--kernel", nargs="+", default=None, required=False,
+                        help="Kernel whose results are written to the output path, e.g., wlst logical_time 2. Optional. Default: wlst logical_time 40 if computed, else the first kernel")
+    parser.add_argument("-n", "--n_workers", type=int, default=None, required=False,
+                        help="Number of processes the kernel and policy combinations are spread over. Optional. Default: one per CPU")
     args = parser.parse_args()
 
     main( args.kernel_distance_data, 
           args.anomaly_detection_policies, 
-          args.output_path )
+          args.output_path,
+          parse_kernel_key( args.kernel ),
+          args.n_workers )
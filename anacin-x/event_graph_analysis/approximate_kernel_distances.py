@@ -0,0 +1,142 @@
+import numpy as np
+import scipy.sparse
+
+from graph_kernel_postprocessing import ( convert_to_distance_matrix,
+                                          flatten_distance_matrix,
+                                          sampled_distances
+                                        )
+
+"""
+Approximate kernel distances for large numbers of runs.
+
+Exact kernel distances form a dense n x n matrix per slice and kernel, which
+does not scale to thousands of runs. All kernels computed here (WL subtree,
+vertex and edge histogram) have explicit sparse feature matrices X whose Gram
+matrix is the kernel matrix, so the kernel distance between two graphs is the
+Euclidean distance between their rows of X. In approximate mode, X is embedded
+into a fixed number of dimensions, either by hashing its columns with random
+signs into buckets (a count sketch, which preserves inner products in
+expectation) or by projecting onto the span of a random set of landmark graphs
+(Nystrom). Only the distances of a random sample of pairs are then computed,
+which is all that the summaries used downstream (medians, quantiles, and
+per-slice distance distributions) need.
+
+Two kinds of error are reported. The quantiles of the sampled distances come
+with distribution-free confidence bounds from order statistics. The error of
+the embedding itself is measured against exact distances among a random sample
+of graphs.
+"""
+
+default_approximation = { "method"             : "hash",
+                          "dim"                : 256,
+                          "n_distance_samples" : 10000,
+                          "error_sample_size"  : 50,
+                          "seed"               : 0 }
+
+default_quantile_levels = [ 0.05, 0.25, 0.5, 0.75, 0.95 ]
+
+"""
+Embeds the rows of X by hashing each column into one of dim buckets with a
+random sign
+"""
+def get_hashed_embedding( X, dim, rng ):
+    n_cols = X.shape[1]
+    buckets = rng.integers( 0, dim, size=n_cols )
+    signs = rng.choice( [ -1.0, 1.0 ], size=n_cols )
+    R = scipy.sparse.csr_matrix( ( signs, ( np.arange( n_cols ), buckets ) ), shape=( n_cols, dim ) )
+    return np.asarray( ( X @ R ).todense() )
+
+"""
+Embeds the rows of X via the Nystrom method with up to n_landmarks randomly
+chosen rows as landmarks
+"""
+def get_nystrom_embedding( X, n_landmarks, rng, rtol=1e-10 ):
+    n_rows = X.shape[0]
+    landmarks = np.sort( rng.choice( n_rows, size=min( n_landmarks, n_rows ), replace=False ) )
+    K_nm = np.asarray( ( X @ X[ landmarks ].T ).todense(), dtype=np.float64 )
+    eigvals, eigvecs = np.linalg.eigh( K_nm[ landmarks ] )
+    keep = eigvals > rtol * max( eigvals.max(), 0.0 ) if len( eigvals ) > 0 else eigvals > 0
+    return K_nm @ ( eigvecs[:,keep] / np.sqrt( eigvals[ keep ] ) )
+
+def get_embedding( X, approximation, rng ):
+    method = approximation["method"]
+    if method == "hash":
+        return get_hashed_embedding( X, approximation["dim"], rng )
+    elif method == "nystrom":
+        return get_nystrom_embedding( X, approximation["dim"], rng )
+    else:
+        raise NotImplementedError("Approximation method: {} not supported".format(method))
+
+"""
+Chooses the pairs of graphs whose distances are computed. If there are no more
+pairs than requested samples, all pairs are used, in the order of
+flatten_distance_matrix. Otherwise, pairs are sampled uniformly with
+replacement. Returns ( rows, cols ) with rows > cols.
+"""
+def sample_pairs( n_graphs, n_samples, rng ):
+    if n_graphs * ( n_graphs - 1 ) // 2 <= n_samples:
+        return np.tril_indices( n_graphs, k=-1 )
+    rows = rng.integers( 0, n_graphs, size=n_samples )
+    # Sampling the offset from [1, n) ensures the two graphs differ
+    cols = ( rows + rng.integers( 1, n_graphs, size=n_samples ) ) % n_graphs
+    return np.maximum( rows, cols ), np.minimum( rows, cols )
+
+def get_embedded_distances( E, rows, cols ):
+    return np.sqrt( np.square( E[ rows ] - E[ cols ] ).sum( axis=1 ) )
+
+"""
+Estimates the requested quantiles of the distances, each with a
+distribution-free confidence interval given by the order statistics around it
+"""
+def get_quantiles( distances, levels, z=1.96 ):
+    n = len( distances )
+    if n == 0:
+        nan = np.full( len( levels ), np.nan )
+        return nan, np.column_stack( ( nan, nan ) )
+    levels = np.asarray( levels, dtype=np.float64 )
+    sorted_distances = np.sort( distances )
+    quantiles = np.quantile( sorted_distances, levels )
+    spread = z * np.sqrt( n * levels * ( 1 - levels ) )
+    lower = np.clip( np.floor( n * levels - spread ).astype( np.int64 ), 0, n-1 )
+    upper = np.clip( np.ceil( n * levels + spread ).astype( np.int64 ), 0, n-1 )
+    return quantiles, np.column_stack( ( sorted_distances[ lower ], sorted_distances[ upper ] ) )
+
+"""
+Measures the embedding's error against the exact kernel distances among a
+random sample of graphs
+"""
+def estimate_embedding_error( X, E, sample_size, rng ):
+    n_graphs = X.shape[0]
+    sample = np.sort( rng.choice( n_graphs, size=min( sample_size, n_graphs ), replace=False ) )
+    X_s = X[ sample ]
+    exact = flatten_distance_matrix( convert_to_distance_matrix( ( X_s @ X_s.T ).todense() ) )
+    rows, cols = np.tril_indices( len( sample ), k=-1 )
+    approx = get_embedded_distances( E[ sample ], rows, cols )
+    if len( exact ) == 0:
+        return { "n_graphs" : len( sample ), "n_pairs" : 0 }
+    abs_errors = np.abs( approx - exact )
+    exact_median = np.median( exact )
+    median_error = abs( np.median( approx ) - exact_median )
+    return { "n_graphs"              : len( sample ),
+             "n_pairs"               : len( exact ),
+             "max_abs_error"         : float( np.nanmax( abs_errors ) ),
+             "mean_abs_error"        : float( np.nanmean( abs_errors ) ),
+             "median_error"          : float( median_error ),
+             "relative_median_error" : float( median_error / exact_median ) if exact_median > 0 else 0.0 }
+
+"""
+Computes the approximate distance summary of the graphs whose explicit kernel
+features are the rows of X
+"""
+def compute_sampled_distances( X, approximation, quantile_levels=default_quantile_levels ):
+    approximation = dict( default_approximation, **approximation )
+    rng = np.random.default_rng( approximation["seed"] )
+    X = scipy.sparse.csr_matrix( X, dtype=np.float64 )
+    n_graphs = X.shape[0]
+    E = get_embedding( X, approximation, rng )
+    rows, cols = sample_pairs( n_graphs, approximation["n_distance_samples"], rng )
+    distances = get_embedded_distances( E, rows, cols )
+    quantiles, quantile_bounds = get_quantiles( distances, quantile_levels )
+    error = estimate_embedding_error( X, E, approximation["error_sample_size"], rng )
+    return sampled_distances( n_graphs, rows, cols, distances,
+                              list( quantile_levels ), quantiles, quantile_bounds, error )
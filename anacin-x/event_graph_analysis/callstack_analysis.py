@@ -16,7 +16,8 @@ from elftools.elf.elffile import ELFFile
 # For constructing call tree from set of callstacks
 import igraph
 
-from utilities import timer, read_graphs_parallel, read_graphs_serial, merge_dicts
+from utilities import timer, merge_dicts
+from kdts_store import load_kdts
 
 
 
@@ -184,9 +185,8 @@ def main( flagged_slices_path, kdts_path, executable_path ):
     #pprint.pprint( policy_to_flagged_indices )
 
     # Ingest mapping from slice indices to callstack data
-    with open( kdts_path, "rb" ) as infile:
-        slice_idx_to_data = pickle.load( infile )
-        slice_idx_to_callstacks = { k:v["callstack"] for k,v in slice_idx_to_data.items() }
+    slice_idx_to_data = load_kdts( kdts_path )
+    slice_idx_to_callstacks = { k:v["callstack"] for k,v in slice_idx_to_data.items() }
 
     # Validate executable we'll be querying later
     with open( executable_path, "rb" ) as executable_infile:
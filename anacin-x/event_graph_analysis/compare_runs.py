@@ -7,21 +7,21 @@
 import pprint
 
 import argparse
-import igraph
 import numpy as np
 import pathlib
 import os
 import json
-import glob
 
 import time
 
 from mpi4py import MPI
 comm = MPI.COMM_WORLD
 
-def read_graph( graph_path ):
-    graph = igraph.read( graph_path )
-    return graph
+import sys
+sys.path.append(".")
+sys.path.append("..")
+
+from utilities import read_graph, list_graph_paths, get_slice_path
 
 def assign_slices( n_slices ):
     my_rank = comm.Get_rank()
@@ -32,14 +32,14 @@ def assign_slices( n_slices ):
 
 def main( slice_dir_a, slice_dir_b ):
     my_rank = comm.Get_rank()
-    slices_a = sorted( glob.glob( slice_dir_a + "/*.graphml" ) )
-    slices_b = sorted( glob.glob( slice_dir_b + "/*.graphml" ) )
+    slices_a = list_graph_paths( slice_dir_a )
+    slices_b = list_graph_paths( slice_dir_b )
     assert( len(slices_a) == len(slices_b) )
     my_slices = assign_slices( len( slices_a ) )
     #print("Rank: {} assigned slices: {}".format( my_rank, my_slices ) )
     for idx in my_slices:
-        path_a = slice_dir_a + "/slice_" + str(idx) + ".graphml"
-        path_b = slice_dir_b + "/slice_" + str(idx) + ".graphml"
+        path_a = get_slice_path( slice_dir_a, idx )
+        path_b = get_slice_path( slice_dir_b, idx )
         graph_a = read_graph( path_a )
         graph_b = read_graph( path_b )
         is_iso = graph_a.isomorphic( graph_b )
@@ -12,9 +12,8 @@ import json
 from pathlib import Path
 
 import igraph
-import graphkernels
-import graphkernels.kernels as gk
 import numpy as np
+import scipy.sparse
 
 import grakel
 
@@ -26,26 +25,77 @@ comm = MPI.COMM_WORLD
 import sys
 sys.path.append(".")
 
-from utilities import ( read_graphs_parallel, 
-                        timer, 
-                        read_graph,
-                        merge_dicts
+from utilities import ( timer, 
+                        get_slice_path,
+                        list_graph_paths,
+                        get_vertex_values
                       )
 
-from graph_kernel_preprocessing import ( get_relabeled_graphs,
+from wl_kernel import ( compute_wl_feature_matrices,
+                        get_wl_kernel_matrices_from_features
+                      )
+
+from histogram_kernels import ( get_vertex_label_count_matrix,
+                                get_edge_label_count_matrix,
+                                compute_histogram_kernel_matrix
+                              )
+
+from graph_kernel_preprocessing import ( relabel_graph_set,
+                                         graph_set_topology,
                                          compute_extra_labels
                                        )
 
+from approximate_kernel_distances import ( compute_sampled_distances,
+                                           default_approximation
+                                         )
+
+from incremental_kernel_distances import ( compute_keyed_features,
+                                           stack_keyed_features,
+                                           get_distance_rows
+                                         )
+
 from graph_kernel_postprocessing import ( convert_to_distance_matrix,
                                           validate_kernel_matrix
                                         )
 
+from slice_scheduler import ( schedule_slices,
+                              get_slice_file_costs
+                            )
+
+from graph_kernel_cache import graph_kernel_cache
+
+from parallel_graph_loader import get_graph_loader
+
+from label_vocabulary import ( get_label_vocabulary_path,
+                               get_label_source_paths,
+                               get_vocabulary_labels,
+                               load_label_vocabulary
+                             )
+
+from online_change_detection import ( read_online_detection_policies,
+                                      get_distance_summary,
+                                      ordered_slice_feed,
+                                      print_flag
+                                    )
+
+from kdts_store import ( get_kdts_store_dir,
+                         open_kdts_store,
+                         get_completed_slices,
+                         get_slice_inputs,
+                         write_slice_chunk,
+                         read_slice_chunk,
+                         read_slice_chunk_inputs,
+                         write_slice_features,
+                         read_slice_features,
+                         finalize_kdts_store
+                       )
+
 ################################################################################
 ############################ Utility functions #################################
 ################################################################################
 
 #@timer
-def make_output_path( traces_root_dir, slicing_policy, kernel_params ):
+def make_output_path( traces_root_dir, slicing_policy, kernel_params, approximation=None ):
     output_path = traces_root_dir + "/kernel_distance_time_series_"
     output_path += "SLICING_"
     for idx,kvp in enumerate( sorted(slicing_policy.items()) ):
@@ -61,56 +111,387 @@ def make_output_path( traces_root_dir, slicing_policy, kernel_params ):
             output_path += str(param_val)
         if idx != len(kernel_params)-1:
             output_path += "_"
+    if approximation is not None:
+        output_path += "_APPROX_"
+        output_path += "_".join( str(k) + "_" + str(v) for k,v in sorted( approximation.items() ) )
     output_path += ".pkl"
     return output_path
 
+"""
+Names the output path based on the slicing policy and kernel params unless one
+is provided
+"""
+def get_output_path( traces_root_dir, slicing_policy_path, kernel_params, output_path, approximation=None ):
+    if output_path is None:
+        if slicing_policy_path is not None:
+            with open( slicing_policy_path, "r" ) as infile:
+                slicing_policy = json.load( infile )
+        else:
+            slicing_policy = {}
+        output_path = make_output_path( traces_root_dir, 
+                                        slicing_policy, 
+                                        kernel_params,
+                                        approximation )
+    else:
+        name,ext = os.path.splitext( output_path )
+        if ext != ".pkl":
+            output_path = traces_root_dir + "/" + name + ".pkl"
+        else:
+            output_path = traces_root_dir + "/" + output_path
+    return output_path
+
 
 ################################################################################
 ##################### Graph kernel distance functions ##########################
 ################################################################################
 
-#@timer 
-def compute_kernel_distance_matrices( slice_subgraphs, kernel_params ):
-    # Relabel based on requested graph kernels
-    kernel_label_pair_to_relabeled_graphs = get_relabeled_graphs( slice_subgraphs, kernel_params )
+"""
+Reads a slice's subgraphs (one per run) the first time they are needed, so that
+slices whose results are all cached are never read at all. The subgraphs are
+read as event_graph_arrays objects, which need no conversion after parallel
+parsing. Their topology is likewise built once on first use and shared by all
+relabelings.
+"""
+class lazy_slice_subgraphs(object):
+    def __init__(self, slice_subgraph_paths):
+        self._paths = slice_subgraph_paths
+        self._graphs = None
+        self._topology = None
+
+    def get_topology(self):
+        if self._topology is None:
+            self._topology = graph_set_topology( self.get() )
+        return self._topology
+
+    def get(self):
+        if self._graphs is None:
+            slice_subgraphs = get_graph_loader().load_arrays( self._paths, keep_edge_order=True )
+            # Compute extra labels (e.g., logical time increment)
+            self._graphs = [ compute_extra_labels(g) for g in slice_subgraphs ]
+        return self._graphs
+
+"""
+Determines the key that identifies a kernel's matrix (and distance matrix) 
+"""
+def get_kernel_key( kernel_param ):
+    kernel = kernel_param["name"]
+    params = kernel_param["params"]
+    if kernel == "wlst":
+        return ( kernel, params["label"], params["n_iters"] )
+    elif kernel in [ "eh", "vh" ]:
+        return ( kernel, params["label"] )
+    else:
+        raise NotImplementedError("Kernel: {} not supported".format(kernel))
+
+"""
+Returns the slice's subgraphs relabeled for a kernel / label pair, from the 
+cache if available
+"""
+def get_cached_relabeled_graphs( slice_subgraphs, kernel, label, cache, slice_key, vocabulary=None ):
+    compute_fn = lambda: relabel_graph_set( slice_subgraphs.get(), kernel, label, 
+                                            slice_subgraphs.get_topology(), vocabulary )
+    return cache.get_or_compute( slice_key, "relabeled_graph_set", [ kernel, label ], compute_fn )
+
+"""
+Computes the WL feature matrices for all requested WL kernels, grouped by label
+so that each label's graphs are refined only once up to the largest requested 
+number of iterations. The WL feature matrices are cached, so that a later run 
+requesting no more iterations than were cached skips refinement entirely. 
+Returns a map from labels to the WL feature matrices X_0 ... X_n.
+"""
+def get_wl_feature_matrices( slice_subgraphs, kernel_params, cache, slice_key, vocabulary=None ):
+    label_to_feature_matrices = {}
+    for label, iters in get_wl_label_to_iters( kernel_params ).items():
+        feature_matrices = cache.get( slice_key, "wl_features", [ label ] )
+        if feature_matrices is None or len( feature_matrices ) <= max( iters ):
+            relabeled_graphs = get_cached_relabeled_graphs( slice_subgraphs, "wlst", label, 
+                                                            cache, slice_key, vocabulary )
+            feature_matrices = compute_wl_feature_matrices( relabeled_graphs, max( iters ) )
+            cache.put( slice_key, "wl_features", [ label ], feature_matrices )
+        label_to_feature_matrices[ label ] = feature_matrices
+    return label_to_feature_matrices
 
-    # Actually compute the kernel distance matrices
-    kernel_to_distance_matrix = {}
+def get_wl_label_to_iters( kernel_params ):
+    label_to_iters = {}
     for kp in kernel_params:
+        if kp["name"] == "wlst":
+            label = kp["params"]["label"]
+            label_to_iters.setdefault( label, [] ).append( kp["params"]["n_iters"] )
+    return label_to_iters
+
+"""
+Computes the kernel matrices for all requested WL kernels from their feature 
+matrices (see get_wl_feature_matrices). Returns a map from labels to maps from
+numbers of WL iterations to kernel matrices, and a map from labels to the WL
+feature matrices.
+"""
+def get_wl_kernel_matrices( slice_subgraphs, kernel_params, cache, slice_key, vocabulary=None ):
+    label_to_feature_matrices = get_wl_feature_matrices( slice_subgraphs, kernel_params, 
+                                                         cache, slice_key, vocabulary )
+    label_to_kernel_mats = {}
+    for label, iters in get_wl_label_to_iters( kernel_params ).items():
+        label_to_kernel_mats[ label ] = get_wl_kernel_matrices_from_features( label_to_feature_matrices[ label ], 
+                                                                              iters )
+    return label_to_kernel_mats, label_to_feature_matrices
+
+"""
+Returns the sparse graph x label count matrix that a histogram kernel compares,
+from the cache if available. A vertex-histogram kernel over the same label as a
+WL kernel counts exactly the WL kernel's initial labels, so it reuses the WL 
+feature matrix X_0 if given.
+"""
+def get_histogram_count_matrix( slice_subgraphs, kernel, label, cache, slice_key, 
+                                vocabulary=None, wl_feature_matrices=None ):
+    if kernel == "vh" and wl_feature_matrices is not None:
+        return wl_feature_matrices[0]
+    def compute_fn():
+        relabeled_graphs = get_cached_relabeled_graphs( slice_subgraphs, kernel, label, 
+                                                        cache, slice_key, vocabulary )
+        if kernel == "vh":
+            return get_vertex_label_count_matrix( relabeled_graphs )
+        return get_edge_label_count_matrix( relabeled_graphs )
+    return cache.get_or_compute( slice_key, "label_counts", [ kernel, label ], compute_fn )
+
+"""
+Computes the requested kernel matrices for a slice. Kernel matrices already in
+the cache are reused, so that only kernels not computed by a previous run are
+computed.
+"""
+#@timer 
+def compute_kernel_matrices( slice_subgraphs, kernel_params, cache, slice_key, vocabulary=None ):
+    kernel_to_kernel_matrix = {}
+    missing_kernel_params = []
+    for kp in kernel_params:
+        key = get_kernel_key( kp )
+        kernel_mat = cache.get( slice_key, "kernel_matrix", key )
+        if kernel_mat is None:
+            missing_kernel_params.append( kp )
+        else:
+            kernel_to_kernel_matrix[ key ] = kernel_mat
+
+    # Compute all requested WL iteration counts for the same label in a single
+    # refinement pass
+    wl_label_to_kernel_mats, wl_label_to_features = get_wl_kernel_matrices( slice_subgraphs, 
+                                                                            missing_kernel_params,
+                                                                            cache, slice_key, 
+                                                                            vocabulary )
+
+    # Actually compute the kernel matrices
+    for kp in missing_kernel_params:
         kernel = kp["name"]
         params = kp["params"]
+        key = get_kernel_key( kp )
         # Compute Weisfeiler-Lehman subtree pattern kernel
         if kernel == "wlst":
-            n_iters = params["n_iters"]
-            label   = params["label"]
-            kernel_label_pair = ( kernel, label )
-            relabeled_graphs = kernel_label_pair_to_relabeled_graphs[ kernel_label_pair ]
-            kernel_mat = gk.CalculateWLKernel( relabeled_graphs, n_iters )
-            distance_mat = convert_to_distance_matrix( kernel_mat )
-            kernel_params_key = ( kernel, label, n_iters )
-            kernel_to_distance_matrix[ kernel_params_key ] = distance_mat
-        # Compute edge-histogram kernel
-        elif kernel == "eh":
-            label = params["label"]
-            kernel_label_pair = ( kernel, label )
-            relabeled_graphs = kernel_label_pair_to_relabeled_graphs[ kernel_label_pair ]
-            kernel_mat = gk.CalculateEdgeHistKernel( relabeled_graphs )
-            distance_mat = convert_to_distance_matrix( kernel_mat )
-            kernel_key = ( kernel, label )
-            kernel_to_distance_matrix[ kernel_key ] = distance_mat
-        # Compute vertex-histogram kernel
-        elif kernel == "vh":
-            label = params["label"]
-            key = (kernel, label)
-            relabeled_graphs = kernel_label_pair_to_relabeled_graphs[ key ]
-            kernel_mat = gk.CalculateVertexHistKernel( relabeled_graphs )
-            distance_mat = convert_to_distance_matrix( kernel_mat )
-            kernel_to_distance_matrix[ key ] = distance_mat
+            kernel_mat = wl_label_to_kernel_mats[ params["label"] ][ params["n_iters"] ]
+        # Compute edge- or vertex-histogram kernel as the Gram matrix of the
+        # slice's label count matrix
+        elif kernel in [ "eh", "vh" ]:
+            count_mat = get_histogram_count_matrix( slice_subgraphs, kernel, params["label"], 
+                                                    cache, slice_key, vocabulary,
+                                                    wl_label_to_features.get( params["label"] ) )
+            kernel_mat = compute_histogram_kernel_matrix( count_mat )
+        cache.put( slice_key, "kernel_matrix", key, kernel_mat )
+        kernel_to_kernel_matrix[ key ] = kernel_mat
+    return kernel_to_kernel_matrix
+
+"""
+Computes approximate kernel distance summaries for a slice in place of full
+distance matrices (see approximate_kernel_distances). Each kernel's explicit 
+feature matrix is embedded and only a sample of pairwise distances computed.
+Summaries are cached per kernel and approximation parameters.
+"""
+def compute_approximate_kernel_distances( slice_subgraphs, kernel_params, cache, slice_key, 
+                                          approximation, vocabulary=None ):
+    kernel_to_distances = {}
+    missing_kernel_params = []
+    for kp in kernel_params:
+        key = get_kernel_key( kp )
+        distances = cache.get( slice_key, "sampled_distances", [ key, approximation ] )
+        if distances is None:
+            missing_kernel_params.append( kp )
+        else:
+            kernel_to_distances[ key ] = distances
+
+    wl_label_to_features = get_wl_feature_matrices( slice_subgraphs, missing_kernel_params,
+                                                    cache, slice_key, vocabulary )
+    for kp in missing_kernel_params:
+        kernel = kp["name"]
+        params = kp["params"]
+        key = get_kernel_key( kp )
+        # The WL kernel with n iterations is the dot product of the 
+        # concatenated features of iterations 0 ... n
+        if kernel == "wlst":
+            feature_mat = scipy.sparse.hstack( wl_label_to_features[ params["label"] ][ :params["n_iters"]+1 ], 
+                                               format="csr" )
+        elif kernel in [ "eh", "vh" ]:
+            feature_mat = get_histogram_count_matrix( slice_subgraphs, kernel, params["label"], 
+                                                      cache, slice_key, vocabulary,
+                                                      wl_label_to_features.get( params["label"] ) )
         else:
             raise NotImplementedError("Kernel: {} not supported".format(kernel))
-    return kernel_to_distance_matrix
+        distances = compute_sampled_distances( feature_mat, approximation )
+        cache.put( slice_key, "sampled_distances", [ key, approximation ], distances )
+        kernel_to_distances[ key ] = distances
+    return kernel_to_distances
+
+#@timer 
+def compute_kernel_distance_matrices( slice_subgraphs, kernel_params, cache, slice_key, 
+                                      vocabulary=None, approximation=None ):
+    if approximation is not None:
+        return compute_approximate_kernel_distances( slice_subgraphs, kernel_params, cache, 
+                                                     slice_key, approximation, vocabulary )
+    kernel_to_kernel_matrix = compute_kernel_matrices( slice_subgraphs, kernel_params, 
+                                                       cache, slice_key, vocabulary )
+    return { key : convert_to_distance_matrix( kernel_mat ) for key,kernel_mat in kernel_to_kernel_matrix.items() }
             
 
+################################################################################
+################ Batched graph kernel distances over slice windows #############
+################################################################################
+
+"""
+Groups slice indices into windows of up to window_size consecutive indices. 
+Each window is processed as one task, so that small slices share a single
+relabeling and feature pass instead of paying per-slice overheads.
+"""
+def get_slice_windows( slice_indices, window_size ):
+    windows = []
+    for slice_idx in sorted( slice_indices ):
+        if len( windows ) > 0 and len( windows[-1] ) < window_size and windows[-1][-1] == slice_idx - 1:
+            windows[-1].append( slice_idx )
+        else:
+            windows.append( [ slice_idx ] )
+    return [ tuple( w ) for w in windows ]
+
+"""
+The subgraphs of several slices treated as one set of graphs, slice after 
+slice, with each slice's graphs (one per run) occupying a contiguous block
+"""
+class slice_window_subgraphs(object):
+    def __init__(self, slice_subgraphs_seq):
+        self._members = slice_subgraphs_seq
+        self._graphs = None
+        self._topology = None
+
+    def get(self):
+        if self._graphs is None:
+            self._graphs = [ g for m in self._members for g in m.get() ]
+        return self._graphs
+
+    def get_topology(self):
+        if self._topology is None:
+            self._topology = graph_set_topology( self.get() )
+        return self._topology
+
+    def get_blocks(self):
+        """
+        Row range of each slice's graphs within the window
+        """
+        blocks = []
+        start = 0
+        for m in self._members:
+            stop = start + len( m.get() )
+            blocks.append( ( start, stop ) )
+            start = stop
+        return blocks
+
+"""
+Computes the requested kernel matrices for every slice of a window with one
+relabeling and one WL or histogram feature pass over all of the window's 
+subgraphs. Since the label dictionaries are shared by the whole window, each
+slice's kernel matrix is the Gram matrix of its own block of feature rows, so
+only the block diagonal of the window's Gram matrix is ever formed. Returns a
+list with one map from kernel keys to kernel matrices per slice.
+"""
+def compute_window_kernel_matrices( window_subgraphs, kernel_params, vocabulary=None ):
+    graphs = window_subgraphs.get()
+    topology = window_subgraphs.get_topology()
+    blocks = window_subgraphs.get_blocks()
+    block_to_kernel_matrices = [ {} for _ in blocks ]
+
+    # One WL refinement pass per label, up to the largest number of iterations
+    label_to_iters = {}
+    for kp in kernel_params:
+        if kp["name"] == "wlst":
+            label_to_iters.setdefault( kp["params"]["label"], [] ).append( kp["params"]["n_iters"] )
+    label_to_wl_features = {}
+    for label, iters in label_to_iters.items():
+        relabeled_graphs = relabel_graph_set( graphs, "wlst", label, topology, vocabulary )
+        feature_matrices = compute_wl_feature_matrices( relabeled_graphs, max( iters ) )
+        label_to_wl_features[ label ] = feature_matrices
+        for b, ( start, stop ) in enumerate( blocks ):
+            block_features = [ X[ start:stop ] for X in feature_matrices ]
+            n_iters_to_kernel_mat = get_wl_kernel_matrices_from_features( block_features, iters )
+            for n_iters in iters:
+                block_to_kernel_matrices[b][ ( "wlst", label, n_iters ) ] = n_iters_to_kernel_mat[ n_iters ]
+
+    # One count matrix per histogram kernel / label pair
+    for kp in kernel_params:
+        kernel = kp["name"]
+        if kernel not in [ "eh", "vh" ]:
+            continue
+        label = kp["params"]["label"]
+        if kernel == "vh" and label in label_to_wl_features:
+            count_mat = label_to_wl_features[ label ][0]
+        else:
+            relabeled_graphs = relabel_graph_set( graphs, kernel, label, topology, vocabulary )
+            if kernel == "vh":
+                count_mat = get_vertex_label_count_matrix( relabeled_graphs )
+            else:
+                count_mat = get_edge_label_count_matrix( relabeled_graphs )
+        for b, ( start, stop ) in enumerate( blocks ):
+            block_to_kernel_matrices[b][ ( kernel, label ) ] = compute_histogram_kernel_matrix( count_mat[ start:stop ] )
+    return block_to_kernel_matrices
+
+#@timer
+def get_window_slice_data( slice_dirs, window, kernel_params, callstacks_available, cache, vocabulary=None ):
+    print("Ingesting subgraphs for slices: {}-{}".format( window[0], window[-1] ))
+    slice_idx_to_subgraphs = {}
+    slice_idx_to_key = {}
+    slice_idx_to_kernel_matrices = {}
+    for slice_idx in window:
+        slice_subgraph_paths = [ get_slice_path( sd, slice_idx ) for sd in slice_dirs ]
+        slice_idx_to_subgraphs[ slice_idx ] = lazy_slice_subgraphs( slice_subgraph_paths )
+        slice_idx_to_key[ slice_idx ] = cache.get_slice_key( slice_subgraph_paths )
+        # Reuse kernel matrices of slices that are entirely cached
+        kernel_mats = { get_kernel_key( kp ) : cache.get( slice_idx_to_key[ slice_idx ], 
+                                                          "kernel_matrix", 
+                                                          get_kernel_key( kp ) ) 
+                        for kp in kernel_params }
+        if all( mat is not None for mat in kernel_mats.values() ):
+            slice_idx_to_kernel_matrices[ slice_idx ] = kernel_mats
+
+    # Compute the kernel matrices of all other slices in one batch
+    uncached_indices = [ idx for idx in window if idx not in slice_idx_to_kernel_matrices ]
+    if len( uncached_indices ) > 0:
+        print("Computing kernel distances for slices: {}".format( uncached_indices ))
+        window_subgraphs = slice_window_subgraphs( [ slice_idx_to_subgraphs[ idx ] for idx in uncached_indices ] )
+        block_to_kernel_matrices = compute_window_kernel_matrices( window_subgraphs, kernel_params, vocabulary )
+        for slice_idx, kernel_mats in zip( uncached_indices, block_to_kernel_matrices ):
+            for key, kernel_mat in kernel_mats.items():
+                cache.put( slice_idx_to_key[ slice_idx ], "kernel_matrix", key, kernel_mat )
+            slice_idx_to_kernel_matrices[ slice_idx ] = kernel_mats
+
+    slice_idx_to_data = {}
+    for slice_idx in window:
+        slice_subgraphs = slice_idx_to_subgraphs[ slice_idx ]
+        slice_key = slice_idx_to_key[ slice_idx ]
+        kernel_distance_data = { key : convert_to_distance_matrix( kernel_mat ) 
+                                 for key,kernel_mat in slice_idx_to_kernel_matrices[ slice_idx ].items() }
+        wall_time_data = cache.get_or_compute( slice_key, "wall_time", None,
+                                               lambda: extract_wall_time_data( slice_subgraphs.get() ) )
+        if callstacks_available:
+            callstack_data = cache.get_or_compute( slice_key, "callstack", None,
+                                                   lambda: extract_callstack_data( slice_subgraphs.get() ) )
+        else:
+            callstack_data = {}
+        slice_idx_to_data[ slice_idx ] = { "kernel_distance" : kernel_distance_data,
+                                           "wall_time"       : wall_time_data,
+                                           "callstack"       : callstack_data }
+    return slice_idx_to_data
+
+
 ################################################################################
 ####################### Slice data extraction functions ########################
 ################################################################################
@@ -119,7 +500,7 @@ def compute_kernel_distance_matrices( slice_subgraphs, kernel_params ):
 def extract_wall_time_data( slice_subgraphs ):
     graph_to_wall_time_data = {}
     for idx,g in enumerate(slice_subgraphs):
-        wall_times = [ float(wt) for wt in g.vs[:]["wall_time"] ]
+        wall_times = [ float(wt) for wt in get_vertex_values( g, "wall_time" ) ]
         time_stats = {}
         time_stats["median_wall_time"] = np.median( wall_times )
         time_stats["mean_wall_time"] = np.mean( wall_times )
@@ -133,8 +514,8 @@ def extract_callstack_data( slice_subgraphs ):
     graph_to_callstack_data = {}
     for idx,g in enumerate(slice_subgraphs):
         callstack_to_count = {}
-        callstacks = g.vs[:]["callstack"]
-        mpi_fns = g.vs[:]["mpi_function"]
+        callstacks = get_vertex_values( g, "callstack" )
+        mpi_fns = get_vertex_values( g, "mpi_function" )
         for c,f in zip(callstacks, mpi_fns):
             if c != "":
                 key = (c,f)
@@ -146,28 +527,32 @@ def extract_callstack_data( slice_subgraphs ):
     return graph_to_callstack_data
 
 #@timer
-def get_slice_data( slice_dirs, slice_idx, kernel_params, callstacks_available ):
+def get_slice_data( slice_dirs, slice_idx, kernel_params, callstacks_available, cache, 
+                    vocabulary=None, approximation=None ):
     print("Ingesting subgraphs for slice: {}".format( slice_idx ))
-    slice_subgraph_paths = [ str(sd) + "/slice_" + str(slice_idx) + ".graphml" for sd in slice_dirs ]
-    #slice_subgraphs = read_graphs_parallel( slice_subgraph_paths )
-    slice_subgraphs = [ read_graph(g) for g in slice_subgraph_paths ]
-   
-    # Compute extra labels (e.g., logical time increment)
-    slice_subgraphs = [ compute_extra_labels(g) for g in slice_subgraphs ]
+    slice_subgraph_paths = [ get_slice_path( sd, slice_idx ) for sd in slice_dirs ]
+    slice_subgraphs = lazy_slice_subgraphs( slice_subgraph_paths )
+    slice_key = cache.get_slice_key( slice_subgraph_paths )
 
     # Compute the requested kernel distance matrices
     print("Computing kernel distances for slice: {}".format( slice_idx ))
     kernel_distance_data = compute_kernel_distance_matrices( slice_subgraphs, 
-                                                             kernel_params )
+                                                             kernel_params,
+                                                             cache,
+                                                             slice_key,
+                                                             vocabulary,
+                                                             approximation )
     
     # Extract wall-time information for correlating with application events
     print("Extracting wall-time data for slice: {}".format( slice_idx ))
-    wall_time_data = extract_wall_time_data( slice_subgraphs )
+    wall_time_data = cache.get_or_compute( slice_key, "wall_time", None,
+                                           lambda: extract_wall_time_data( slice_subgraphs.get() ) )
     
     # Extract callstack data if available
     if callstacks_available:
         print("Extracting callstack data for slice: {}".format( slice_idx ))
-        callstack_data = extract_callstack_data( slice_subgraphs )
+        callstack_data = cache.get_or_compute( slice_key, "callstack", None,
+                                               lambda: extract_callstack_data( slice_subgraphs.get() ) )
     else:
         callstack_data = {}
     
@@ -182,6 +567,93 @@ def get_slice_data( slice_dirs, slice_idx, kernel_params, callstacks_available )
 
     return slice_data
 
+"""
+Adds the runs that a slice's chunk in the store does not cover yet (see
+incremental_kernel_distances). Only the new runs' subgraphs are read, and only
+the distances between the new runs and all runs are computed; the distances
+between runs already in the store are kept. Rows for new runs are appended in
+the order of slice_dirs, so a grown chunk's rows follow the order in which runs
+were added, as recorded in the slice's features file. Chunks without features
+(e.g., computed without --incremental), and chunks whose runs' slices changed
+since they were computed, are recomputed from scratch. Returns the updated 
+slice data and the inputs it was computed from (see kdts_store.get_slice_inputs),
+or None, None if the chunk is current and already covers all runs.
+"""
+def update_slice_data( slice_dirs, slice_idx, kernel_params, callstacks_available, store_dir, 
+                       vocabulary=None, slicing_policy=None ):
+    stored = read_slice_features( store_dir, slice_idx )
+    slice_data = read_slice_chunk( store_dir, slice_idx ) if stored is not None else None
+    # A chunk that does not match its features was left behind by an
+    # interrupted update, so it cannot be extended
+    if slice_data is not None:
+        n_rows = [ len( d ) for d in slice_data["kernel_distance"].values() ]
+        if any( n != len( stored["runs"] ) for n in n_rows ):
+            stored, slice_data = None, None
+    # Nor can a chunk whose runs' slices were regenerated or sliced differently
+    if stored is not None and not is_chunk_current( stored["runs"], slice_idx, 
+                                                    read_slice_chunk_inputs( store_dir, slice_idx ), 
+                                                    slicing_policy ):
+        print("Slice: {} changed since it was stored, recomputing".format( slice_idx ))
+        stored, slice_data = None, None
+    old_runs = stored["runs"] if stored is not None else []
+    known_runs = set( old_runs )
+    new_slice_dirs = [ sd for sd in slice_dirs if str( sd ) not in known_runs ]
+    if len( new_slice_dirs ) == 0:
+        print("Slice: {} already covers all requested runs".format( slice_idx ))
+        return None, None
+    inputs = get_slice_inputs( old_runs + new_slice_dirs, slice_idx, slicing_policy )
+
+    print("Ingesting subgraphs of {} new runs for slice: {}".format( len( new_slice_dirs ), slice_idx ))
+    slice_subgraphs = lazy_slice_subgraphs( [ get_slice_path( sd, slice_idx ) for sd in new_slice_dirs ] )
+    print("Computing kernel features of new runs for slice: {}".format( slice_idx ))
+    features = compute_keyed_features( slice_subgraphs.get(), kernel_params, vocabulary )
+    if stored is not None:
+        features = stack_keyed_features( stored["features"], features )
+
+    # Grow each distance matrix by the new runs' rows and columns
+    print("Computing kernel distances of new runs for slice: {}".format( slice_idx ))
+    n_old = len( old_runs )
+    n_runs = n_old + len( new_slice_dirs )
+    kernel_distance_data = {}
+    for kp in kernel_params:
+        key = get_kernel_key( kp )
+        dist_mat = np.zeros( ( n_runs, n_runs ), dtype=np.float64 )
+        if slice_data is not None:
+            dist_mat[ :n_old, :n_old ] = slice_data["kernel_distance"][ key ]
+        dist_mat[ n_old:, : ] = get_distance_rows( features, key, n_old )
+        dist_mat[ :, n_old: ] = dist_mat[ n_old:, : ].T
+        kernel_distance_data[ key ] = dist_mat
+
+    # Per-run data is keyed by row, so the new runs' data is shifted past the 
+    # old runs'
+    wall_time_data = dict( slice_data["wall_time"] ) if slice_data is not None else {}
+    for idx, stats in extract_wall_time_data( slice_subgraphs.get() ).items():
+        wall_time_data[ n_old + idx ] = stats
+    callstack_data = dict( slice_data["callstack"] ) if slice_data is not None else {}
+    if callstacks_available:
+        for idx, counts in extract_callstack_data( slice_subgraphs.get() ).items():
+            callstack_data[ n_old + idx ] = counts
+
+    # Features are written first: if the chunk write is interrupted, the 
+    # mismatch is detected on the next update
+    runs = old_runs + [ str( sd ) for sd in new_slice_dirs ]
+    write_slice_features( store_dir, slice_idx, runs, features )
+    slice_data = { "kernel_distance" : kernel_distance_data,
+                   "wall_time"       : wall_time_data,
+                   "callstack"       : callstack_data }
+    return slice_data, inputs
+
+"""
+Determines whether a slice's chunk in the store, with the given recorded inputs
+(see kdts_store.get_slice_inputs), was computed from the current slices of the
+runs in slice_dirs, in that order, under the same slicing policy. Chunks that do
+not record their inputs are never current.
+"""
+def is_chunk_current( slice_dirs, slice_idx, chunk_inputs, slicing_policy ):
+    if chunk_inputs is None:
+        return False
+    return chunk_inputs == get_slice_inputs( slice_dirs, slice_idx, slicing_policy )
+
 
 
 ################################################################################
@@ -189,21 +661,17 @@ def get_slice_data( slice_dirs, slice_idx, kernel_params, callstacks_available )
 ################################################################################
 
 """
-Determines which slice indices each MPI process is responsible for via
-round-robin assignment
+Determines which slice indices are requested. The slices themselves are handed
+out to MPI processes on demand by the slice scheduler.
 """
-def assign_slice_indices( n_slices, slices, slice_range_lower, slice_range_upper ):
-    rank = comm.Get_rank()
-    n_procs = comm.Get_size()
+def get_requested_slice_indices( n_slices, slices, slice_range_lower, slice_range_upper ):
     if slices is not None:
         requested_slices = slices
     elif slices is None and slice_range_lower is not None and slice_range_upper is not None:
         requested_slices = range(slice_range_lower, slice_range_upper )
     else:
         requested_slices = range( n_slices )
-    indices = list(filter(lambda x : x % n_procs == rank, range(len(requested_slices))))
-    indices = [ requested_slices[idx] for idx in indices ]
-    return indices
+    return list( requested_slices )
 
 ################################################################################
 ############### Functions for ingesting and validating inputs ##################
@@ -217,7 +685,7 @@ def validate_slice_dirs( slice_dirs ):
     for sd in slice_dirs:
         assert( os.path.isdir(str(sd)) )
         assert( sd.is_dir() )
-        slice_counts.add( len(list(sd.glob("*.graphml"))) )
+        slice_counts.add( len( list_graph_paths( sd, "slice_*" ) ) )
     assert( len( slice_counts ) == 1 )
     return list(slice_counts)[0]
 
@@ -304,7 +772,19 @@ def main( traces_root_dir,
           slice_range_lower, 
           slice_range_upper, 
           callstacks_available, 
-          output_path ):
+          output_path,
+          largest_first=False,
+          cache_dir=None,
+          cache_size_gb=10,
+          slice_window=1,
+          approximation=None,
+          incremental=False,
+          loader_workers=1,
+          online_detection=None ):
+    if approximation is not None and slice_window > 1:
+        raise ValueError("Approximate mode does not support slice windows")
+    if incremental and ( approximation is not None or slice_window > 1 ):
+        raise ValueError("Incremental mode does not support approximate mode or slice windows")
     # Get MPI rank
     rank = comm.Get_rank()
     # Ingest inputs on root process
@@ -316,9 +796,43 @@ def main( traces_root_dir,
 
         # Sanity-check the slice directories
         n_slices = validate_slice_dirs( slice_dirs )
-        input_config = { "slice_dirs" : slice_dirs,
-                         "kernels"    : kernels,
-                         "n_slices"   : n_slices }
+
+        # Open the store that per-slice results are written to, and skip any
+        # slices a previous, interrupted run already completed from the same
+        # slices of the same runs
+        if slicing_policy_path is not None:
+            with open( slicing_policy_path, "r" ) as infile:
+                slicing_policy = json.load( infile )
+        else:
+            slicing_policy = None
+        output_path = get_output_path( traces_root_dir, slicing_policy_path, 
+                                       kernels, output_path, approximation )
+        store_dir = open_kdts_store( get_kdts_store_dir( output_path ), kernels, approximation,
+                                     slicing_policy, slice_dirs )
+        completed_indices = [ idx for idx in get_completed_slices( store_dir )
+                              if is_chunk_current( slice_dirs, idx, read_slice_chunk_inputs( store_dir, idx ), 
+                                                   slicing_policy ) ]
+
+        # If requested, monitor one kernel's distances for change points as
+        # slices are computed, by default the first kernel's
+        if online_detection is not None:
+            online_kernel_key, quantile_levels, online_policies = read_online_detection_policies( online_detection )
+            kernel_keys = [ get_kernel_key( kp ) for kp in kernels ]
+            if online_kernel_key is None:
+                online_kernel_key = kernel_keys[0]
+            if online_kernel_key not in kernel_keys:
+                raise ValueError("Kernel: {} monitored by online detection is not computed".format( online_kernel_key ))
+            online_config = { "kernel"    : online_kernel_key,
+                              "quantiles" : quantile_levels }
+        else:
+            online_config = None
+        input_config = { "slice_dirs"        : slice_dirs,
+                         "kernels"           : kernels,
+                         "n_slices"          : n_slices,
+                         "store_dir"         : store_dir,
+                         "slicing_policy"    : slicing_policy,
+                         "completed_indices" : completed_indices,
+                         "online"            : online_config }
     else:
         input_config = None
     # Broadcast from root to all other processes
@@ -327,54 +841,148 @@ def main( traces_root_dir,
     slice_dirs = input_config["slice_dirs"]
     n_slices   = input_config["n_slices"]
     kernels    = input_config["kernels"]
+    store_dir  = input_config["store_dir"]
+    slicing_policy = input_config["slicing_policy"]
+    completed_indices = set( input_config["completed_indices"] )
+    online_config = input_config["online"]
     
-    # Determine slice assignment
-    assigned_indices = assign_slice_indices( n_slices, slices, slice_range_lower, slice_range_upper )
-    print("Rank: {}, Assigned Slices: {}".format( rank, assigned_indices ))
+    # Determine requested slices that still need to be computed and, if 
+    # desired, order them largest-first by the size of their subgraphs on disk
+    requested_indices = get_requested_slice_indices( n_slices, slices, slice_range_lower, slice_range_upper )
+    # In incremental mode, every requested slice is checked for runs it does 
+    # not cover yet
+    if incremental:
+        remaining_indices = requested_indices
+    else:
+        remaining_indices = [ idx for idx in requested_indices if idx not in completed_indices ]
+    if rank == 0:
+        print("Slices requested: {}, already in store: {}, remaining: {}".format( len( requested_indices ), 
+                                                                                len( requested_indices ) - len( remaining_indices ), 
+                                                                                len( remaining_indices ) ))
+
+    # Encode string-valued labels the same way in every run and slice. The
+    # slices this job reads are scanned for values not in the campaign's 
+    # vocabulary yet by all processes.
+    vocabulary = load_label_vocabulary( get_label_vocabulary_path( traces_root_dir ),
+                                        get_label_source_paths( slice_dirs, remaining_indices ) if rank == 0 else None,
+                                        get_vocabulary_labels( kernels ),
+                                        comm )
+
+    if rank == 0 and largest_first:
+        slice_to_cost = get_slice_file_costs( slice_dirs, remaining_indices )
+    else:
+        slice_to_cost = None
+
+    # If requested, group consecutive slices into windows that are each 
+    # computed as one batch
+    if slice_window > 1:
+        windows = get_slice_windows( remaining_indices, slice_window )
+        if slice_to_cost is not None:
+            slice_to_cost = { w : sum( slice_to_cost[ idx ] for idx in w ) for w in windows }
+
+    # Set up this process's graph loader. Each MPI process already works on
+    # its own slices, so by default each reads its graphs itself.
+    get_graph_loader( loader_workers )
+
+    # Open the persistent cache of per-slice intermediates, if requested
+    cache = graph_kernel_cache( cache_dir, int( cache_size_gb * (1<<30) ) )
+
+    # With online detection, each task returns a small summary of the
+    # monitored kernel's distances to the root, which feeds the detectors in
+    # slice order. Requested slices that are not computed in this run are
+    # summarized from the store when it is their turn.
+    def get_online_summary( slice_data ):
+        if online_config is None or slice_data is None:
+            return None
+        return get_distance_summary( slice_data["kernel_distance"][ online_config["kernel"] ], 
+                                     online_config["quantiles"] )
+
+    if rank == 0 and online_config is not None:
+        def read_summary( slice_idx ):
+            return get_online_summary( read_slice_chunk( store_dir, slice_idx ) )
+        feed = ordered_slice_feed( sorted( requested_indices ), online_policies, read_summary, print_flag )
+        feed.skip( set( requested_indices ) - set( remaining_indices ) )
+        if slice_window > 1:
+            def result_fn( window, slice_idx_to_summary ):
+                for slice_idx in window:
+                    feed.add( slice_idx, slice_idx_to_summary.get( slice_idx ) )
+        else:
+            def result_fn( slice_idx, summary ):
+                feed.add( slice_idx, summary )
+    else:
+        feed = None
+        result_fn = None
 
     # Compute kernel distances and collect wall-time or callstack data as 
-    # requested
-    slice_idx_to_data = {}
-    for slice_idx in assigned_indices:
+    # requested. Slices are handed out to whichever process is idle, and each
+    # slice's data is written to the store by the process that computed it.
+    def compute_slice_data( slice_idx ):
+        # The slices' inputs are recorded before they are read, so that slices
+        # regenerated while they are being computed are recomputed next time
+        inputs = get_slice_inputs( slice_dirs, slice_idx, slicing_policy )
         slice_data = get_slice_data( slice_dirs, 
                                      slice_idx, 
                                      kernels, 
-                                     callstacks_available )
-        slice_idx_to_data[ slice_idx ] = slice_data
+                                     callstacks_available,
+                                     cache,
+                                     vocabulary,
+                                     approximation )
+        write_slice_chunk( store_dir, slice_idx, slice_data, inputs )
         print("Rank: {} done computing kernel distance data for slice: {}".format(rank, slice_idx))
-    
-    comm.barrier()
-    print("Rank: {} done computing kernel distance data".format(rank))
-    comm.barrier()
+        return get_online_summary( slice_data )
 
-    # Gather all per-slice kernel distance results
-    kdts_data = comm.gather( slice_idx_to_data, root=0 )
+    def compute_window_data( window ):
+        slice_idx_to_inputs = { idx : get_slice_inputs( slice_dirs, idx, slicing_policy ) for idx in window }
+        slice_idx_to_data = get_window_slice_data( slice_dirs, 
+                                                   window, 
+                                                   kernels, 
+                                                   callstacks_available,
+                                                   cache,
+                                                   vocabulary )
+        for slice_idx, slice_data in slice_idx_to_data.items():
+            write_slice_chunk( store_dir, slice_idx, slice_data, slice_idx_to_inputs[ slice_idx ] )
+        print("Rank: {} done computing kernel distance data for slices: {}-{}".format(rank, window[0], window[-1]))
+        return { idx : get_online_summary( d ) for idx,d in slice_idx_to_data.items() }
 
-    if rank == 0:
-        print("Kernel distance data gathered")
+    def update_slice( slice_idx ):
+        slice_data, inputs = update_slice_data( slice_dirs,
+                                                slice_idx,
+                                                kernels,
+                                                callstacks_available,
+                                                store_dir,
+                                                vocabulary,
+                                                slicing_policy )
+        if slice_data is not None:
+            write_slice_chunk( store_dir, slice_idx, slice_data, inputs )
+            print("Rank: {} done updating kernel distance data for slice: {}".format(rank, slice_idx))
+        return get_online_summary( slice_data )
 
-    # Merge on root and write out
-    if rank == 0:
-        kdts = merge_dicts( kdts_data, check_keys=True )
-
-        # Name output path based on slicing policy and kernel params unless one is
-        # provided
-        if output_path is None:
-            output_path = make_output_path( traces_root_dir, 
-                                            slicing_policy, 
-                                            kernels )
-        else:
-            name,ext = os.path.splitext( output_path )
-            if ext != ".pkl":
-                output_path = traces_root_dir + "/" + name + ".pkl"
-            else:
-                output_path = traces_root_dir + "/" + output_path
+    if incremental:
+        schedule_slices( remaining_indices, update_slice, slice_to_cost, result_fn )
+    elif slice_window > 1:
+        schedule_slices( windows, compute_window_data, slice_to_cost, result_fn )
+    else:
+        schedule_slices( remaining_indices, compute_slice_data, slice_to_cost, result_fn )
 
-        # Write out time series data for further analysis or visualization
-        with open( output_path, "wb" ) as pklfile:
-            #pkl.dump( kdts, pklfile, pkl.HIGHEST_PROTOCOL )
-            pkl.dump( kdts, pklfile )
-        print("Kernel distance data written to: {}".format(output_path))
+    # Root only finalizes the store's manifest, which lists only the chunks
+    # computed from the current slices of the requested runs. Incrementally
+    # grown chunks must cover every requested run and be current for all the
+    # runs they hold.
+    if rank == 0:
+        def is_current( slice_idx, chunk_inputs ):
+            if incremental and chunk_inputs is not None:
+                chunk_slice_dirs = [ run[0] for run in chunk_inputs["runs"] ]
+                if not set( str( sd ) for sd in slice_dirs ) <= set( chunk_slice_dirs ):
+                    return False
+                return is_chunk_current( chunk_slice_dirs, slice_idx, chunk_inputs, slicing_policy )
+            return is_chunk_current( slice_dirs, slice_idx, chunk_inputs, slicing_policy )
+        finalized_indices = finalize_kdts_store( store_dir, is_current )
+        print("Kernel distance data for {} slices written to: {}".format( len( finalized_indices ), store_dir ))
+        if feed is not None:
+            flags_path = os.path.splitext( output_path )[0] + "_online_flags.pkl"
+            with open( flags_path, "wb" ) as outfile:
+                pkl.dump( feed.flagged, outfile, pkl.HIGHEST_PROTOCOL )
+            print("Online detection flags written to: {}".format( flags_path ))
 
 
 
@@ -409,12 +1017,48 @@ if __name__ == "__main__":
                         help="lower bound of range of slices")
     parser.add_argument("--slice_range_upper", type=int, required=False, default=None,
                         help="lower bound of range of slicds")
+    # Dispatch the largest slices first to keep all processes busy until the end
+    parser.add_argument("--largest_first", action="store_true", default=False,
+                        help="Dispatch slices in decreasing order of their subgraphs' total size on disk")
+    # Persistent cache of per-slice kernel intermediates
+    parser.add_argument("--cache_dir", required=False, default=None,
+                        help="Directory of a cache of relabeled graphs, WL feature vectors, and kernel matrices keyed by slice contents and kernel params. Reruns with overlapping kernels only compute what is not cached. Optional. Default: no caching")
+    parser.add_argument("--cache_size_gb", type=float, required=False, default=10,
+                        help="Size bound of the cache in GiB. Least recently used entries are evicted beyond it. Default: 10")
+    parser.add_argument("--slice_window", type=int, required=False, default=1,
+                        help="Number of consecutive slices whose kernels are computed together in one batch. Amortizes per-slice overheads when slices are small and numerous. Default: 1 (one slice at a time)")
+    # Approximate mode
+    parser.add_argument("--approximate", choices=[ "hash", "nystrom" ], required=False, default=None,
+                        help="Compute approximate kernel distance summaries instead of full distance matrices, for very large numbers of runs. Each slice's kernel features are embedded into a fixed number of dimensions, by hashing WL / histogram features (hash) or via Nystrom landmarks (nystrom), and only a sample of pairwise distances is computed. Default: exact distances")
+    parser.add_argument("--embedding_dim", type=int, required=False, default=default_approximation["dim"],
+                        help="Number of hashed features or Nystrom landmarks in approximate mode. Default: {}".format( default_approximation["dim"] ))
+    parser.add_argument("--n_distance_samples", type=int, required=False, default=default_approximation["n_distance_samples"],
+                        help="Number of pairwise distances sampled per slice and kernel in approximate mode. Default: {}".format( default_approximation["n_distance_samples"] ))
+    parser.add_argument("--error_sample_size", type=int, required=False, default=default_approximation["error_sample_size"],
+                        help="Number of runs whose exact distances the approximation is checked against per slice and kernel in approximate mode. Default: {}".format( default_approximation["error_sample_size"] ))
+    parser.add_argument("--loader_workers", type=int, required=False, default=1,
+                        help="Number of worker processes each MPI process parses slice subgraphs with. Default: 1 (parse in the MPI process itself)")
+    # Incremental mode
+    parser.add_argument("--incremental", action="store_true", default=False,
+                        help="Add runs that are not in the store yet without recomputing the distances between runs already in it, e.g., to compare nightly runs against a rolling baseline. Stores each slice's kernel features alongside its chunk so that later runs can be added. Distance matrix rows follow the order in which runs were added. Default: off")
+    # Online change-point detection
+    parser.add_argument("--online_detection", required=False, default=None,
+                        help="JSON file of online change-point detectors (see online_change_detection) to run on one kernel's distances as slices are computed. Flagged slices are printed as soon as they are detected, within a bounded number of slices after the change, and written to <path stem>_online_flags.pkl at the end. Slices are fed to the detectors in index order, so dispatching them in order (i.e., without --largest_first) keeps detection latency lowest. Default: off")
     # Defines location of output
     parser.add_argument("-o", "--output_path", default=None,
                         action="store", type=str, required=False,
-                        help="Path to write kernel distance time series data to. Optional. If not provided, a default will be constructed from the traces root dir., the slicing policy, and the kernel params.")
+                        help="Path to write kernel distance time series data to. Per-slice results are stored in the directory <path stem>_store, and slices already present there are not recomputed, as long as they were computed from the same slice files of the same runs under the same slicing policy. Optional. If not provided, a default will be constructed from the traces root dir., the slicing policy, and the kernel params.")
     args = parser.parse_args()
 
+    if args.approximate is not None:
+        approximation = dict( default_approximation, 
+                              method=args.approximate,
+                              dim=args.embedding_dim,
+                              n_distance_samples=args.n_distance_samples,
+                              error_sample_size=args.error_sample_size )
+    else:
+        approximation = None
+
     main( args.traces_root_dir, 
           args.slicing_policy, 
           args.slice_dir_name,
@@ -426,6 +1070,14 @@ if __name__ == "__main__":
           args.slice_range_lower,
           args.slice_range_upper,
           args.callstacks_available, 
-          args.output_path )
+          args.output_path,
+          args.largest_first,
+          args.cache_dir,
+          args.cache_size_gb,
+          args.slice_window,
+          approximation,
+          args.incremental,
+          args.loader_workers,
+          args.online_detection )
 
 
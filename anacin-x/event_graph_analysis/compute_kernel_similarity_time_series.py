@@ -12,8 +12,6 @@ import json
 from pathlib import Path
 
 import igraph
-import graphkernels
-import graphkernels.kernels as gk
 import numpy as np
 
 import grakel
@@ -26,16 +24,31 @@ comm = MPI.COMM_WORLD
 import sys
 sys.path.append(".")
 
-from utilities import ( read_graphs_parallel, 
-                        timer, 
-                        read_graph,
-                        merge_dicts
+from utilities import ( timer, 
+                        merge_dicts,
+                        get_slice_path,
+                        list_graph_paths,
+                        get_vertex_values
                       )
 
+from wl_kernel import compute_wl_kernel_matrices
+
+from parallel_graph_loader import get_graph_loader
+
+from histogram_kernels import ( compute_vertex_histogram_kernel,
+                                compute_edge_histogram_kernel
+                              )
+
 from graph_kernel_preprocessing import ( get_relabeled_graphs,
                                          compute_extra_labels
                                        )
 
+from label_vocabulary import ( get_label_vocabulary_path,
+                               get_label_source_paths,
+                               get_vocabulary_labels,
+                               load_label_vocabulary
+                             )
+
 from graph_kernel_postprocessing import ( convert_to_distance_matrix,
                                           validate_kernel_matrix
                                         )
@@ -69,10 +82,33 @@ def make_output_path( traces_root_dir, slicing_policy, kernel_params ):
 ##################### Graph kernel distance functions ##########################
 ################################################################################
 
+"""
+Computes the kernel matrices for all requested WL kernels, grouped by label so
+that each label's graphs are refined only once up to the largest requested 
+number of iterations. Returns a map from labels to maps from numbers of WL 
+iterations to kernel matrices.
+"""
+def get_wl_kernel_matrices( kernel_label_pair_to_relabeled_graphs, kernel_params ):
+    label_to_iters = {}
+    for kp in kernel_params:
+        if kp["name"] == "wlst":
+            label = kp["params"]["label"]
+            label_to_iters.setdefault( label, [] ).append( kp["params"]["n_iters"] )
+    label_to_kernel_mats = {}
+    for label, iters in label_to_iters.items():
+        relabeled_graphs = kernel_label_pair_to_relabeled_graphs[ ( "wlst", label ) ]
+        label_to_kernel_mats[ label ] = compute_wl_kernel_matrices( relabeled_graphs, iters )
+    return label_to_kernel_mats
+
 #@timer 
-def compute_kernel_similarity_matrices( slice_subgraphs, kernel_params ):
+def compute_kernel_similarity_matrices( slice_subgraphs, kernel_params, vocabulary=None ):
     # Relabel based on requested graph kernels
-    kernel_label_pair_to_relabeled_graphs = get_relabeled_graphs( slice_subgraphs, kernel_params )
+    kernel_label_pair_to_relabeled_graphs = get_relabeled_graphs( slice_subgraphs, kernel_params, vocabulary )
+
+    # Compute all requested WL iteration counts for the same label in a single
+    # refinement pass
+    wl_label_to_kernel_mats = get_wl_kernel_matrices( kernel_label_pair_to_relabeled_graphs, 
+                                                      kernel_params )
 
     # Actually compute the kernel similarity matrices
     kernel_to_similarity_matrix = {}
@@ -84,8 +120,7 @@ def compute_kernel_similarity_matrices( slice_subgraphs, kernel_params ):
             n_iters = params["n_iters"]
             label   = params["label"]
             kernel_label_pair = ( kernel, label )
-            relabeled_graphs = kernel_label_pair_to_relabeled_graphs[ kernel_label_pair ]
-            similarity_mat = gk.CalculateWLKernel( relabeled_graphs, n_iters )
+            similarity_mat = wl_label_to_kernel_mats[ label ][ n_iters ]
             kernel_params_key = ( kernel, label, n_iters )
             kernel_to_similarity_matrix[ kernel_params_key ] = similarity_mat
         # Compute edge-histogram kernel
@@ -93,7 +128,7 @@ def compute_kernel_similarity_matrices( slice_subgraphs, kernel_params ):
             label = params["label"]
             kernel_label_pair = ( kernel, label )
             relabeled_graphs = kernel_label_pair_to_relabeled_graphs[ kernel_label_pair ]
-            similarity_mat = gk.CalculateEdgeHistKernel( relabeled_graphs )
+            similarity_mat = compute_edge_histogram_kernel( relabeled_graphs )
             kernel_key = ( kernel, label )
             kernel_to_similarity_matrix[ kernel_key ] = similarity_mat
         # Compute vertex-histogram kernel
@@ -101,7 +136,7 @@ def compute_kernel_similarity_matrices( slice_subgraphs, kernel_params ):
             label = params["label"]
             key = (kernel, label)
             relabeled_graphs = kernel_label_pair_to_relabeled_graphs[ key ]
-            similarity_mat = gk.CalculateVertexHistKernel( relabeled_graphs )
+            similarity_mat = compute_vertex_histogram_kernel( relabeled_graphs )
             kernel_to_similarity_matrix[ key ] = similarity_mat
         else:
             raise NotImplementedError("Kernel: {} not supported".format(kernel))
@@ -116,7 +151,7 @@ def compute_kernel_similarity_matrices( slice_subgraphs, kernel_params ):
 def extract_wall_time_data( slice_subgraphs ):
     graph_to_wall_time_data = {}
     for idx,g in enumerate(slice_subgraphs):
-        wall_times = [ float(wt) for wt in g.vs[:]["wall_time"] ]
+        wall_times = [ float(wt) for wt in get_vertex_values( g, "wall_time" ) ]
         time_stats = {}
         time_stats["median_wall_time"] = np.median( wall_times )
         time_stats["mean_wall_time"] = np.mean( wall_times )
@@ -130,8 +165,8 @@ def extract_callstack_data( slice_subgraphs ):
     graph_to_callstack_data = {}
     for idx,g in enumerate(slice_subgraphs):
         callstack_to_count = {}
-        callstacks = g.vs[:]["callstack"]
-        mpi_fns = g.vs[:]["mpi_function"]
+        callstacks = get_vertex_values( g, "callstack" )
+        mpi_fns = get_vertex_values( g, "mpi_function" )
         for c,f in zip(callstacks, mpi_fns):
             if c != "":
                 key = (c,f)
@@ -143,11 +178,10 @@ def extract_callstack_data( slice_subgraphs ):
     return graph_to_callstack_data
 
 #@timer
-def get_slice_data( slice_dirs, slice_idx, kernel_params, callstacks_available ):
+def get_slice_data( slice_dirs, slice_idx, kernel_params, callstacks_available, vocabulary=None ):
     print("Ingesting subgraphs for slice: {}".format( slice_idx ))
-    slice_subgraph_paths = [ str(sd) + "/slice_" + str(slice_idx) + ".graphml" for sd in slice_dirs ]
-    #slice_subgraphs = read_graphs_parallel( slice_subgraph_paths )
-    slice_subgraphs = [ read_graph(g) for g in slice_subgraph_paths ]
+    slice_subgraph_paths = [ get_slice_path( sd, slice_idx ) for sd in slice_dirs ]
+    slice_subgraphs = get_graph_loader().load_arrays( slice_subgraph_paths, keep_edge_order=True )
    
     # Compute extra labels (e.g., logical time increment)
     slice_subgraphs = [ compute_extra_labels(g) for g in slice_subgraphs ]
@@ -155,7 +189,8 @@ def get_slice_data( slice_dirs, slice_idx, kernel_params, callstacks_available )
     # Compute the requested kernel similarity matrices
     print("Computing kernel similarities for slice: {}".format( slice_idx ))
     kernel_distance_data = compute_kernel_similarity_matrices( slice_subgraphs, 
-                                                             kernel_params )
+                                                             kernel_params,
+                                                             vocabulary )
     
     # Extract wall-time information for correlating with application events
     print("Extracting wall-time data for slice: {}".format( slice_idx ))
@@ -214,7 +249,7 @@ def validate_slice_dirs( slice_dirs ):
     for sd in slice_dirs:
         assert( os.path.isdir(str(sd)) )
         assert( sd.is_dir() )
-        slice_counts.add( len(list(sd.glob("*.graphml"))) )
+        slice_counts.add( len( list_graph_paths( sd, "slice_*" ) ) )
     assert( len( slice_counts ) == 1 )
     return list(slice_counts)[0]
 
@@ -301,7 +336,8 @@ def main( traces_root_dir,
           slice_range_lower, 
           slice_range_upper, 
           callstacks_available, 
-          output_path ):
+          output_path,
+          loader_workers=1 ):
     # Get MPI rank
     rank = comm.Get_rank()
     # Ingest inputs on root process
@@ -313,6 +349,7 @@ def main( traces_root_dir,
 
         # Sanity-check the slice directories
         n_slices = validate_slice_dirs( slice_dirs )
+
         input_config = { "slice_dirs" : slice_dirs,
                          "kernels"    : kernels,
                          "n_slices"   : n_slices }
@@ -329,6 +366,19 @@ def main( traces_root_dir,
     assigned_indices = assign_slice_indices( n_slices, slices, slice_range_lower, slice_range_upper )
     print("Rank: {}, Assigned Slices: {}".format( rank, assigned_indices ))
 
+    # Encode string-valued labels the same way in every run and slice. The
+    # slices this job reads are scanned for values not in the campaign's 
+    # vocabulary yet by all processes.
+    requested_indices = sorted( set().union( *comm.allgather( assigned_indices ) ) )
+    vocabulary = load_label_vocabulary( get_label_vocabulary_path( traces_root_dir ),
+                                        get_label_source_paths( slice_dirs, requested_indices ) if rank == 0 else None,
+                                        get_vocabulary_labels( kernels ),
+                                        comm )
+
+    # Set up this process's graph loader. Each MPI process already works on
+    # its own slices, so by default each reads its graphs itself.
+    get_graph_loader( loader_workers )
+
     # Compute kernel distances and collect wall-time or callstack data as 
     # requested
     slice_idx_to_data = {}
@@ -336,7 +386,8 @@ def main( traces_root_dir,
         slice_data = get_slice_data( slice_dirs, 
                                      slice_idx, 
                                      kernels, 
-                                     callstacks_available )
+                                     callstacks_available,
+                                     vocabulary )
         slice_idx_to_data[ slice_idx ] = slice_data
         print("Rank: {} done computing kernel distance data for slice: {}".format(rank, slice_idx))
     
@@ -406,6 +457,8 @@ if __name__ == "__main__":
                         help="lower bound of range of slices")
     parser.add_argument("--slice_range_upper", type=int, required=False, default=None,
                         help="lower bound of range of slicds")
+    parser.add_argument("--loader_workers", type=int, required=False, default=1,
+                        help="Number of worker processes each MPI process parses slice subgraphs with. Default: 1 (parse in the MPI process itself)")
     # Defines location of output
     parser.add_argument("-o", "--output_path", default=None,
                         action="store", type=str, required=False,
@@ -423,6 +476,7 @@ if __name__ == "__main__":
           args.slice_range_lower,
           args.slice_range_upper,
           args.callstacks_available, 
-          args.output_path )
+          args.output_path,
+          args.loader_workers )
 
 
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+#SBATCH -t 01:00:00
+#SBATCH -o convert_event_graphs-%j.out
+#SBATCH -e convert_event_graphs-%j.err
+
+import argparse
+import os
+import glob
+import time
+
+from mpi4py import MPI
+comm = MPI.COMM_WORLD
+
+import sys
+sys.path.append(".")
+sys.path.append("..")
+
+from utilities import ( read_graph_arrays,
+                        write_graph_binary,
+                        binary_graph_ext
+                      )
+
+"""
+Finds all GraphML files anywhere below the root directory
+"""
+def get_graphml_paths( root_dir ):
+    return sorted( glob.glob( root_dir + "/**/*.graphml", recursive=True ) )
+
+"""
+Determines which GraphML files each MPI process converts via round-robin
+assignment
+"""
+def assign_paths( root_dir ):
+    rank = comm.Get_rank()
+    comm_size = comm.Get_size()
+    # Root process finds all GraphML files and broadcasts
+    if rank == 0:
+        graphml_paths = get_graphml_paths( root_dir )
+    else:
+        graphml_paths = None
+    graphml_paths = comm.bcast( graphml_paths, root=0 )
+    return [ p for idx,p in enumerate(graphml_paths) if idx % comm_size == rank ]
+
+"""
+Writes a binary copy of a GraphML event graph next to the original. An existing
+binary copy is only kept if it is at least as recent as the GraphML file, since
+otherwise the GraphML was re-written after the last conversion. The GraphML file
+is only removed once it has been converted by this call, never on the strength
+of a copy written earlier. The binary copy records the GraphML edge order, so
+that labels that depend on it (see compute_extra_labels) are unchanged.
+"""
+def convert( graphml_path, overwrite, remove_graphml ):
+    output_path = os.path.splitext( graphml_path )[0] + binary_graph_ext
+    is_stale = ( not os.path.exists( output_path ) 
+                 or os.path.getmtime( output_path ) < os.path.getmtime( graphml_path ) )
+    converted = overwrite or is_stale
+    if converted:
+        graph = read_graph_arrays( graphml_path, keep_edge_order=True )
+        write_graph_binary( graph, output_path )
+        if remove_graphml:
+            os.remove( graphml_path )
+    return output_path, converted
+
+def main( root_dir, overwrite, remove_graphml ):
+    rank = comm.Get_rank()
+    assigned_paths = assign_paths( root_dir )
+    for path in assigned_paths:
+        output_path, converted = convert( path, overwrite, remove_graphml )
+        if converted:
+            print("Rank: {} converted: {} --> {}".format( rank, path, output_path ))
+        else:
+            print("Rank: {} skipped: {} (up-to-date binary copy: {})".format( rank, path, output_path ))
+    comm.barrier()
+
+
+if __name__ == "__main__":
+    desc = "Converts all GraphML event graphs and slices below a directory into the binary event graph format"
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument("root_dir",
+                        help="Directory to search recursively for GraphML files")
+    parser.add_argument("--overwrite", action="store_true", default=False,
+                        help="Re-convert graphs that already have an up-to-date binary copy")
+    parser.add_argument("--remove_graphml", action="store_true", default=False,
+                        help="Delete each GraphML file once it has been converted. Files skipped because an up-to-date binary copy already exists are kept.")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    main( args.root_dir, args.overwrite, args.remove_graphml )
+    elapsed = time.time() - start_time
+    if comm.Get_rank() == 0:
+        print("Total elapsed time: {}".format( elapsed ))
@@ -0,0 +1,129 @@
+import os
+import tempfile
+import multiprocessing as mp
+
+import numpy as np
+import psutil
+
+from sklearn.model_selection import KFold
+from sklearn import svm
+
+import sys
+sys.path.append(".")
+
+from parallel_graph_loader import get_shared_memory_dir
+
+"""
+Parallel cross-validation of kernel SVR / SVC models on precomputed kernel
+matrices.
+
+Each ( kernel, repeat, fold ) fit only needs the training and test rows and
+columns of its kernel matrix, extracted with one np.ix_ indexing operation.
+The fits are independent of each other, so all of them are handed out to a
+pool of worker processes. Workers do not receive copies of the kernel
+matrices: each matrix is written once to a file in shared memory (/dev/shm),
+which every worker memory-maps read-only, so the matrices are held in memory
+once however many workers there are.
+"""
+
+"""
+Returns the rows and columns of a kernel matrix selected by row_indices and
+col_indices, e.g., the training graphs' Gram matrix ( train x train ) or the
+test graphs' kernel values against the training graphs ( test x train )
+"""
+def get_sub_gram( k_mat, row_indices, col_indices ):
+    return np.asarray( k_mat )[ np.ix_( row_indices, col_indices ) ]
+
+"""
+Returns the train / test splits of repeated shuffled k-fold cross-validation,
+one repeat per seed, as a list of ( repeat_idx, fold_idx, train_indices,
+test_indices )
+"""
+def get_kfold_splits( n_samples, n_folds, seeds ):
+    splits = []
+    for repeat_idx, seed in enumerate( seeds ):
+        kf = KFold( n_splits=n_folds, random_state=seed, shuffle=True )
+        for fold_idx, ( train_indices, test_indices ) in enumerate( kf.split( np.arange( n_samples ) ) ):
+            splits.append( ( repeat_idx, fold_idx, train_indices, test_indices ) )
+    return splits
+
+def get_model( model_type ):
+    if model_type == "svr":
+        return svm.SVR( kernel="precomputed" )
+    elif model_type == "svc":
+        return svm.SVC( kernel="precomputed" )
+    else:
+        raise NotImplementedError("Model type: {} not supported".format( model_type ))
+
+"""
+Trains a model on one split's training graphs and returns its predictions for
+the split's test graphs
+"""
+def fit_and_predict( k_mat, targets, train_indices, test_indices, model_type ):
+    k_train = get_sub_gram( k_mat, train_indices, train_indices )
+    k_test = get_sub_gram( k_mat, test_indices, train_indices )
+    model = get_model( model_type )
+    model.fit( k_train, targets[ train_indices ] )
+    return model.predict( k_test )
+
+# Memory-mapped kernel matrices and targets of a worker process, set once per
+# worker by the pool initializer
+_worker_matrices = None
+_worker_targets = None
+
+def _attach_kernel_matrices( matrix_paths, targets ):
+    global _worker_matrices, _worker_targets
+    _worker_matrices = [ np.load( p, mmap_mode="r" ) for p in matrix_paths ]
+    _worker_targets = targets
+
+def _fit_task( task ):
+    kernel_idx, repeat_idx, fold_idx, train_indices, test_indices, model_type = task
+    y_pred = fit_and_predict( _worker_matrices[ kernel_idx ], _worker_targets,
+                              train_indices, test_indices, model_type )
+    return kernel_idx, repeat_idx, fold_idx, y_pred
+
+"""
+Fits and evaluates a model of model_type ("svr" or "svc") for every kernel
+matrix and every split (see get_kfold_splits). All fits are spread over a pool
+of n_workers processes (default: one per CPU), which share the kernel matrices
+through shared memory. With a single worker, the fits run in this process.
+Returns a dict mapping ( kernel, repeat_idx, fold_idx ) to the predictions for
+that split's test graphs.
+"""
+def cross_validate( kernel_to_matrix, targets, splits, model_type, n_workers=None ):
+    kernels = list( kernel_to_matrix.keys() )
+    targets = np.asarray( targets )
+    # Fail on an unknown model type before any work is handed out
+    get_model( model_type )
+    tasks = [ ( kernel_idx, repeat_idx, fold_idx, train_indices, test_indices, model_type )
+              for kernel_idx in range( len( kernels ) )
+              for repeat_idx, fold_idx, train_indices, test_indices in splits ]
+    if n_workers is None:
+        n_workers = psutil.cpu_count( logical=True )
+    n_workers = min( n_workers, len( tasks ) )
+
+    if n_workers <= 1:
+        matrices = [ np.asarray( kernel_to_matrix[ k ], dtype=np.float64 ) for k in kernels ]
+        results = []
+        for kernel_idx, repeat_idx, fold_idx, train_indices, test_indices, model_type in tasks:
+            y_pred = fit_and_predict( matrices[ kernel_idx ], targets, train_indices, test_indices, model_type )
+            results.append( ( kernel_idx, repeat_idx, fold_idx, y_pred ) )
+    else:
+        matrix_paths = []
+        try:
+            shared_memory_dir = get_shared_memory_dir()
+            for k in kernels:
+                fd, path = tempfile.mkstemp( prefix="kernel_matrix_", suffix=".npy", dir=shared_memory_dir )
+                os.close( fd )
+                matrix_paths.append( path )
+                np.save( path, np.asarray( kernel_to_matrix[ k ], dtype=np.float64 ) )
+            chunk_size = max( 1, len( tasks ) // ( 4 * n_workers ) )
+            with mp.Pool( n_workers, initializer=_attach_kernel_matrices,
+                          initargs=( matrix_paths, targets ) ) as pool:
+                results = list( pool.imap_unordered( _fit_task, tasks, chunksize=chunk_size ) )
+        finally:
+            for path in matrix_paths:
+                os.remove( path )
+
+    return { ( kernels[ kernel_idx ], repeat_idx, fold_idx ) : y_pred
+             for kernel_idx, repeat_idx, fold_idx, y_pred in results }
@@ -7,7 +7,6 @@
 import pprint
 
 import argparse
-import igraph
 import numpy as np
 import pathlib
 import os
@@ -18,42 +17,183 @@ import time
 from mpi4py import MPI
 comm = MPI.COMM_WORLD
 
-#from utilities import timer, read_graph
-
 import sys
 sys.path.append(".")
 sys.path.append("..")
 
-def read_graph( graph_path ):
-    graph = igraph.read( graph_path )
-    return graph
+from utilities import ( read_graph, 
+                        read_graph_arrays,
+                        write_graph,
+                        get_vertex_values,
+                        vertex_values_equal,
+                        event_graph_arrays,
+                        binary_graph_format,
+                        binary_graph_ext
+                      )
+
+from slice_scheduler import schedule_slices
+
+from node_shared_graph import ( read_graph_arrays_node_shared,
+                                share_arrays_node_shared
+                              )
 
 ################################################################################
 ######################## Slice extraction utilities ############################
 ################################################################################
 
-# Returns a dict mapping MPI ranks to sequence of barrier vertices
+class rank_timestamp_index(object):
+    """
+    Per-rank index over the vertices of an event graph. For each clock, all 
+    vertex ids are kept in one array grouped by rank and sorted by timestamp 
+    within each rank, alongside the sorted timestamps themselves, so the 
+    vertices a rank contributes to any timestamp interval can be found by 
+    binary search instead of a scan over the whole graph. The sorted order for
+    each clock is built the first time that clock is used. Works on both igraph
+    graphs and event_graph_arrays objects.
+
+    The index is held as a few flat arrays (see get_arrays), so that it can be
+    built once per node and shared by all processes on the node (see 
+    node_shared).
+    """
+    def __init__(self, graph, arrays=None):
+        self._graph = graph
+        self._process_ids = get_vertex_values( graph, "process_id" )
+        if arrays is None:
+            rank_vals, counts = np.unique( self._process_ids, return_counts=True )
+            rank_bounds = np.zeros( len( counts ) + 1, dtype=np.int64 )
+            np.cumsum( counts, out=rank_bounds[1:] )
+            arrays = { "ranks"      : rank_vals.astype( np.int64 ),
+                       "rank_bounds": rank_bounds,
+                       "is_barrier" : vertex_values_equal( graph, "event_type", "barrier" ) }
+        self._arrays = dict( arrays )
+        self._rank_to_position = { int(r):i for i,r in enumerate( self._arrays["ranks"] ) }
+        self._topology = None
+
+    @classmethod
+    def node_shared(cls, graph, clocks, comm=MPI.COMM_WORLD):
+        """
+        Builds the index, sorted for the requested clocks, once per node in 
+        memory shared by all processes on the node. Collective over comm. 
+        Clocks not requested are still sorted on first use, per process.
+        """
+        def build():
+            index = cls( graph )
+            for clock in clocks:
+                index.get_sorted_arrays( clock )
+            return index.get_arrays()
+        window, views = share_arrays_node_shared( build, comm )
+        index = cls( graph, views )
+        # The window must outlive the views into it
+        index._shared_window = window
+        return index
+
+    def get_arrays(self):
+        """
+        The arrays that make up the index, keyed by name
+        """
+        return dict( self._arrays )
+
+    def ranks(self):
+        return sorted( self._rank_to_position.keys() )
+
+    def get_timestamps(self, clock):
+        """
+        Timestamps of all vertices w/r/t the requested clock, indexed by vertex id
+        """
+        key = "timestamps_" + clock
+        if key not in self._arrays:
+            if clock not in [ "logical", "wall" ]:
+                raise ValueError("Clock: {} not recognized".format( clock ))
+            column = np.asarray( get_vertex_values( self._graph, clock + "_time" ) )
+            if column.dtype == np.float64:
+                # Used as is, so that graph columns are not copied
+                return column
+            self._arrays[ key ] = column.astype( np.float64 )
+        return self._arrays[ key ]
+
+    def get_sorted_arrays(self, clock):
+        """
+        Returns ( vertex ids, timestamps ) of all vertices, grouped by rank and
+        sorted by timestamp within each rank. Ties keep vertex id order.
+        """
+        order_key, timestamps_key = "order_" + clock, "sorted_timestamps_" + clock
+        if order_key not in self._arrays:
+            timestamps = self.get_timestamps( clock )
+            order = np.lexsort( ( timestamps, self._process_ids ) )
+            self._arrays[ order_key ] = order
+            self._arrays[ timestamps_key ] = timestamps[ order ]
+        return self._arrays[ order_key ], self._arrays[ timestamps_key ]
+
+    def get_sorted(self, rank, clock):
+        """
+        Returns ( vertex ids, timestamps ) for one rank, sorted by timestamp
+        """
+        order, timestamps = self.get_sorted_arrays( clock )
+        position = self._rank_to_position[ rank ]
+        start, stop = self._arrays["rank_bounds"][ position:position+2 ]
+        return order[ start:stop ], timestamps[ start:stop ]
+
+    def get_position_range(self, rank, clock, lower_bound, upper_bound):
+        """
+        Positions in the rank's sorted order of the first vertex with timestamp
+        >= lower_bound and one past the last vertex with timestamp <= upper_bound
+        """
+        _, timestamps = self.get_sorted( rank, clock )
+        lower = np.searchsorted( timestamps, lower_bound, side="left" )
+        upper = np.searchsorted( timestamps, upper_bound, side="right" )
+        return lower, upper
+
+    def get_vertices(self, rank, clock, lower_bound, upper_bound):
+        """
+        Ids of the rank's vertices whose timestamps lie in [lower_bound, upper_bound]
+        """
+        vids, _ = self.get_sorted( rank, clock )
+        lower, upper = self.get_position_range( rank, clock, lower_bound, upper_bound )
+        return vids[ lower:upper ]
+
+    def get_barrier_vertices(self, rank):
+        """
+        Ids of the rank's barrier vertices in logical-time order
+        """
+        vids, _ = self.get_sorted( rank, "logical" )
+        return vids[ self._arrays["is_barrier"][ vids ] ]
+
+    def get_process_ids(self):
+        return self._process_ids
+
+    def get_topology(self):
+        """
+        CSR adjacency of the graph as an event_graph_arrays object. For igraph
+        graphs this is built from the edge list the first time it is needed.
+        """
+        if isinstance( self._graph, event_graph_arrays ):
+            return self._graph
+        if self._topology is None:
+            edges = np.asarray( self._graph.get_edgelist(), dtype=np.int64 ).reshape( -1, 2 )
+            self._topology = event_graph_arrays.from_edge_list( self._graph.vcount(), 
+                                                                edges[:,0], edges[:,1] )
+        return self._topology
+
+
+# Returns a dict mapping MPI ranks to sequence of barrier vertex ids
 #@timer
-def get_rank_to_barrier_seq( graph, slice_ranks ):
+def get_rank_to_barrier_seq( index, slice_ranks ):
     rank_to_barrier_seq = {}
     for rank in slice_ranks:
-        barrier_seq = graph.vs.select( process_id_eq=rank, 
-                                       event_type_eq="barrier" )
-        rank_to_barrier_seq[ rank ] = barrier_seq
+        rank_to_barrier_seq[ rank ] = index.get_barrier_vertices( rank )
     return rank_to_barrier_seq
 
-# Returns a dict mapping MPI ranks to sequences of pairs of subsequent barrier
-# vertices
+# Returns a dict mapping MPI ranks to sequences of timestamp intervals between
+# pairs of subsequent barrier vertices
 #@timer
-def get_rank_to_barrier_pair_seq( rank_to_barrier_seq ):
-    rank_to_barrier_pair_seq = {}
+def get_rank_to_barrier_pair_interval_seq( index, rank_to_barrier_seq, clock ):
+    timestamps = index.get_timestamps( clock )
+    rank_to_timestamp_interval_seq = {}
     for rank,barrier_seq in rank_to_barrier_seq.items():
-        barrier_pair_seq = []
-        for i in range(1, len(barrier_seq) ):
-            barrier_pair = ( barrier_seq[i-1], barrier_seq[i] )
-            barrier_pair_seq.append( barrier_pair )
-        rank_to_barrier_pair_seq[ rank ] = barrier_pair_seq
-    return rank_to_barrier_pair_seq
+        barrier_timestamps = timestamps[ barrier_seq ]
+        rank_to_timestamp_interval_seq[ rank ] = list( zip( barrier_timestamps[:-1], 
+                                                            barrier_timestamps[1:] ) )
+    return rank_to_timestamp_interval_seq
             
 # Inputs: Dict representing slicing policy and path to parent event graph
 # Ouputs: String representing path that slice subgraphs will be written to
@@ -86,75 +226,57 @@ def make_output_dir( output_dir, slicing_policy, graph_path ):
 
 
 #@timer
-def extract_slice( graph, clock, rank_to_timestamp_interval, include_endpoints ):
+def extract_slice( graph, index, clock, rank_to_timestamp_interval, include_endpoints ):
     # Get the vertices that are entirely contained within the timestamp bounds
-    slice_vertices = get_core_slice_vertices( graph, clock, rank_to_timestamp_interval )
+    slice_vertices = get_core_slice_vertices( index, clock, rank_to_timestamp_interval )
     # If desired, get extra vertices that are not contained within the timestamp
     # bounds, but are an endpoint of an edge whose other endpoint *is* contained
     # within the timestamp bounds
     if include_endpoints:
-        endpoint_vertices = get_endpoint_vertices( slice_vertices )
-        slice_vertices += endpoint_vertices
+        endpoint_vertices = get_endpoint_vertices( index, slice_vertices )
+        slice_vertices = np.union1d( slice_vertices, endpoint_vertices )
 
     # Actually construct the subgraph. Since the slices will almost always be 
     # very small compared with the parent graph, we force igraph to avoid 
     # copying the parent graph via the implementation parameter.
-    slice_subgraph = graph.subgraph( slice_vertices, 
+    if isinstance( graph, event_graph_arrays ):
+        return graph.subgraph( slice_vertices )
+    slice_subgraph = graph.subgraph( slice_vertices.tolist(), 
                                      implementation="create_from_scratch")
     return slice_subgraph
 
+# Returns the ids of all vertices whose timestamps fall within their rank's
+# interval. Each rank's vertices are found by binary search in the index.
 #@timer 
-def get_core_slice_vertices( graph, clock, rank_to_timestamp_interval ):
+def get_core_slice_vertices( index, clock, rank_to_timestamp_interval ):
     slice_vertices = []
     for rank, timestamp_interval in rank_to_timestamp_interval.items():
         # Unpack interval
         lower_bound, upper_bound = timestamp_interval
-        # Accumulate vertices for the current rank (if using logical time)
-        if clock == "logical":
-            slice_vertices += graph.vs.select( process_id_eq=rank,
-                                              logical_time_ge=lower_bound, 
-                                              logical_time_le=upper_bound 
-                                            )
-            slice_vertices += graph.vs.select( process_id_eq=rank,
-                                              logical_time_ge=lower_bound, 
-                                              logical_time_le=upper_bound, 
-                                            )
-        # Accumulate vertices for the current rank (if using wall time)
-        elif clock == "wall":
-            slice_vertices += graph.vs.select( process_id_eq=rank,
-                                              wall_time_ge=lower_bound, 
-                                              wall_time_le=upper_bound 
-                                            )
-            slice_vertices += graph.vs.select( process_id_eq=rank,
-                                              wall_time_ge=lower_bound, 
-                                              wall_time_le=upper_bound, 
-                                            )
-    return slice_vertices
-
+        # Accumulate vertices for the current rank
+        slice_vertices.append( index.get_vertices( rank, clock, lower_bound, upper_bound ) )
+    if len( slice_vertices ) == 0:
+        return np.zeros( 0, dtype=np.int64 )
+    return np.unique( np.concatenate( slice_vertices ) )
+
+# Returns the ids of vertices outside the slice that are the other endpoint of
+# a cross-rank edge (i.e., a message) with one endpoint inside the slice. 
+# Rather than visiting each slice vertex's neighbors, the edges incident to the
+# slice are gathered from the CSR adjacency as arrays and masked in one step.
 #@timer
-def get_endpoint_vertices( core_slice_vertices ):
-    endpoint_vertices = []
-    for v in core_slice_vertices:
-        for s in v.successors():
-            if s["process_id"] != v["process_id"]:
-                endpoint_vertices.append(s)
-        for p in v.predecessors():
-            if p["process_id"] != v["process_id"]:
-                endpoint_vertices.append(p)
-    return endpoint_vertices
-
-def vertex_pair_to_timestamp_interval( vertex_pair, clock ):
-    start_vertex, end_vertex = vertex_pair
-    if clock in [ "logical", "wall" ]:
-        label = clock + "_time"
-        return ( start_vertex[label], end_vertex[label] )
-    else:
-        raise ValueError("Clock: {} not recognized".format( clock ))
+def get_endpoint_vertices( index, slice_vertices ):
+    return get_endpoint_vertex_ids( index.get_topology(), 
+                                    np.asarray( index.get_process_ids() ), 
+                                    slice_vertices )
 
 #@timer 
 def write_slice( slice_subgraph, output_dir, slice_idx, output_format ):
-    output_path = output_dir + "/slice_" + str(slice_idx) + ".graphml"
-    slice_subgraph.write( output_path, format=output_format )
+    if output_format == binary_graph_format:
+        ext = binary_graph_ext
+    else:
+        ext = ".graphml"
+    output_path = output_dir + "/slice_" + str(slice_idx) + ext
+    write_graph( slice_subgraph, output_path, output_format )
 
 
 
@@ -168,95 +290,235 @@ def assign_slices( n_slices ):
     return my_slices
 
 
+# Returns the number of core vertices in each slice, found from the index 
+# without materializing the slices. Used to dispatch the largest slices first.
+def get_slice_vertex_counts( index, clock, rank_to_timestamp_interval_seq ):
+    slice_counts = 0
+    for rank, interval_seq in rank_to_timestamp_interval_seq.items():
+        _, timestamps = index.get_sorted( rank, clock )
+        bounds = np.asarray( interval_seq, dtype=np.float64 ).reshape( -1, 2 )
+        lower = np.searchsorted( timestamps, bounds[:,0], side="left" )
+        upper = np.searchsorted( timestamps, bounds[:,1], side="right" )
+        slice_counts = slice_counts + np.maximum( upper - lower, 0 )
+    return { slice_idx : int(c) for slice_idx,c in enumerate( slice_counts ) }
+
+# Extracts and writes every slice, handing slices out to idle MPI processes 
+# through the slice scheduler rather than assigning them round-robin up front
+#@timer
+def extract_slices_scheduled( graph, index, clock, rank_to_timestamp_interval_seq, 
+                              include_endpoints, output_dir, output_format, largest_first ):
+    extract_slice_sets_scheduled( graph, index, clock, 
+                                  [ ( rank_to_timestamp_interval_seq, output_dir ) ],
+                                  include_endpoints, output_format, largest_first )
+
+# Extracts and writes several sets of slices (e.g., one per slice length) from
+# the same graph and index, each set to its own output directory. All sets'
+# slices are handed out by the slice scheduler as one pool of tasks, identified
+# by ( set index, slice index ).
 #@timer
-def extract_barrier_delimited_full_slices( graph, ranks, include_endpoints, output_dir, output_format ):
+def extract_slice_sets_scheduled( graph, index, clock, slice_sets, include_endpoints, 
+                                  output_format, largest_first ):
+    tasks = []
+    for set_idx, ( rank_to_timestamp_interval_seq, _ ) in enumerate( slice_sets ):
+        ranks = list( rank_to_timestamp_interval_seq.keys() )
+        n_slices = len( rank_to_timestamp_interval_seq[ ranks[0] ] )
+        tasks += [ ( set_idx, slice_idx ) for slice_idx in range( n_slices ) ]
+    if comm.Get_rank() == 0 and largest_first:
+        slice_to_cost = {}
+        for set_idx, ( rank_to_timestamp_interval_seq, _ ) in enumerate( slice_sets ):
+            for slice_idx, count in get_slice_vertex_counts( index, clock, rank_to_timestamp_interval_seq ).items():
+                slice_to_cost[ ( set_idx, slice_idx ) ] = count
+    else:
+        slice_to_cost = None
+
+    def extract_and_write( task ):
+        set_idx, slice_idx = task
+        rank_to_timestamp_interval_seq, output_dir = slice_sets[ set_idx ]
+        # Get the mapping between ranks and timestamp intervals for this slice
+        rank_to_timestamp_interval = { rank : seq[ slice_idx ] for rank,seq in rank_to_timestamp_interval_seq.items() }
+        # Get the slice subgraph itself
+        slice_subgraph = extract_slice( graph, index, clock, rank_to_timestamp_interval, include_endpoints )
+        # Write the slice subgraph to file
+        write_slice( slice_subgraph, output_dir, slice_idx, output_format )
+        if len( slice_sets ) > 1:
+            print("Rank: {} extracted slice: {} to: {}".format( comm.Get_rank(), slice_idx, output_dir ))
+        else:
+            print("Rank: {} extracted slice: {}".format( comm.Get_rank(), slice_idx ))
+
+    schedule_slices( tasks, extract_and_write, slice_to_cost )
+
+#@timer
+def extract_barrier_delimited_full_slices( graph, index, ranks, include_endpoints, output_dir, output_format, streaming=False, largest_first=False ):
     # Get a map from MPI ranks to sequences of barrier vertices
-    rank_to_barrier_seq = get_rank_to_barrier_seq( graph, ranks )
-    # Get a map from MPI ranks to sequences of pairs of subsequent barrier 
-    # vertices.
+    rank_to_barrier_seq = get_rank_to_barrier_seq( index, ranks )
+    # Get a map from MPI ranks to sequences of pairs of logical timestamps of
+    # subsequent barrier vertices.
     # Example: Given an MPI rank "r" with an associated barrier sequence 
     # [ b_0, b_1, b_2, ... b_k-1 ], in this map, "r" would map to the sequence
-    # [ (b_0, b_1), (b_1, b_2), (b_2, b_3), ... (b_k-2, b_k-1) ]
-    rank_to_barrier_pair_seq = get_rank_to_barrier_pair_seq( rank_to_barrier_seq )
-    # Get a map from MPI ranks to sequences of pairs of logical timestamps
+    # [ (t(b_0), t(b_1)), (t(b_1), t(b_2)), ... (t(b_k-2), t(b_k-1)) ]
     # The reason why we do this is that we need to select all of the vertices
-    # between a pair of barriers, but that request needs to be phrased in terms 
-    # of some predicates on vertex attributes in order to use the select method
-    # of an igraph VertexSequence (i.e., to make the slice extraction fast).
-    # While in principle we could phrase these predicates in terms of wall-time,
+    # between a pair of barriers, and the index answers that request as a 
+    # binary search over each rank's vertices sorted by timestamp.
+    # While in principle we could phrase these intervals in terms of wall-time,
     # logical timestamps for each rank's sequence of vertices are guaranteed to
     # be monotonically increasing, so it is easy to prove that all of the 
     # vertices between the barriers are included. 
     clock = "logical"
-    rank_to_timestamp_interval_seq = {}
-    for rank,barrier_pair_seq in rank_to_barrier_pair_seq.items():
-        timestamp_interval_seq = []
-        for idx,barrier_pair in enumerate(barrier_pair_seq):
-            timestamp_interval = vertex_pair_to_timestamp_interval( barrier_pair, clock )
-            timestamp_interval_seq.append( timestamp_interval )
-        rank_to_timestamp_interval_seq[ rank ] = timestamp_interval_seq
-    
-    n_slices = len( rank_to_timestamp_interval_seq[0] )
-    
-    assigned_slices = assign_slices( n_slices )
-
-    print("Rank: {} assigned slices: {}".format( my_rank, assigned_slices ) )
+    rank_to_timestamp_interval_seq = get_rank_to_barrier_pair_interval_seq( index, rank_to_barrier_seq, clock )
 
-    # Select slice subgraphs based on timestamp bounds 
-    #n_slices = len( rank_to_timestamp_interval_seq[0] )
-    #for slice_idx in range( n_slices ):
-    for slice_idx in assigned_slices:
-        # Get the mapping between ranks and timestamp intervals for this slice
-        rank_to_timestamp_interval = { rank : seq[ slice_idx ] for rank,seq in rank_to_timestamp_interval_seq.items() }
-        # Get the slice subgraph itself
-        slice_subgraph = extract_slice( graph, clock, rank_to_timestamp_interval, include_endpoints )
-        # Write the slice subgraph to file
-        write_slice( slice_subgraph, output_dir, slice_idx, output_format )
-        print("Rank: {} extracted slice: {}".format(my_rank, slice_idx))
+    if streaming:
+        extract_slices_streaming( graph, index, clock, rank_to_timestamp_interval_seq, 
+                                  include_endpoints, output_dir, output_format )
+        return
+    
+    extract_slices_scheduled( graph, index, clock, rank_to_timestamp_interval_seq, 
+                              include_endpoints, output_dir, output_format, largest_first )
 
 ################################################################################
 
 
 #@timer
-def get_rank_to_timestamp_interval_seq_fixed_len( rank_to_barrier_seq, clock, slice_len ):
-    if clock == "logical":
-        timestamp_label = "logical_time"
-    elif clock == "wall":
-        timestamp_label = "wall_time"
-    else:
-        raise ValueError("Clock: {} is not supported".format(clock))
-    rank_to_timestamp_interval_seq = {}
-    for rank, barrier_seq in rank_to_barrier_seq.items():
-        timestamp_interval_seq = []
-        for barrier_vertex in barrier_seq:
-            timestamp_upper_bound = barrier_vertex[ timestamp_label ]
-            timestamp_lower_bound = max( timestamp_upper_bound - slice_len, 0 )
-            timestamp_interval_seq.append( ( timestamp_lower_bound, timestamp_upper_bound ) )
-        rank_to_timestamp_interval_seq[ rank ] = timestamp_interval_seq
-    return rank_to_timestamp_interval_seq
+def get_rank_to_timestamp_interval_seq_fixed_len( index, rank_to_barrier_seq, clock, slice_len ):
+    return get_rank_to_timestamp_interval_seqs_fixed_len( index, rank_to_barrier_seq, clock, [ slice_len ] )[0]
+
+# Returns the ranks and a ( rank x barrier ) array of the timestamps of each 
+# rank's barrier vertices
+def get_barrier_timestamps( index, rank_to_barrier_seq, clock ):
+    timestamps = index.get_timestamps( clock )
+    ranks = list( rank_to_barrier_seq.keys() )
+    barrier_counts = set( len( seq ) for seq in rank_to_barrier_seq.values() )
+    if len( barrier_counts ) > 1:
+        raise ValueError("Ranks have different numbers of barriers: {}".format( sorted( barrier_counts ) ))
+    n_barriers = barrier_counts.pop() if len( barrier_counts ) > 0 else 0
+    barrier_timestamps = np.zeros( ( len( ranks ), n_barriers ), dtype=np.float64 )
+    for i,rank in enumerate( ranks ):
+        barrier_timestamps[ i ] = timestamps[ rank_to_barrier_seq[ rank ] ]
+    return ranks, barrier_timestamps
+
+# Returns one map from ranks to sequences of timestamp intervals per slice 
+# length. The intervals of all slice lengths, ranks, and barriers are computed 
+# in one vectorized step as a ( slice length x rank x barrier ) array.
+#@timer
+def get_rank_to_timestamp_interval_seqs_fixed_len( index, rank_to_barrier_seq, clock, slice_lens ):
+    ranks, timestamp_upper_bounds = get_barrier_timestamps( index, rank_to_barrier_seq, clock )
+    slice_lens = np.asarray( slice_lens, dtype=np.float64 )
+    timestamp_lower_bounds = np.maximum( timestamp_upper_bounds[None,:,:] - slice_lens[:,None,None], 0 )
+    return [ { rank : list( zip( timestamp_lower_bounds[ l,i ], timestamp_upper_bounds[ i ] ) )
+               for i,rank in enumerate( ranks ) }
+             for l in range( len( slice_lens ) ) ]
 
 
 #@timer
-def extract_barrier_delimited_fixed_len_slices( graph, ranks, include_endpoints, clock, slice_len, output_dir, output_format ):
+def extract_barrier_delimited_fixed_len_slices( graph, index, ranks, include_endpoints, clock, slice_len, output_dir, output_format, streaming=False, largest_first=False ):
     # Get a map from MPI ranks to sequences of barrier vertices
-    rank_to_barrier_seq = get_rank_to_barrier_seq( graph, ranks )
+    rank_to_barrier_seq = get_rank_to_barrier_seq( index, ranks )
     # Get a map from MPI ranks to sequences of pairs of timestamps 
     # determined from the timestamp of each barrier and the slice length
-    rank_to_timestamp_interval_seq = get_rank_to_timestamp_interval_seq_fixed_len( rank_to_barrier_seq, clock, slice_len )
+    rank_to_timestamp_interval_seq = get_rank_to_timestamp_interval_seq_fixed_len( index, rank_to_barrier_seq, clock, slice_len )
+    if streaming:
+        extract_slices_streaming( graph, index, clock, rank_to_timestamp_interval_seq, 
+                                  include_endpoints, output_dir, output_format )
+        return
     # Extract slice subgraphs based on timestamp bounds
-    n_slices = len( rank_to_timestamp_interval_seq[0] )
-    for slice_idx in range( n_slices ):
-        # Get the mapping between ranks and timestamp intervals for this slice
-        rank_to_timestamp_interval = { rank : seq[ slice_idx ] for rank,seq in rank_to_timestamp_interval_seq.items() }
-        # Get the slice subgraph itself
-        slice_subgraph = extract_slice( graph, clock, rank_to_timestamp_interval, include_endpoints )
-        
-        #n_vertices = len( slice_subgraph.vs[:] )
-        #n_edges = len( slice_subgraph.es[:] )
-        #print("Extracted slice: {} / {} -- # vertices: {}, # edges: {}".format(slice_idx+1,n_slices,n_vertices,n_edges))
+    extract_slices_scheduled( graph, index, clock, rank_to_timestamp_interval_seq, 
+                              include_endpoints, output_dir, output_format, largest_first )
+
+# Returns the output directory of each slice length in a multi-length policy:
+# the directory a policy with just that slice length would be written to
+def get_multi_len_output_dirs( output_dir, slicing_policy, graph_path ):
+    output_dirs = []
+    for slice_len in slicing_policy["slice_len"]:
+        policy = dict( slicing_policy, slice_len=slice_len )
+        if output_dir is None:
+            output_dirs.append( make_output_dir( None, policy, graph_path ) )
+        else:
+            output_dirs.append( make_output_dir( output_dir + "_slice_len_" + str( slice_len ), policy, graph_path ) )
+    return output_dirs
+
+# Extracts barrier-delimited fixed-length slices for several slice lengths from
+# one index, each slice length's slices to their own output directory
+#@timer
+def extract_barrier_delimited_multi_len_slices( graph, index, ranks, include_endpoints, clock, slice_lens, output_dirs, output_format, streaming=False, largest_first=False ):
+    rank_to_barrier_seq = get_rank_to_barrier_seq( index, ranks )
+    interval_seqs = get_rank_to_timestamp_interval_seqs_fixed_len( index, rank_to_barrier_seq, clock, slice_lens )
+    if streaming:
+        # Each slice length is swept separately, since the sweep's cursors 
+        # follow one sequence of intervals
+        for rank_to_timestamp_interval_seq, output_dir in zip( interval_seqs, output_dirs ):
+            extract_slices_streaming( graph, index, clock, rank_to_timestamp_interval_seq, 
+                                      include_endpoints, output_dir, output_format )
+        return
+    extract_slice_sets_scheduled( graph, index, clock, list( zip( interval_seqs, output_dirs ) ),
+                                  include_endpoints, output_format, largest_first )
 
-        # Write the slice subgraph to file
+################################################################################
+############################ Streaming extraction ##############################
+################################################################################
+
+# Returns the ids of vertices outside the slice that share a cross-rank edge
+# with a vertex inside the slice. Out-edges and in-edges of the slice vertices
+# are gathered from the CSR adjacency, edges whose endpoints are on different
+# ranks are kept, and the endpoints not already in the slice are returned as a
+# sorted, duplicate-free array.
+def get_endpoint_vertex_ids( graph, process_ids, slice_vertices ):
+    slice_vertices = np.asarray( slice_vertices, dtype=np.int64 )
+    out_sources, out_targets = graph.out_edges( slice_vertices )
+    in_sources, in_targets = graph.in_edges( slice_vertices )
+    sources = np.concatenate( ( out_sources, in_sources ) )
+    targets = np.concatenate( ( out_targets, in_targets ) )
+    cross_rank = process_ids[ sources ] != process_ids[ targets ]
+    candidates = np.concatenate( ( sources[ cross_rank ], targets[ cross_rank ] ) )
+    return np.setdiff1d( candidates, slice_vertices )
+
+"""
+Extracts every assigned slice in one forward sweep over each rank's vertices
+in timestamp order. Each rank keeps a pair of cursors into its sorted vertex 
+sequence that only ever move forward; a slice's bucket is filled as the 
+cursors advance past the slice's vertices on every rank, and the slice is 
+written out and dropped as soon as its closing boundary (e.g., its delimiting
+barrier) has been passed on all ranks. The parent graph is never materialized
+as an igraph object: slice subgraphs are cut directly out of the (possibly
+memory-mapped) event_graph_arrays. Peak memory is nonetheless O(V + E) rather 
+than bounded by the open slice: the per-rank cursors move over the index, 
+which holds every vertex id and timestamp in sorted order (O(V)), and 
+including endpoints builds the graph's in-edge CSR (O(E)). Only the graph's 
+own columns stay memory-mapped. In node-shared mode both are held once per 
+node.
+
+Requires the per-rank interval sequences to be non-decreasing in both bounds,
+which holds for all barrier-delimited policies and for overlapping 
+fixed-length windows.
+"""
+#@timer
+def extract_slices_streaming( graph, index, clock, rank_to_timestamp_interval_seq, 
+                              include_endpoints, output_dir, output_format ):
+    ranks = list( rank_to_timestamp_interval_seq.keys() )
+    n_slices = len( rank_to_timestamp_interval_seq[ ranks[0] ] )
+    assigned_slices = sorted( assign_slices( n_slices ) )
+    print("Rank: {} assigned slices: {}".format( comm.Get_rank(), assigned_slices ) )
+    # Lower and upper cursor per rank, as positions in that rank's sorted order
+    rank_to_cursors = { rank : [ 0, 0 ] for rank in ranks }
+    for slice_idx in assigned_slices:
+        bucket = []
+        for rank in ranks:
+            lower_bound, upper_bound = rank_to_timestamp_interval_seq[ rank ][ slice_idx ]
+            vids, timestamps = index.get_sorted( rank, clock )
+            lower, upper = rank_to_cursors[ rank ]
+            # Advance both cursors, searching only the part of the sequence 
+            # that has not been swept yet
+            lower += np.searchsorted( timestamps[ lower: ], lower_bound, side="left" )
+            upper = max( upper, lower )
+            upper += np.searchsorted( timestamps[ upper: ], upper_bound, side="right" )
+            rank_to_cursors[ rank ] = [ lower, upper ]
+            bucket.append( vids[ lower:upper ] )
+        # The slice's closing boundary has now been passed on every rank
+        slice_vertices = np.unique( np.concatenate( bucket ) )
+        if include_endpoints:
+            endpoint_vertices = get_endpoint_vertices( index, slice_vertices )
+            slice_vertices = np.union1d( slice_vertices, endpoint_vertices )
+        slice_subgraph = graph.subgraph( slice_vertices )
         write_slice( slice_subgraph, output_dir, slice_idx, output_format )
+        print("Rank: {} extracted slice: {}".format( comm.Get_rank(), slice_idx ))
 
 ################################################################################
 
@@ -264,9 +526,9 @@ def extract_barrier_delimited_fixed_len_slices( graph, ranks, include_endpoints,
 ### Unvalidated stuff below
 
 #@timer
-def extract_barrier_delimited_fixed_size_slices( graph, slice_ranks, vertex_count ):
-    rank_to_barrier_seq = get_rank_to_barrier_seq( graph, slice_ranks )
-    n_barriers = len( rank_to_barrier_seq[0] )
+def extract_barrier_delimited_fixed_size_slices( graph, index, slice_ranks, vertex_count ):
+    rank_to_barrier_seq = get_rank_to_barrier_seq( index, slice_ranks )
+    n_barriers = len( rank_to_barrier_seq[ slice_ranks[0] ] )
     
     slice_seq = []
 
@@ -275,7 +537,7 @@ def extract_barrier_delimited_fixed_size_slices( graph, slice_ranks, vertex_coun
         rank_to_slice_vertices = {}
         # Add vertices from delimiting barrier
         for rank in rank_to_barrier_seq:
-            rank_to_slice_vertices[ rank ] = [ rank_to_barrier_seq[ rank ][ idx ] ]
+            rank_to_slice_vertices[ rank ] = [ graph.vs[ int( rank_to_barrier_seq[ rank ][ idx ] ) ] ]
 
         # Start working backwards
         n_vertices = 0
@@ -329,62 +591,70 @@ def extract_barrier_delimited_fixed_size_slices( graph, slice_ranks, vertex_coun
     return slice_seq
 
 
-#@timer
-def get_wall_time_slice_seq(  graph, time_unit, slice_len, slice_overlap ):
-    slice_vertices = []
-    slice_idx = 0
-
-    
-    all_wall_times = graph.vs[:]["wall_time"] 
-    min_wall_time = min( all_wall_times )
-    max_wall_time = max( all_wall_times )
-
-    n_ranks = 16
-    n_finalize_events = 0
-    while True:
-        wall_time_lower_bound = slice_idx * slice_len
-        wall_time_upper_bound = wall_time_lower_bound + slice_overlap
-
-        if wall_time_lower_bound > max_wall_time:
-            break
-
-        slice_vertices = graph.vs.select( wall_time_ge=wall_time_lower_bound,
-                                          wall_time_le=wall_time_upper_bound )
-        n_vertices = len(slice_vertices)
-        slice_idx += 1
-        print("Slice Index: {} - Wall-Time Lower Bound: {} -- Wall-Time Upper Bound: {} -- # vertices = {}".format(slice_idx, wall_time_lower_bound, wall_time_upper_bound, n_vertices))
-        
-
-#@timer 
-def get_logical_time_slice_seq_dense( graph, slice_len, slice_overlap, ranks, include_endpoints ):
-    slice_seq = []
-    n_procs = len(set(graph.vs[:]["process_id"]))
-    n_finalize_vertices_visited = 0
-    # Keep track of which slice we're on
-    slice_idx = 0
-    # Set logical time stamp bounds for first slice
-    lts_lower = slice_idx * slice_len
-    lts_upper = lts_lower + slice_len
-    while n_finalize_vertices_visited < n_procs:
-        # Extract slice w/r/t logical timestamp interval
-        slice_subgraph = get_slice_logical_timestamp_interval( graph, lts_lower, lts_upper, ranks, include_endpoints )
-        # Aggregate to slice sequence
-        slice_seq.append( slice_subgraph )
-        # update number of finalize vertices accounted for
-        n_finalize_vertices_visited += len( slice_subgraph.vs.select( event_type_eq="finalize" ) ) 
-        # update timestamp interval
-        lts_lower = lts_lower + slice_overlap
-        lts_upper = lts_lower + slice_len
-    return slice_seq
-    
+################################################################################
+####################### Overlapping fixed-length windows #######################
+################################################################################
 
+# Returns the start timestamps of a sequence of windows of length slice_len, 
+# each overlapping the previous one by slice_overlap, that starts at t_min and
+# ends with the first window that extends past t_max
+def get_sliding_window_starts( t_min, t_max, slice_len, slice_overlap ):
+    if slice_len <= 0 or not 0 <= slice_overlap < slice_len:
+        raise ValueError("Slice length: {} and overlap: {} must satisfy 0 <= overlap < length".format( slice_len, slice_overlap ))
+    stride = slice_len - slice_overlap
+    if t_max - t_min < slice_len:
+        n_windows = 1
+    else:
+        n_windows = int( np.floor( ( t_max - t_min - slice_len ) / stride ) ) + 2
+    return t_min + stride * np.arange( n_windows, dtype=np.float64 )
+
+# Returns a dict mapping each MPI rank to the sequence of timestamp intervals of
+# overlapping fixed-length windows over the requested ranks' vertices. The 
+# windows are the same for every rank. Windows are half-open, [start, start + 
+# slice_len), so that without overlap every vertex is in exactly one window; 
+# the intervals' upper bounds are the largest timestamps below each window's
+# end, since slice extraction treats intervals as closed.
+#@timer
+def get_rank_to_timestamp_interval_seq_sliding( index, ranks, clock, slice_len, slice_overlap ):
+    # Each rank's timestamps are sorted, so its extremes are at either end
+    sorted_timestamps = [ index.get_sorted( rank, clock )[1] for rank in ranks ]
+    sorted_timestamps = [ ts for ts in sorted_timestamps if len( ts ) > 0 ]
+    if len( sorted_timestamps ) == 0:
+        return { rank : [] for rank in ranks }
+    t_min = min( ts[0] for ts in sorted_timestamps )
+    t_max = max( ts[-1] for ts in sorted_timestamps )
+    lower_bounds = get_sliding_window_starts( t_min, t_max, slice_len, slice_overlap )
+    upper_bounds = np.nextafter( lower_bounds + slice_len, -np.inf )
+    intervals = list( zip( lower_bounds, upper_bounds ) )
+    return { rank : intervals for rank in ranks }
+
+# Extracts overlapping fixed-length windows w/r/t either clock. Unlike the 
+# barrier-delimited policies, this needs no barriers, so it applies to any
+# trace. Window vertices are found per rank by binary search in the index, or
+# in streaming mode by a single forward sweep, so each vertex is visited a 
+# constant number of times per window it belongs to.
+#@timer
+def extract_fixed_len_overlapping_slices( graph, index, ranks, include_endpoints, clock, slice_len, slice_overlap, output_dir, output_format, streaming=False, largest_first=False ):
+    rank_to_timestamp_interval_seq = get_rank_to_timestamp_interval_seq_sliding( index, ranks, clock, 
+                                                                                 slice_len, slice_overlap )
+    if streaming:
+        extract_slices_streaming( graph, index, clock, rank_to_timestamp_interval_seq, 
+                                  include_endpoints, output_dir, output_format )
+        return
+    extract_slices_scheduled( graph, index, clock, rank_to_timestamp_interval_seq, 
+                              include_endpoints, output_dir, output_format, largest_first )
 
 
 """
 Root MPI process reads in slicing policy, then broadcasts to rest
-All MPI processes read in graph independently
+All MPI processes read in graph independently. In streaming mode the graph is
+read as an event_graph_arrays object, which is memory-mapped for binary graphs.
+In node-shared mode, one process per node reads the graph into memory shared 
+by all processes on the node (see node_shared_graph), also as an 
+event_graph_arrays object. Only the graph's arrays are shared here; main then
+shares the per-rank timestamp index the same way.
 """
-def ingest_inputs( graph_path, slicing_policy_path ):
+def ingest_inputs( graph_path, slicing_policy_path, streaming=False, node_shared=False ):
     my_rank = comm.Get_rank()
     if my_rank == 0:
         with open( slicing_policy_path, "r" ) as infile:
@@ -392,7 +662,12 @@ def ingest_inputs( graph_path, slicing_policy_path ):
     else:
         slicing_policy = None
     slicing_policy = comm.bcast( slicing_policy, root=0 )
-    graph = read_graph( graph_path )
+    if node_shared:
+        graph = read_graph_arrays_node_shared( graph_path, comm )
+    elif streaming:
+        graph = read_graph_arrays( graph_path )
+    else:
+        graph = read_graph( graph_path )
     return graph, slicing_policy
 
 
@@ -403,9 +678,9 @@ def ingest_inputs( graph_path, slicing_policy_path ):
 
 # Extracts a sequence of subgraphs (referred to herein and elsewhere as "slices")
 # from an event graph
-def main( graph_path, slicing_policy_path, output_dir, output_format ):
+def main( graph_path, slicing_policy_path, output_dir, output_format, streaming=False, largest_first=False, node_shared=False ):
     ingest_start_time = time.time()
-    graph, slicing_policy = ingest_inputs( graph_path, slicing_policy_path )
+    graph, slicing_policy = ingest_inputs( graph_path, slicing_policy_path, streaming, node_shared )
     ingest_end_time = time.time()
     ingest_elapsed_time = ingest_end_time - ingest_start_time
     try:
@@ -417,8 +692,14 @@ def main( graph_path, slicing_policy_path, output_dir, output_format ):
     #print( "Rank: {}, ingestion time: {}, # vertices: {}, # edges: {}".format( my_rank, ingest_elapsed_time, n_vertices, n_edges ))
     comm.barrier()
     
-    # Determine, and if necessary, create output directory
-    output_dir = make_output_dir( output_dir, slicing_policy, graph_path )
+    # Determine, and if necessary, create output directory. A fixed-length 
+    # policy may list several slice lengths, each written to its own directory.
+    multi_len = ( slicing_policy["policy"] == "barrier_delimited_fixed_len" and 
+                  isinstance( slicing_policy["slice_len"], list ) )
+    if multi_len:
+        output_dirs = get_multi_len_output_dirs( output_dir, slicing_policy, graph_path )
+    else:
+        output_dir = make_output_dir( output_dir, slicing_policy, graph_path )
 
     #print("Rank: {} - Output Directory: {}".format( my_rank, output_dir ))
     #exit()
@@ -427,14 +708,24 @@ def main( graph_path, slicing_policy_path, output_dir, output_format ):
     allowed_formats = [ "adjacency", "dimacs", "dot", "graphviz", "edgelist", 
                         "edges", "edge", "gml", "graphml", "graphmlz", "gw",
                         "leda", "lgr", "lgl", "ncol", "net", "pajek", "pickle",
-                        "picklez", "svg" ]
+                        "picklez", "svg", binary_graph_format ]
     if output_format not in allowed_formats:
         raise ValueError( "Output format: {} not allowed".format( output_format ) )
 
+    # Build the per-rank timestamp index once. Every slicing policy below
+    # finds slice vertices through it. In node-shared mode it is built once 
+    # per node, sorted for the logical clock (used to find barriers) and the
+    # policy's clock.
+    if node_shared:
+        clocks = sorted( set( [ "logical", slicing_policy.get( "clock", "logical" ) ] ) )
+        index = rank_timestamp_index.node_shared( graph, clocks, comm )
+    else:
+        index = rank_timestamp_index( graph )
+
     # Unless a subset of ranks was passed as a command-line argument, we 
     # slice over all ranks in the event graph
     if slicing_policy["ranks"] == "all":
-        ranks = [ int(x) for x in set( graph.vs[:]["process_id"] ) ]
+        ranks = index.ranks()
     else:
         ranks = slicing_policy["ranks"]
 
@@ -449,45 +740,66 @@ def main( graph_path, slicing_policy_path, output_dir, output_format ):
 
     # Extract the full subgraphs between pairs of barriers
     if slicing_policy["policy"] == "barrier_delimited_full":
-        extract_barrier_delimited_full_slices( graph, ranks, include_endpoints, 
-                                               output_dir, output_format )
+        extract_barrier_delimited_full_slices( graph, index, ranks, include_endpoints, 
+                                               output_dir, output_format, streaming,
+                                               largest_first )
     
     # Extract subgraphs delimited on one end by a barrier and consisting of all
     # vertices later than a fixed amount of time prior to the barrier
+    elif slicing_policy["policy"] == "barrier_delimited_fixed_len" and multi_len:
+        clock = slicing_policy["clock"]
+        slice_lens = slicing_policy["slice_len"]
+        extract_barrier_delimited_multi_len_slices( graph, 
+                                                    index,
+                                                    ranks, 
+                                                    include_endpoints, 
+                                                    clock,
+                                                    slice_lens, 
+                                                    output_dirs, 
+                                                    output_format,
+                                                    streaming,
+                                                    largest_first )
+
     elif slicing_policy["policy"] == "barrier_delimited_fixed_len":
         clock = slicing_policy["clock"]
         slice_len = slicing_policy["slice_len"]
         extract_barrier_delimited_fixed_len_slices( graph, 
+                                                    index,
                                                     ranks, 
                                                     include_endpoints, 
                                                     clock,
                                                     slice_len, 
                                                     output_dir, 
-                                                    output_format )
-
-    # Extract sequence of overlapping slices based on logical time stamps
-
-    
+                                                    output_format,
+                                                    streaming,
+                                                    largest_first )
 
+    # Extract a sequence of overlapping fixed-length windows w/r/t either 
+    # logical or wall time
+    elif slicing_policy["policy"] == "fixed_len_overlapping":
+        clock = slicing_policy["clock"]
+        slice_len = slicing_policy["slice_len"]
+        slice_overlap = slicing_policy.get( "slice_overlap", 0 )
+        extract_fixed_len_overlapping_slices( graph, 
+                                              index,
+                                              ranks, 
+                                              include_endpoints, 
+                                              clock,
+                                              slice_len, 
+                                              slice_overlap,
+                                              output_dir, 
+                                              output_format,
+                                              streaming,
+                                              largest_first )
 
     ## Extract subgraphs delimited on one end by a barrier and consisting of a 
     ## fixed number of vertices. 
     #elif slicing_policy["policy"] == "barrier_delimited_fixed_size_num_vertices":
     #    n_vertices = slicing_policy["slice_size_vertices"]
-    #    extract_barrier_delimited_fixed_size_slices( graph, ranks, n_vertices )
-    #
-    #    
-    #    
-    #elif slicing_policy["policy"] == "wall_time":
-    #    time_unit = slicing_policy["time_unit"]
-    #    slice_len = slicing_policy["slice_len"]
-    #    slice_overlap = slicing_policy["slice_overlap"]
-    #    slice_seq = get_wall_time_slice_seq( graph, time_unit, slice_len, slice_overlap )
-
-    #elif slicing_policy["policy"] == "logical_time_dense":
-    #    slice_len = slicing_policy["slice_len"]
-    #    slice_overlap = slicing_policy["slice_overlap"]
-    #    slice_seq = get_logical_time_slice_seq_dense( graph, slice_len, slice_overlap, ranks, include_endpoints )
+    #    extract_barrier_delimited_fixed_size_slices( graph, index, ranks, n_vertices )
+
+    else:
+        raise NotImplementedError("Slicing policy: {} not supported".format( slicing_policy["policy"] ))
     
     comm.barrier()
                                
@@ -496,7 +808,7 @@ if __name__ == "__main__":
     desc = ""
     parser = argparse.ArgumentParser(description=desc)
     parser.add_argument("graph_path",
-                        help="Path to a GraphML file representing an event graph")
+                        help="Path to a GraphML or binary (.egb) file representing an event graph")
     parser.add_argument("slicing_policy",
                         help="Path to a JSON file describing how to slice the event graph")
     parser.add_argument("-o", "--output_dir", default=None,
@@ -504,14 +816,21 @@ if __name__ == "__main__":
                         help="Directory to write slices to. Optional.")
     parser.add_argument("-f", "--output_format",
                         action="store", type=str, default="graphml", required=False,
-                        help="Format to write slices as. Optional. Default: graphml")
+                        help="Format to write slices as. Use \"egb\" for the binary event graph format. Optional. Default: graphml")
+    parser.add_argument("-s", "--streaming", action="store_true", default=False,
+                        help="Extract all slices in a single forward sweep, cutting them directly out of the event graph's arrays rather than building the parent graph as an igraph object. Binary (.egb) input is memory-mapped. Memory is still O(V + E): the per-rank timestamp index takes about 17 bytes per vertex, and including endpoints adds the in-edge adjacency, about 16 bytes per edge plus 8 per vertex. Combine with --node_shared to hold these once per node. Optional.")
+
+    parser.add_argument("--largest_first", action="store_true", default=False,
+                        help="Dispatch slices to processes in decreasing order of their number of vertices. Ignored in streaming mode. Optional.")
+    parser.add_argument("--node_shared", action="store_true", default=False,
+                        help="Read the event graph, and build the per-rank timestamp index over its vertices, once per node in shared memory that all MPI processes on the node use, rather than once per process. Reduces the ingest time and the memory per node taken by the graph and the index by roughly the number of processes per node. Slices are still extracted and held by each process. Optional.")
 
     args = parser.parse_args()
    
     my_rank = comm.Get_rank()
     start_time = time.time()
     
-    main( args.graph_path, args.slicing_policy, args.output_dir, args.output_format )
+    main( args.graph_path, args.slicing_policy, args.output_dir, args.output_format, args.streaming, args.largest_first, args.node_shared )
     
     end_time = time.time()
     elapsed = end_time - start_time
@@ -1,7 +1,6 @@
 #!/usr/bin/env python3
 
 import argparse
-import pickle as pkl
 import pprint
 
 # For analyzing ELF files and DWARF debugging information
@@ -10,6 +9,7 @@ from elftools.dwarf.descriptions import describe_form_class
 from elftools.elf.elffile import ELFFile
 
 from callstack_analysis import validate, decode_address, lookup_location
+from kdts_store import load_kdts
 
 def get_addresses( kdts ):
     all_addresses = set()
@@ -40,8 +40,7 @@ def translate_addresses( addresses, executable_path ):
 
 
 def main( kdts_path, executable_path ):
-    with open( kdts_path, "rb" ) as infile:
-        kdts = pkl.load( infile )
+    kdts = load_kdts( kdts_path )
 
     addresses = get_addresses( kdts )
 
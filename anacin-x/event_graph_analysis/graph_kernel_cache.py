@@ -0,0 +1,141 @@
+import os
+import glob
+import json
+import hashlib
+import pickle as pkl
+
+import sys
+sys.path.append(".")
+
+from utilities import write_atomic
+
+"""
+Persistent, content-addressed cache of per-slice graph kernel intermediates.
+
+Entries are keyed by a hash of the contents of a slice's subgraph files (one
+per run) together with what is being cached (e.g., "kernel_matrix") and the
+parameters it was computed with (e.g., the kernel and label). Since the key
+only depends on file contents, cached entries stay valid when slices are moved
+or renamed and are invalidated automatically when a slice is re-extracted
+differently.
+
+Each entry is a pickle file written atomically, so any number of MPI processes
+can share one cache directory. The cache is bounded in size: when it grows
+beyond its budget, the least recently used entries are evicted, where use is
+tracked by each entry's modification time, until the cache is back down to a
+fraction of its budget. Eviction lists the whole cache directory, so leaving
+headroom keeps it from running again on every later put. With concurrent 
+writers the bound is enforced approximately, since each process only 
+re-measures the cache when its own estimate exceeds the budget.
+"""
+
+_entry_ext = ".pkl"
+
+# Fraction of the size budget that eviction shrinks the cache to
+_low_water_fraction = 0.8
+
+"""
+Hashes the contents of a file in chunks
+"""
+def hash_file( path, chunk_size=1<<20 ):
+    digest = hashlib.sha256()
+    with open( path, "rb" ) as infile:
+        for chunk in iter( lambda: infile.read( chunk_size ), b"" ):
+            digest.update( chunk )
+    return digest.hexdigest()
+
+class graph_kernel_cache(object):
+    def __init__(self, cache_dir, max_size_bytes=10*(1<<30)):
+        # Without a cache directory, the cache is disabled: lookups always miss
+        # and nothing is stored
+        self._cache_dir = cache_dir
+        self._max_size_bytes = max_size_bytes
+        self._size_bytes = 0
+        if self.enabled():
+            os.makedirs( self._cache_dir, exist_ok=True )
+            self._size_bytes = sum( size for _,_,size in self._list_entries() )
+
+    def enabled(self):
+        return self._cache_dir is not None
+
+    def get_slice_key(self, slice_paths):
+        """
+        Content hash identifying a slice, i.e., one subgraph file per run
+        """
+        if not self.enabled():
+            return None
+        digest = hashlib.sha256()
+        for path in slice_paths:
+            digest.update( hash_file( path ).encode() )
+        return digest.hexdigest()
+
+    def _get_entry_path(self, slice_key, kind, params):
+        description = json.dumps( [ slice_key, kind, params ], default=str )
+        entry_key = hashlib.sha256( description.encode() ).hexdigest()
+        return os.path.join( self._cache_dir, entry_key[:2], entry_key + _entry_ext )
+
+    def get(self, slice_key, kind, params):
+        """
+        Returns the cached value, or None if not present
+        """
+        if not self.enabled():
+            return None
+        path = self._get_entry_path( slice_key, kind, params )
+        try:
+            with open( path, "rb" ) as infile:
+                value = pkl.load( infile )
+            # Mark as recently used
+            os.utime( path )
+        except (FileNotFoundError, EOFError, pkl.UnpicklingError):
+            return None
+        return value
+
+    def put(self, slice_key, kind, params, value):
+        if not self.enabled():
+            return
+        path = self._get_entry_path( slice_key, kind, params )
+        os.makedirs( os.path.dirname( path ), exist_ok=True )
+        write_atomic( value, path, lambda v,f: pkl.dump( v, f, pkl.HIGHEST_PROTOCOL ) )
+        self._size_bytes += os.path.getsize( path )
+        if self._size_bytes > self._max_size_bytes:
+            self._evict()
+
+    def get_or_compute(self, slice_key, kind, params, compute_fn):
+        """
+        Returns the cached value if present. Otherwise computes, caches, and
+        returns it.
+        """
+        value = self.get( slice_key, kind, params )
+        if value is None:
+            value = compute_fn()
+            self.put( slice_key, kind, params, value )
+        return value
+
+    def _list_entries(self):
+        entries = []
+        for path in glob.glob( os.path.join( self._cache_dir, "*", "*" + _entry_ext ) ):
+            try:
+                stat = os.stat( path )
+            except FileNotFoundError:
+                continue
+            entries.append( ( stat.st_mtime, path, stat.st_size ) )
+        return entries
+
+    def _evict(self):
+        """
+        Removes least recently used entries until the cache is down to its 
+        low-water mark
+        """
+        entries = sorted( self._list_entries() )
+        size_bytes = sum( size for _,_,size in entries )
+        target_size_bytes = int( self._max_size_bytes * _low_water_fraction )
+        for _, path, size in entries:
+            if size_bytes <= target_size_bytes:
+                break
+            try:
+                os.remove( path )
+            except FileNotFoundError:
+                # Already evicted by another process
+                pass
+            size_bytes -= size
+        self._size_bytes = size_bytes
@@ -10,52 +10,138 @@ For details on similarity -> distance formulat, see [1].
    kernel distance. arXiv preprint arXiv:1103.1625.
 """
 #@timer
-def convert_to_distance_matrix( kernel_mat ):
-    n_rows = len( kernel_mat )
-    n_cols = len( kernel_mat[0] )
+def convert_to_distance_matrix( kernel_mat, rtol=1e-9 ):
+    kernel_mat = np.asarray( kernel_mat, dtype=np.float64 )
+    n_rows, n_cols = kernel_mat.shape
     assert( n_rows == n_cols )
-    dist_mat = np.zeros( ( n_rows, n_cols ) )
-    for i in range(n_rows):
-        for j in range(n_cols):
-            self_similarity = kernel_mat[i][i] + kernel_mat[j][j]
-            cross_similarity = 2*kernel_mat[i][j]
-            kernel_distance = np.sqrt( self_similarity - cross_similarity )
-            dist_mat[i][j] = kernel_distance
-    return dist_mat
+    diagonal = np.diag( kernel_mat )
+    return convert_to_distance_block( kernel_mat, diagonal, diagonal, rtol )
 
+"""
+Converts the kernel values between two sets of graphs into distances, given 
+each graph's self-similarity
+"""
+def convert_to_distance_block( kernel_block, row_self_similarities, col_self_similarities, rtol=1e-9 ):
+    kernel_block = np.asarray( kernel_block, dtype=np.float64 )
+    row_self_similarities = np.asarray( row_self_similarities, dtype=np.float64 )
+    col_self_similarities = np.asarray( col_self_similarities, dtype=np.float64 )
+    squared_dist_mat = ( row_self_similarities[:,None] + col_self_similarities[None,:] ) - 2*kernel_block
+    # Self-similarity can fall short of cross-similarity by a rounding error for
+    # (near-)identical graphs. Clamp those tiny negative values to zero rather 
+    # than letting them become NaN. Larger violations are left as NaN; they 
+    # indicate an invalid kernel matrix (see validate_kernel_matrix).
+    self_similarities = np.concatenate( ( row_self_similarities, col_self_similarities ) )
+    tol = rtol * max( 1.0, np.abs( self_similarities ).max() ) if len( self_similarities ) > 0 else 0.0
+    squared_dist_mat[ ( squared_dist_mat < 0 ) & ( squared_dist_mat >= -tol ) ] = 0.0
+    with np.errstate( invalid="ignore" ):
+        return np.sqrt( squared_dist_mat )
+
+"""
+Computes K[i][i] + K[j][j] - 2*K[i][j] for all pairs at once by broadcasting 
+the diagonal
+"""
+def get_squared_distance_matrix( kernel_mat ):
+    kernel_mat = np.asarray( kernel_mat, dtype=np.float64 )
+    n_rows, n_cols = kernel_mat.shape
+    assert( n_rows == n_cols )
+    diagonal = np.diag( kernel_mat )
+    return ( diagonal[:,None] + diagonal[None,:] ) - 2*kernel_mat
+
+"""
+Approximate summary of the pairwise kernel distances between a set of graphs,
+as computed in approximate mode (see approximate_kernel_distances): the 
+distances of a sample of pairs, their quantiles with confidence bounds, and the
+error of the approximation measured against exact distances on a sample of 
+graphs. Stands in for the full distance matrix in kernel distance time series
+data, and is accepted by flatten_distance_matrix and get_distance_pairs.
+"""
+class sampled_distances(object):
+    def __init__(self, n_graphs, rows, cols, distances, 
+                 quantile_levels, quantiles, quantile_bounds, error):
+        self.n_graphs = n_graphs
+        self.rows = rows
+        self.cols = cols
+        self.distances = distances
+        self.quantile_levels = quantile_levels
+        self.quantiles = quantiles
+        self.quantile_bounds = quantile_bounds
+        self.error = error
+
+    def __len__(self):
+        return self.n_graphs
+
+    @property
+    def median(self):
+        return float( np.median( self.distances ) ) if len( self.distances ) > 0 else np.nan
+
+"""
+Returns the distances below the diagonal, i.e., one distance per pair of graphs,
+as a flat array. Distances are in row-major order: (1,0), (2,0), (2,1), (3,0), ...
+For sampled distances, returns the distances of the sampled pairs.
+"""
 def flatten_distance_matrix( dist_mat ):
-    n_rows = len( dist_mat )
-    n_cols = len( dist_mat[0] )
+    if isinstance( dist_mat, sampled_distances ):
+        return dist_mat.distances
+    dist_mat = np.asarray( dist_mat )
+    n_rows, n_cols = dist_mat.shape
     assert( n_rows == n_cols )
-    distances = []
-    for i in range( n_rows ):
-        for j in range( n_cols ):
-            if i > j:
-                distances.append( dist_mat[i][j] )
-    return distances
-                
-    
+    rows, cols = np.tril_indices( n_rows, k=-1 )
+    return dist_mat[ rows, cols ]
+
+"""
+Flattens a sequence of distance matrices (or sampled distances) into a single
+( n_matrices x n_pairs ) array whose rows are the matrices' flattened distances
+(see flatten_distance_matrix). Distance matrices of the same size are flattened
+together in one indexing operation. If the matrices have different numbers of 
+pairs, shorter rows are padded with NaN.
+"""
+def stack_flattened_distance_matrices( dist_mats ):
+    dist_mats = list( dist_mats )
+    sizes = [ len( d.distances ) if isinstance( d, sampled_distances ) else len( d ) * ( len( d ) - 1 ) // 2
+              for d in dist_mats ]
+    stacked = np.full( ( len( dist_mats ), max( sizes, default=0 ) ), np.nan, dtype=np.float64 )
+    shape_to_positions = {}
+    for i,d in enumerate( dist_mats ):
+        if isinstance( d, sampled_distances ):
+            stacked[ i, :sizes[i] ] = d.distances
+        else:
+            shape_to_positions.setdefault( np.shape( d ), [] ).append( i )
+    for shape, positions in shape_to_positions.items():
+        n_rows, n_cols = shape
+        assert( n_rows == n_cols )
+        rows, cols = np.tril_indices( n_rows, k=-1 )
+        stacked[ positions, :len( rows ) ] = np.stack( [ np.asarray( dist_mats[i], dtype=np.float64 ) 
+                                                         for i in positions ] )[ :, rows, cols ]
+    return stacked
+
+"""
+Returns the graph pair ( row, col ) of every distance returned by 
+flatten_distance_matrix, in the same order
+"""
+def get_distance_pairs( dist_mat ):
+    if isinstance( dist_mat, sampled_distances ):
+        return list( zip( dist_mat.rows.tolist(), dist_mat.cols.tolist() ) )
+    rows, cols = np.tril_indices( len( dist_mat ), k=-1 )
+    return list( zip( rows.tolist(), cols.tolist() ) )
 
 """                                                                             
 Checks that kernel matrix is eligible to be converted into a distance matrix.   
 Specifically, we check that sum of self-similarities for graphs G and G' is     
-always greater than 2 * cross-similarity of G and G'                            
+always greater than 2 * cross-similarity of G and G'. All pairs are checked at
+once; the (expensive) isomorphism test is only run for the pairs that fail.
 """                                                                             
 #@timer                                                                          
 def validate_kernel_matrix( kernel_mat, graphs ):                                        
-    n_graphs = len(kernel_mat)                                                           
-    for i in range( n_graphs ):                                                 
-        for j in range( n_graphs ):                                             
-            self_similarity = kernel_mat[i][i] + kernel_mat[j][j]
-            cross_similarity = 2*kernel_mat[i][j]                                        
-            if self_similarity < cross_similarity:                              
-                graph_i = graphs[i]                                             
-                graph_j = graphs[j]                                             
-                iso = graph_i.isomorphic( graph_j )                             
-                if not iso:                                                     
-                    err_str = ( "Self-similarity less than cross-similarity for"
-                                " non-isomorphic graphs\n")
-                    err_str += "K[{}][{}] = {}\n".format(i, i, K[i][i])
-                    err_str += "K[{}][{}] = {}\n".format(j, j, K[j][j])
-                    err_str += "K[{}][{}] = {}\n".format(i, j, K[i][j])         
-                    raise RuntimeError( err_str ) 
+    K = np.asarray( kernel_mat, dtype=np.float64 )
+    violations = get_squared_distance_matrix( K ) < 0
+    # Each unordered pair only needs to be checked once
+    rows, cols = np.nonzero( np.triu( violations | violations.T, k=1 ) )
+    for i,j in zip( rows, cols ):
+        iso = graphs[i].isomorphic( graphs[j] )
+        if not iso:
+            err_str = ( "Self-similarity less than cross-similarity for"
+                        " non-isomorphic graphs\n")
+            err_str += "K[{}][{}] = {}\n".format(i, i, K[i][i])
+            err_str += "K[{}][{}] = {}\n".format(j, j, K[j][j])
+            err_str += "K[{}][{}] = {}\n".format(i, j, K[i][j])
+            raise RuntimeError( err_str ) 
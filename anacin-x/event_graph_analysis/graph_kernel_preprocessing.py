@@ -1,6 +1,11 @@
 import igraph 
 import numpy as np
-from utilities import timer
+from utilities import ( timer, 
+                        event_graph_arrays, 
+                        get_vertex_values, 
+                        set_vertex_values, 
+                        get_vertex_count
+                      )
 import pprint
 
 legal_vertex_labels = [ "event_type", 
@@ -74,36 +79,56 @@ def convert_to_grakel_graph( graph, label_request ):
     return [ edge_list, vid_to_label, eid_to_label ]
 
 
+"""
+Returns the graph's edges as arrays of source and target vertex ids, in edge id
+order. Accepts either an igraph graph or an event_graph_arrays object, whose 
+edges are in the order read_graph would give them.
+"""
+def get_edge_arrays( graph ):
+    if isinstance( graph, event_graph_arrays ):
+        return graph.file_order_edge_list()
+    edges = np.asarray( graph.get_edgelist(), dtype=np.int64 ).reshape( -1, 2 )
+    return edges[:,0], edges[:,1]
+
+"""
+Labels each vertex with the largest logical time increment over its incoming
+edges, or 0 if it has none. The increments of all edges are computed at once 
+and reduced per target vertex.
+"""
 def add_logical_tick_labels(graph):
-    for v in graph.vs[:]:
-        preds = v.predecessors()
-        if len(preds) > 0:
-            pred_logical_times = [ p["logical_time"] for p in preds ]
-            tick = max([v["logical_time"] - lts for lts in pred_logical_times])
-            v["logical_tick"] = tick
-        else:
-            v["logical_tick"] = 0
+    sources, targets = get_edge_arrays( graph )
+    logical_times = np.asarray( graph.vs[:]["logical_time"] )
+    increments = logical_times[ targets ] - logical_times[ sources ]
+    ticks = np.zeros( graph.vcount(), dtype=increments.dtype )
+    if len( targets ) > 0:
+        order = np.argsort( targets, kind="stable" )
+        vertices, starts = np.unique( targets[ order ], return_index=True )
+        ticks[ vertices ] = np.maximum.reduceat( increments[ order ], starts )
+    graph.vs[:]["logical_tick"] = ticks.tolist()
     return graph
 
 
 
 
+"""
+Labels each vertex with the logical and wall time increments along its last 
+incoming edge (in edge order), or 0 if it has none. Both labels are computed 
+with a few array gathers over the edge list. Accepts either an igraph graph or
+an event_graph_arrays object.
+"""
 def compute_extra_labels( graph ):
-    logical_time_increments = [ 0 ] * len(graph.vs[:])
-    wall_time_increments = [ 0 ] * len(graph.vs[:])
-    for edge in graph.es[:]:
-        src_vertex = graph.vs[ edge.source ]
-        dst_vertex = graph.vs[ edge.target ]
-        # Update logical time increment
-        logical_time_increment = dst_vertex["logical_time"] - src_vertex["logical_time"]
-        logical_time_increments[ edge.target ] = logical_time_increment
-        # Update logical time increment
-        wall_time_increment = dst_vertex["wall_time"] - src_vertex["wall_time"]
-        wall_time_increments[ edge.target ] = wall_time_increment
-    # Add logical time increment vertex label
-    graph.vs[:]["logical_tick"] = logical_time_increments
-    # Add wall time increment vertex label
-    graph.vs[:]["wall_time_increment"] = wall_time_increments
+    sources, targets = get_edge_arrays( graph )
+    # Find each target vertex's last incoming edge: the first occurrence of
+    # the vertex when the targets are scanned in reverse
+    vertices, reversed_positions = np.unique( targets[::-1], return_index=True )
+    last_edges = len( targets ) - 1 - reversed_positions
+    last_sources = sources[ last_edges ]
+    for clock_attr, label in [ ( "logical_time", "logical_tick" ), 
+                               ( "wall_time", "wall_time_increment" ) ]:
+        timestamps = np.asarray( get_vertex_values( graph, clock_attr ) )
+        increments = np.zeros( get_vertex_count( graph ), dtype=timestamps.dtype )
+        increments[ vertices ] = timestamps[ vertices ] - timestamps[ last_sources ]
+        set_vertex_values( graph, label, increments )
     
     ## Add adjusted logical time 
     #pids = set(graph.vs[:]["process_id"])
@@ -118,8 +143,133 @@ def compute_extra_labels( graph ):
 
 
 
-def get_relabeled_graphs( graphs, kernels ):
+"""
+Shared topology of a set of graphs (e.g., one slice's subgraphs across runs):
+the disjoint union of all of the graphs' edges in CSR form, plus each graph's
+vertex range in the union. Since the CSR edges are sorted by source vertex and
+each graph's vertices are contiguous, each graph's edges are contiguous too.
+Built once and shared by every relabeling of the same graphs. Graphs may be 
+igraph graphs or event_graph_arrays objects.
+"""
+class graph_set_topology(object):
+    def __init__(self, graphs):
+        n_vertices = np.array( [ get_vertex_count( g ) for g in graphs ], dtype=np.int64 )
+        self.vertex_offsets = np.zeros( len( graphs ) + 1, dtype=np.int64 )
+        np.cumsum( n_vertices, out=self.vertex_offsets[1:] )
+        self.graph_ids = np.repeat( np.arange( len( graphs ), dtype=np.int64 ), n_vertices )
+        edges = [ np.column_stack( get_edge_arrays( g ) ) + self.vertex_offsets[i]
+                  for i,g in enumerate( graphs ) ]
+        edges = np.concatenate( edges ) if len( edges ) > 0 else np.zeros( ( 0, 2 ), dtype=np.int64 )
+        self.csr = event_graph_arrays.from_edge_list( self.n_vertices, edges[:,0], edges[:,1] )
+        self.sources, self.targets = self.csr.edge_list()
+        self.edge_offsets = np.asarray( self.csr.indptr[ self.vertex_offsets ], dtype=np.int64 )
+
+    def __len__(self):
+        return len( self.vertex_offsets ) - 1
+
+    @property
+    def n_vertices(self):
+        return int( self.vertex_offsets[-1] )
+
+    def get_graph_edges(self, graph_idx):
+        """
+        Returns ( sources, targets ) of one graph's edges in its own vertex ids
+        """
+        start, stop = self.edge_offsets[ graph_idx ], self.edge_offsets[ graph_idx+1 ]
+        offset = self.vertex_offsets[ graph_idx ]
+        return self.sources[ start:stop ] - offset, self.targets[ start:stop ] - offset
+
+    def get_vertex_values(self, graphs, name):
+        """
+        Concatenates a vertex attribute of every graph in union vertex order
+        """
+        values = [ np.asarray( get_vertex_values( g, name ) ) for g in graphs if get_vertex_count( g ) > 0 ]
+        return np.concatenate( values ) if len( values ) > 0 else np.zeros( 0, dtype=np.int64 )
+
+"""
+Lightweight view of a set of graphs relabeled for one kernel / label pair: the
+shared topology plus the label arrays the kernel needs, indexed by union vertex
+or CSR edge id. Kernel implementations that work on arrays (e.g., wl_kernel)
+consume the view directly. Graphs are only materialized as igraph objects for
+backends that require them.
+"""
+class relabeled_graph_set(object):
+    def __init__(self, topology, vertex_label_name=None, vertex_labels=None, 
+                 edge_label_name=None, edge_labels=None):
+        self.topology = topology
+        self.vertex_label_name = vertex_label_name
+        self.vertex_labels = vertex_labels
+        self.edge_label_name = edge_label_name
+        self.edge_labels = edge_labels
+
+    def __len__(self):
+        return len( self.topology )
+
+    def get_union_arrays(self):
+        """
+        Returns ( n_vertices, graph_ids, vertex_labels, sources, targets ) of
+        the disjoint union of the graphs
+        """
+        t = self.topology
+        return t.n_vertices, t.graph_ids, self.vertex_labels, t.sources, t.targets
+
+    def to_igraph(self):
+        """
+        Materializes the relabeled graphs as igraph objects
+        """
+        t = self.topology
+        graphs = []
+        for i in range( len( t ) ):
+            sources, targets = t.get_graph_edges( i )
+            n_vertices = int( t.vertex_offsets[i+1] - t.vertex_offsets[i] )
+            g = igraph.Graph( n_vertices, 
+                              edges=np.column_stack( ( sources, targets ) ).tolist(),
+                              directed=True )
+            if self.vertex_labels is not None:
+                g.vs[:][ self.vertex_label_name ] = self.vertex_labels[ t.vertex_offsets[i]:t.vertex_offsets[i+1] ].tolist()
+            if self.edge_labels is not None:
+                g.es[:][ self.edge_label_name ] = self.edge_labels[ t.edge_offsets[i]:t.edge_offsets[i+1] ].tolist()
+            graphs.append( g )
+        return graphs
+
+"""
+Maps arbitrary label values to integer codes. If the campaign's label 
+vocabulary covers the label, its codes are used, so that they are the same in 
+every run and slice. Otherwise, codes are only consistent across the given 
+values.
+"""
+def encode_labels( values, label=None, vocabulary=None ):
+    if vocabulary is not None and label in vocabulary:
+        return vocabulary.encode( label, values )
+    _, codes = np.unique( values, return_inverse=True )
+    return codes.ravel().astype( np.int64 )
+
+"""
+Relabels a set of graphs for comparison with one kernel. Returns a 
+relabeled_graph_set sharing the given topology of the graphs, which is built
+if not given. String-valued labels are encoded with the label vocabulary if 
+one is given.
+"""
+def relabel_graph_set( graphs, name, label, topology=None, vocabulary=None ):
+    if topology is None:
+        topology = graph_set_topology( graphs )
+    # Relabel for Weisfeiler-Lehman Subtree Pattern kernel 
+    if name == "wlst":
+        return relabeled_graph_set( topology, "label", get_wlst_labels( graphs, topology, label, vocabulary ) )
+    # Relabel for edge-histogram kernel 
+    elif name == "eh":
+        return relabeled_graph_set( topology, edge_label_name=label, 
+                                    edge_labels=get_eh_labels( graphs, topology, label ) )
+    # Relabel for vertex-histogram kernel
+    elif name == "vh":
+        return relabeled_graph_set( topology, label, get_vh_labels( graphs, topology, label, vocabulary ) )
+    else:
+        raise NotImplementedError("Kernel: {} not supported".format(name))
+
+def get_relabeled_graphs( graphs, kernels, vocabulary=None ):
     all_relabeled_graphs = {}
+    # All relabelings share one copy of the graphs' topology
+    topology = None
     for kernel in kernels:
         # Which graph kernel are we relabeling for?
         name = kernel[ "name" ]
@@ -137,16 +287,9 @@ def get_relabeled_graphs( graphs, kernels ):
         # use the same relabeled graphs (e.g., multiple WL kernels with the same
         # label but different numbers of WL iterations)
         if key not in all_relabeled_graphs:
-            # Relabel for Weisfeiler-Lehman Subtree-Pattern kernel 
-            if name == "wlst":
-                relabeled_graphs = [ relabel_for_wlst_kernel(g, label) for g in graphs ]
-            # Relabel for edge-histogram kernel 
-            elif name == "eh":
-                relabeled_graphs = [ relabel_for_eh_kernel(g, label) for g in graphs ]
-            # Relabel for vertex-histogram kernel
-            elif name == "vh":
-                relabeled_graphs = [ relabel_for_vh_kernel(g, label) for g in graphs ]
-            all_relabeled_graphs[ key ] = relabeled_graphs
+            if topology is None:
+                topology = graph_set_topology( graphs )
+            all_relabeled_graphs[ key ] = relabel_graph_set( graphs, name, label, topology, vocabulary )
     return all_relabeled_graphs
 
 
@@ -154,88 +297,67 @@ def get_relabeled_graphs( graphs, kernels ):
 Returns a copy of the graph with no vertex or edge labels
 """
 def label_free_copy( graph ):
-    n_vertices = len(graph.vs[:])
-    copy = igraph.Graph(n_vertices, directed=True)
-    edges = [ (e.source, e.target) for e in graph.es[:] ]
-    copy.add_edges( edges )
-    return copy
+    return igraph.Graph( graph.vcount(), edges=graph.get_edgelist(), directed=True )
 
-# Relabels a graph for comparison using the graphkernels Weisfeiler-Lehman 
-# Subtree Pattern kernel
-#@timer
-def relabel_for_wlst_kernel( graph, label="dummy" ):
-    # Copy the graph
-    n_vertices = len(graph.vs[:])
-    relabeled_graph = igraph.Graph(n_vertices, directed=True)
+# Integer vertex labels of a set of graphs for the Weisfeiler-Lehman Subtree
+# Pattern kernel
+def get_wlst_labels( graphs, topology, label="dummy", vocabulary=None ):
+    n_vertices = np.diff( topology.vertex_offsets )
     # If a label was specified, use it. Otherwise, put no label so that the 
     # WL kernel impl. supplies its own labels
     if label == "dummy":
-        labels = [ 0 ] * len(graph.vs[:])
+        return np.zeros( topology.n_vertices, dtype=np.int64 )
     elif label == "random":
-        labels = [ np.random.randint(len(graph.vs[:])) ] * len(graph.vs[:])
-    else:
-        # Weisfeiler-Lehman kernel impl. in graphkernels only accepts 
-        # integer-valued labels
-        try:
-            label_val = int(graph.vs[0][label])
-            # Apply labels directly to the copy's vertices
-            labels = [ int(label_val) for label_val in graph.vs[:][label] ]
-        except:
-            # Translate label values of other types to ints first
-            label_set = set(graph.vs[:][label])
-            label_to_int = { L:I for L,I in zip(label_set,range(len(label_set))) }
-            labels = [ label_to_int[label_val] for label_val in graph.vs[:][label] ]
-    relabeled_graph.vs[:]["label"] = labels
-    # Add edges
-    edges = [ (e.source, e.target) for e in graph.es[:] ]
-    relabeled_graph.add_edges( edges )
-    return relabeled_graph
+        return np.repeat( [ np.random.randint( max( n, 1 ) ) for n in n_vertices ], n_vertices ).astype( np.int64 )
+    values = topology.get_vertex_values( graphs, label )
+    # Weisfeiler-Lehman kernel impl. only accepts integer-valued labels
+    try:
+        return values.astype( np.int64 )
+    except (ValueError, TypeError):
+        # Translate label values of other types to ints first
+        return encode_labels( values, label, vocabulary )
 
-# Relabels a graph for comparison using the graphkernels edge-histogram kernel
-#@timer 
-def relabel_for_eh_kernel( graph, label ):
-    # Copy the graph
-    n_vertices = len(graph.vs[:])
-    relabeled_graph = igraph.Graph(n_vertices, directed=True)
-    # Add edges 
-    edges = [ (e.source, e.target) for e in graph.es[:] ]
-    relabeled_graph.add_edges( edges )
-    # Add edge labels
+# Relabels a graph for comparison using the graphkernels Weisfeiler-Lehman 
+# Subtree Pattern kernel
+#@timer
+def relabel_for_wlst_kernel( graph, label="dummy", vocabulary=None ):
+    return relabel_graph_set( [ graph ], "wlst", label, vocabulary=vocabulary ).to_igraph()[0]
+
+# Edge labels of a set of graphs for the edge-histogram kernel, in CSR edge order
+def get_eh_labels( graphs, topology, label ):
     if label == "logical_latency":
-        edge_labels = [ graph.vs[e[1]]["logical_time"] - graph.vs[e[0]]["logical_time"] for e in edges ]
-        relabeled_graph.es[:][label] = edge_labels
+        timestamps = topology.get_vertex_values( graphs, "logical_time" )
     #FIXME: This crashes graphkernels with a double-free / corruption.
     elif label == "wall_time_latency":
-        edge_labels = [ graph.vs[e[1]]["wall_time"] - graph.vs[e[0]]["wall_time"] for e in edges ]
-        relabeled_graph.es[:][label] = edge_labels
+        timestamps = topology.get_vertex_values( graphs, "wall_time" )
     else:
         err_str = ( "Unable to relabel for edge histogram kernel using edge "
                     "label: {}".format(label) )
         raise NotImplementedError( err_str )
-    return relabeled_graph
+    return timestamps[ topology.targets ] - timestamps[ topology.sources ]
 
-"""
-Relabels a graph for comparison using the graphkernels vertex-histogram kernel
-"""
-#@timer
-def relabel_for_vh_kernel( graph, label ):
+# Relabels a graph for comparison using the graphkernels edge-histogram kernel
+#@timer 
+def relabel_for_eh_kernel( graph, label ):
+    return relabel_graph_set( [ graph ], "eh", label ).to_igraph()[0]
+
+# Vertex labels of a set of graphs for the vertex-histogram kernel
+def get_vh_labels( graphs, topology, label, vocabulary=None ):
     # Validate requested label
     if label not in legal_vertex_labels:
         err_str = "Vertex label {} is not supported".format( label )
         raise ValueError( err_str )
-    # Make a copy of the graph
-    relabeled_graph = label_free_copy( graph )
+    values = topology.get_vertex_values( graphs, label )
     # Convert string-valued labels into integer valued labels if needed
     if label in [ "event_type", "callstack" ]:
-        unique_labels = list(set( graph.vs[:][ label ] ))
-        label_to_repr = {}
-        for i,l in enumerate(unique_labels):
-            label_to_repr[ l ] = i
-        labels = [ label_to_repr[l] for l in graph.vs[:][ label ] ]
-    else:
-        labels = graph.vs[:][ label ]
-    # Apply label
-    relabeled_graph.vs[:][ label ] = labels
-    return relabeled_graph
+        return encode_labels( values, label, vocabulary )
+    return values
+
+"""
+Relabels a graph for comparison using the graphkernels vertex-histogram kernel
+"""
+#@timer
+def relabel_for_vh_kernel( graph, label, vocabulary=None ):
+    return relabel_graph_set( [ graph ], "vh", label, vocabulary=vocabulary ).to_igraph()[0]
 
 
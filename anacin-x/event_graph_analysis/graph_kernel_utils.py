@@ -1,3 +1,7 @@
+from event_graph_analysis.graph_kernel_preprocessing import ( add_logical_tick_labels,
+                                                               get_edge_latency
+                                                             )
+
 
 def convert_to_grakel_graph( graph, label_request ):
     """
@@ -55,21 +59,6 @@ def convert_to_grakel_graph( graph, label_request ):
     return [ edge_list, vid_to_label, eid_to_label ]
 
 
-def add_logical_tick_labels(graph):
-    for v in graph.vs[:]:
-        preds = v.predecessors()
-        if len(preds) > 0:
-            pred_logical_times = [ p["logical_time"] for p in preds ]
-            tick = max([v["logical_time"] - lts for lts in pred_logical_times])
-            v["logical_tick"] = tick
-        else:
-            v["logical_tick"] = 0
-    return graph
-
-
-
-
-
 def preprocess( graphs, base_kernel_defs, kernels, labelings ):
     labeling_to_graphs =  { "unlabeled" : [ convert_to_grakel_graph(g, None) for g in graphs ] }
     # First check if we need labels at all
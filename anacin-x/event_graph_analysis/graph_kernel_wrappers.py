@@ -18,6 +18,9 @@ import sys
 sys.path.append(".")
 sys.path.append("..")
 from event_graph_analysis.utilities import timer
+from event_graph_analysis.histogram_kernels import ( get_grakel_vertex_label_count_matrix,
+                                                    compute_histogram_kernel_matrix
+                                                  )
 
 
 @timer
@@ -77,7 +80,7 @@ def compute_vertex_histogram_kernel( labeling_to_graphs, k_params ):
     for lab,graphs in labeling_to_graphs.items():
         if lab != "unlabeled":
             vertex_label = lab[0]
-            labeling_to_results[vertex_label] = compute_kernel_matrix_grakel(graphs,k_params)
+            labeling_to_results[vertex_label] = compute_histogram_kernel_matrix( get_grakel_vertex_label_count_matrix( graphs ) )
     return labeling_to_results
 
 
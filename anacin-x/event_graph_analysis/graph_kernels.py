@@ -33,16 +33,20 @@ from grakel import GraphKernel
 import sys
 sys.path.append(".")
 sys.path.append("..")
-from event_graph_analysis.utilities import read_graph, read_run_params, timer
+from event_graph_analysis.utilities import read_run_params, timer, find_graph_path
+from event_graph_analysis.parallel_graph_loader import get_graph_loader
 from event_graph_analysis.graph_kernel_utils import preprocess
+from event_graph_analysis.histogram_kernels import ( get_grakel_vertex_label_count_matrix,
+                                                    compute_histogram_kernel_matrix
+                                                  )
 
 
 class graph_loader(object):
-    def __init__(self, base_dir, run_dir_depth, max_run_idx):
+    def __init__(self, base_dir, run_dir_depth, max_run_idx, n_workers=None):
         self._base_dir = base_dir
         self._run_dir_depth = run_dir_depth
         self._max_run_idx = max_run_idx
-        self._eg_ext = "graphml"
+        self._n_workers = n_workers
         self._run_dir_to_data = self._load_graphs()
 
     def _load_graphs(self):
@@ -53,8 +57,11 @@ class graph_loader(object):
         run_dirs = sorted(glob.glob(glob_path), key=lambda x: self._run_dir_to_key(x)) 
         if self._max_run_idx is not None:
             run_dirs = self._select_runs(run_dirs, self._max_run_idx)
-        run_dir_to_data = {rd:{"event_graph":read_graph(rd+"/event_graph." + self._eg_ext),
-                               "run_params":read_run_params(rd+"/run_params.json")} for rd in run_dirs}
+        # Event graphs are parsed in parallel, and returned in run order
+        graph_paths = [find_graph_path(rd+"/event_graph") for rd in run_dirs]
+        event_graphs = get_graph_loader(self._n_workers).load(graph_paths)
+        run_dir_to_data = {rd:{"event_graph":g,
+                               "run_params":read_run_params(rd+"/run_params.json")} for rd,g in zip(run_dirs, event_graphs)}
         return run_dir_to_data
 
     def _run_dir_to_key(self, rd):
@@ -218,7 +225,8 @@ class graph_kernel_manager(object):
 
     def _compute_vertex_histogram_kernel(self, labeling_to_graphs, k_params):
         """
-        Compute vertex histogram kernel using specified implementation
+        Compute vertex histogram kernel as the Gram matrix of the graphs' 
+        sparse vertex label count matrix
         """
         for lab,graphs in labeling_to_graphs.items():
             if lab != "unlabeled":
@@ -228,7 +236,7 @@ class graph_kernel_manager(object):
                     print("Kernel: {} already computed".format(key))
                 else:
                     print("Computing kernel: {}".format(key))
-                    mat = self._compute_kernel_matrix_grakel(graphs,k_params)
+                    mat = compute_histogram_kernel_matrix( get_grakel_vertex_label_count_matrix( graphs ) )
                     self._kernel_matrices[key] = mat
 
 
@@ -348,10 +356,11 @@ def main(base_dir,
          run_params_output_path, 
          wl_iters=None,
          graphlet_sampling_dims=None,
-         graphlet_sampling_counts=None
+         graphlet_sampling_counts=None,
+         loader_workers=None
         ):
 
-    loader = graph_loader(base_dir, run_dir_depth, max_run_idx)
+    loader = graph_loader(base_dir, run_dir_depth, max_run_idx, loader_workers)
     run_dir_to_data = loader.get_run_dir_to_data()
     event_graphs = []
     run_params = []
@@ -400,6 +409,8 @@ if __name__ == "__main__":
     parser.add_argument("--graphlet_sampling_dims", required=False, default=None, type=int, nargs="+", help="List of graphlet dimensions if using the graphlet_sampling kernel")
     parser.add_argument("--graphlet_sampling_counts", required=False, default=None, type=int, nargs="+", help="List of graphlet counts if using the graphlet_sampling kernel")
 
+    parser.add_argument("--loader_workers", required=False, default=None, type=int, help="Number of worker processes to parse event graphs with. If ommitted, one per CPU is used.")
+
 
     args = parser.parse_args()
     
@@ -414,4 +425,5 @@ if __name__ == "__main__":
          args.run_params_output,
          wl_iters=args.wl_iters,
          graphlet_sampling_dims=args.graphlet_sampling_dims,
-         graphlet_sampling_counts=args.graphlet_sampling_counts)
+         graphlet_sampling_counts=args.graphlet_sampling_counts,
+         loader_workers=args.loader_workers)
@@ -0,0 +1,156 @@
+import numpy as np
+import scipy.sparse
+
+from wl_kernel import compute_wl_label_hashes
+
+from graph_kernel_preprocessing import ( relabel_graph_set,
+                                         graph_set_topology
+                                       )
+
+from graph_kernel_postprocessing import convert_to_distance_block
+
+"""
+Incremental kernel distances for growing sets of runs.
+
+When new runs are added to a campaign (e.g., nightly runs compared against a
+rolling baseline), recomputing every slice's distance matrices from scratch
+repeats the O(n^2) kernel values between runs that were already compared. All
+kernels computed here have explicit feature matrices X with K = X X^T, so the
+kernel values between the new runs and all runs only need the new runs' rows of
+X and the stored rows of the old runs: K_new = X_new X^T.
+
+For this to work, the columns of features computed in different passes have to
+mean the same thing. Feature columns are therefore identified by stable 64-bit
+keys rather than by position: label values for the histogram kernels and
+content hashes of subtree patterns for the WL kernel (see
+wl_kernel.compute_wl_label_hashes). String-valued labels are encoded with the
+campaign's persisted vocabulary (see label_vocabulary), whose codes never
+change.
+"""
+
+class keyed_feature_matrix(object):
+    """
+    Sparse graph x feature count matrix whose columns are identified by sorted,
+    distinct 64-bit keys
+    """
+    def __init__(self, matrix, keys):
+        self.matrix = scipy.sparse.csr_matrix( matrix, dtype=np.float64 )
+        self.keys = np.asarray( keys, dtype=np.uint64 )
+
+    @classmethod
+    def from_items(cls, graph_ids, item_keys, n_graphs):
+        """
+        Counts the items (vertices or edges) of each graph by key
+        """
+        keys, columns = np.unique( np.asarray( item_keys, dtype=np.uint64 ), return_inverse=True )
+        counts = np.ones( len( columns ), dtype=np.float64 )
+        matrix = scipy.sparse.csr_matrix( ( counts, ( np.asarray( graph_ids, dtype=np.int64 ), columns.ravel() ) ),
+                                          shape=( n_graphs, len( keys ) ) )
+        return cls( matrix, keys )
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def reindex(self, keys):
+        """
+        Returns the matrix with its columns laid out by keys, which must be a
+        sorted superset of this matrix's keys
+        """
+        columns = np.searchsorted( keys, self.keys )
+        m = self.matrix
+        return scipy.sparse.csr_matrix( ( m.data, columns[ m.indices ], m.indptr ),
+                                        shape=( m.shape[0], len( keys ) ) )
+
+    def squared_norms(self):
+        return np.asarray( self.matrix.multiply( self.matrix ).sum( axis=1 ) ).ravel()
+
+def stack_keyed_feature_matrices( upper, lower ):
+    keys = np.union1d( upper.keys, lower.keys )
+    return keyed_feature_matrix( scipy.sparse.vstack( ( upper.reindex( keys ), lower.reindex( keys ) ),
+                                                      format="csr" ),
+                                 keys )
+
+def _get_feature_key( kernel, label ):
+    return ( kernel, label )
+
+"""
+Computes keyed feature matrices for all requested kernels. WL kernels over the
+same label share the features of iterations 0 ... n, where n is the largest
+requested number of iterations. Returns a map from ( kernel, label ) to a list
+of keyed feature matrices (one per WL iteration, or a single one for the
+histogram kernels).
+"""
+def compute_keyed_features( graphs, kernel_params, vocabulary=None ):
+    topology = graph_set_topology( graphs )
+    n_graphs = len( topology )
+    label_to_iters = {}
+    histogram_keys = set()
+    for kp in kernel_params:
+        kernel = kp["name"]
+        label = kp["params"]["label"]
+        if kernel == "wlst":
+            label_to_iters[ label ] = max( label_to_iters.get( label, 0 ), kp["params"]["n_iters"] )
+        elif kernel in [ "eh", "vh" ]:
+            histogram_keys.add( ( kernel, label ) )
+        else:
+            raise NotImplementedError("Kernel: {} not supported".format(kernel))
+
+    features = {}
+    for label, n_iters in label_to_iters.items():
+        relabeled_graphs = relabel_graph_set( graphs, "wlst", label, topology, vocabulary )
+        graph_ids, hashes_seq = compute_wl_label_hashes( relabeled_graphs, n_iters )
+        features[ _get_feature_key( "wlst", label ) ] = [ keyed_feature_matrix.from_items( graph_ids, h, n_graphs )
+                                                          for h in hashes_seq ]
+    for kernel, label in sorted( histogram_keys ):
+        relabeled_graphs = relabel_graph_set( graphs, kernel, label, topology, vocabulary )
+        # Label values are truncated to integers, as for the exact histogram
+        # kernels (see histogram_kernels)
+        if kernel == "vh":
+            graph_ids = topology.graph_ids
+            labels = relabeled_graphs.vertex_labels
+        else:
+            graph_ids = np.repeat( np.arange( n_graphs, dtype=np.int64 ), np.diff( topology.edge_offsets ) )
+            labels = relabeled_graphs.edge_labels
+        item_keys = np.asarray( labels ).astype( np.int64 ).view( np.uint64 )
+        features[ _get_feature_key( kernel, label ) ] = [ keyed_feature_matrix.from_items( graph_ids, item_keys, n_graphs ) ]
+    return features
+
+"""
+Appends the rows of new graphs' features to stored features
+"""
+def stack_keyed_features( features, new_features ):
+    if features.keys() != new_features.keys():
+        raise ValueError("Stored and new features were computed for different kernels")
+    stacked = {}
+    for key, matrices in features.items():
+        new_matrices = new_features[ key ]
+        if len( matrices ) != len( new_matrices ):
+            raise ValueError("Stored and new features for: {} have different numbers of WL iterations".format( key ))
+        stacked[ key ] = [ stack_keyed_feature_matrices( m, n ) for m,n in zip( matrices, new_matrices ) ]
+    return stacked
+
+def _get_kernel_feature_matrices( features, kernel_key ):
+    kernel, label = kernel_key[:2]
+    matrices = features[ _get_feature_key( kernel, label ) ]
+    if kernel == "wlst":
+        n_iters = kernel_key[2]
+        if n_iters >= len( matrices ):
+            raise ValueError( "Features for {} WL iterations requested, but only {} available".format( n_iters, len( matrices ) - 1 ) )
+        return matrices[ :n_iters+1 ]
+    return matrices
+
+"""
+Computes the distances between the graphs from row first_row onwards and all
+graphs, for the kernel identified by kernel_key (see
+compute_kernel_distance_time_series.get_kernel_key). Returns a dense
+( n_graphs - first_row ) x n_graphs matrix.
+"""
+def get_distance_rows( features, kernel_key, first_row ):
+    matrices = _get_kernel_feature_matrices( features, kernel_key )
+    n_graphs = len( matrices[0] )
+    kernel_block = np.zeros( ( n_graphs - first_row, n_graphs ), dtype=np.float64 )
+    self_similarities = np.zeros( n_graphs, dtype=np.float64 )
+    for m in matrices:
+        kernel_block += ( m.matrix[ first_row: ] @ m.matrix.T ).toarray()
+        self_similarities += m.squared_norms()
+    return convert_to_distance_block( kernel_block, self_similarities[ first_row: ], self_similarities )
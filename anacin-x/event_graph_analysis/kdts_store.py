@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+import os
+import glob
+import json
+import pickle as pkl
+
+import sys
+sys.path.append(".")
+
+from utilities import write_atomic, get_slice_path
+
+"""
+On-disk store for kernel distance time series (KDTS) data.
+
+Rather than one pickle of the whole time series written by the root process at
+the end of the job, each slice's data is written to its own chunk file as soon
+as it is computed, by whichever process computed it. The root process only
+writes the manifest listing the completed slices once all work is done. Chunks
+are written to a temporary file and renamed into place, so a chunk that exists
+is always complete; a job that is interrupted can therefore be rerun and will
+only compute the slices that are missing.
+
+Each chunk records the inputs it was computed from (see get_slice_inputs): the
+slicing policy and, for each run in the order of the chunk's rows, its slice 
+directory and the path, size, and modification time of its slice file. A chunk
+is only reused while its inputs match the current job's, so rerunning into the
+same store with a different set of runs, a different slicing policy, or slices
+regenerated in place recomputes the affected slices instead of returning stale
+distances. The inputs are pickled ahead of the slice data in the same file, so 
+they can be checked without loading the distance matrices.
+
+Layout of a store for KDTS path "<stem>.pkl":
+    <stem>_store/config.json       Kernel (and approximation) parameters the chunks
+                                   were computed with, and the slicing policy and
+                                   slice directories of the latest job
+    <stem>_store/slice_<idx>.pkl   Inputs and data for slice <idx>
+    <stem>_store/manifest.json     Completed slices, written when the job finishes
+    <stem>_store/features_<idx>.pkl  Runs and keyed kernel features of slice <idx>,
+                                   only for stores grown incrementally (see
+                                   incremental_kernel_distances)
+"""
+
+_config_name = "config.json"
+_manifest_name = "manifest.json"
+_chunk_prefix = "slice_"
+_chunk_ext = ".pkl"
+_features_prefix = "features_"
+
+"""
+Determines the store directory that corresponds to a KDTS output path
+"""
+def get_kdts_store_dir( kdts_path ):
+    stem, _ = os.path.splitext( str( kdts_path ) )
+    return stem + "_store"
+
+def get_chunk_path( store_dir, slice_idx ):
+    return os.path.join( store_dir, _chunk_prefix + str( slice_idx ) + _chunk_ext )
+
+def _write_json_atomic( data, path ):
+    write_atomic( data, path, lambda d,f: json.dump( d, f, indent=2 ), "w" )
+
+"""
+Creates the store directory if needed and records the kernel parameters (and
+approximation parameters, for approximate distances) its chunks are computed 
+with. Raises a ValueError if the store already holds chunks computed with 
+different parameters, since resuming into it would mix incompatible data. The
+slicing policy and slice directories of the job are recorded as well; if they
+differ from the previous job's, chunks computed from other inputs are not 
+reused (see get_slice_inputs). Called by the root process only.
+"""
+def open_kdts_store( store_dir, kernel_params, approximation=None, slicing_policy=None, slice_dirs=None ):
+    os.makedirs( store_dir, exist_ok=True )
+    config_path = os.path.join( store_dir, _config_name )
+    config = { "kernels" : kernel_params }
+    if approximation is not None:
+        config[ "approximation" ] = approximation
+    inputs = { "slicing_policy" : slicing_policy,
+               "slice_dirs"     : [ str( sd ) for sd in slice_dirs ] if slice_dirs is not None else None }
+    if os.path.isfile( config_path ):
+        with open( config_path, "r" ) as infile:
+            existing_config = json.load( infile )
+        existing_inputs = { k : existing_config.pop( k, None ) for k in inputs }
+        if existing_config != config:
+            raise ValueError( "KDTS store: {} was computed with different kernel or approximation parameters".format( store_dir ) )
+        if existing_inputs != inputs:
+            print("KDTS store: {} was last computed for different runs or a different slicing policy. Slices computed from other inputs are recomputed".format( store_dir ))
+    config.update( inputs )
+    _write_json_atomic( config, config_path )
+    return store_dir
+
+"""
+Returns the inputs a slice's chunk is computed from: the slicing policy and, 
+for each run in slice_dirs (in the order of the chunk's rows), its slice 
+directory and the path, size, and modification time in ns of its slice file. 
+Runs whose slice file is missing are recorded without a path.
+"""
+def get_slice_inputs( slice_dirs, slice_idx, slicing_policy=None ):
+    runs = []
+    for sd in slice_dirs:
+        try:
+            path = get_slice_path( sd, slice_idx )
+            stat = os.stat( path )
+            runs.append( [ str( sd ), path, stat.st_size, stat.st_mtime_ns ] )
+        except FileNotFoundError:
+            runs.append( [ str( sd ), None, None, None ] )
+    return { "slicing_policy" : slicing_policy, "runs" : runs }
+
+"""
+Returns the sorted indices of all slices that have a complete chunk in the store
+"""
+def get_completed_slices( store_dir ):
+    slice_indices = []
+    for path in glob.glob( os.path.join( store_dir, _chunk_prefix + "*" + _chunk_ext ) ):
+        name = os.path.basename( path )
+        idx = name[ len( _chunk_prefix ):-len( _chunk_ext ) ]
+        if idx.isdigit():
+            slice_indices.append( int( idx ) )
+    return sorted( slice_indices )
+
+"""
+Writes one slice's data, along with the inputs it was computed from (see 
+get_slice_inputs), to the store. Safe to call from any process.
+"""
+def write_slice_chunk( store_dir, slice_idx, slice_data, inputs ):
+    def dump( data, outfile ):
+        pkl.dump( { "inputs" : inputs }, outfile, pkl.HIGHEST_PROTOCOL )
+        pkl.dump( data, outfile, pkl.HIGHEST_PROTOCOL )
+    write_atomic( slice_data, get_chunk_path( store_dir, slice_idx ), dump, "wb" )
+
+# Chunks written before inputs were recorded hold only the slice data
+def _is_chunk_header( obj ):
+    return isinstance( obj, dict ) and list( obj.keys() ) == [ "inputs" ]
+
+def read_slice_chunk( store_dir, slice_idx ):
+    with open( get_chunk_path( store_dir, slice_idx ), "rb" ) as infile:
+        obj = pkl.load( infile )
+        return pkl.load( infile ) if _is_chunk_header( obj ) else obj
+
+"""
+Reads only the inputs recorded in a slice's chunk. Returns None if the slice 
+has no chunk, or if its chunk does not record its inputs.
+"""
+def read_slice_chunk_inputs( store_dir, slice_idx ):
+    try:
+        with open( get_chunk_path( store_dir, slice_idx ), "rb" ) as infile:
+            obj = pkl.load( infile )
+    except FileNotFoundError:
+        return None
+    return obj[ "inputs" ] if _is_chunk_header( obj ) else None
+
+def get_features_path( store_dir, slice_idx ):
+    return os.path.join( store_dir, _features_prefix + str( slice_idx ) + _chunk_ext )
+
+"""
+Writes the runs a slice's chunk covers, in the order of its distance matrices' 
+rows, together with their keyed kernel features. Safe to call from any process.
+"""
+def write_slice_features( store_dir, slice_idx, runs, features ):
+    write_atomic( { "runs" : list( runs ), "features" : features }, 
+                  get_features_path( store_dir, slice_idx ), 
+                  lambda d,f: pkl.dump( d, f, pkl.HIGHEST_PROTOCOL ), "wb" )
+
+"""
+Reads a slice's runs and keyed kernel features, or returns None if the slice 
+has none
+"""
+def read_slice_features( store_dir, slice_idx ):
+    try:
+        with open( get_features_path( store_dir, slice_idx ), "rb" ) as infile:
+            return pkl.load( infile )
+    except FileNotFoundError:
+        return None
+
+"""
+Writes the manifest listing every slice with a complete chunk. If is_current is
+given, only chunks for which is_current( slice_idx, inputs ) holds are listed,
+so that chunks left over from jobs with other inputs are never loaded. Called 
+by the root process once all slices have been computed.
+"""
+def finalize_kdts_store( store_dir, is_current=None ):
+    slice_indices = get_completed_slices( store_dir )
+    if is_current is not None:
+        slice_indices = [ idx for idx in slice_indices 
+                          if is_current( idx, read_slice_chunk_inputs( store_dir, idx ) ) ]
+    manifest = { "slices" : slice_indices,
+                 "chunks" : { str(idx) : os.path.basename( get_chunk_path( store_dir, idx ) ) for idx in slice_indices } }
+    _write_json_atomic( manifest, os.path.join( store_dir, _manifest_name ) )
+    return slice_indices
+
+"""
+Loads a kernel distance time series as a dict mapping slice indices to slice
+data. Accepts a legacy single-pickle KDTS file, a store directory, or the
+KDTS output path a store was created for. A finalized store takes precedence
+over a legacy pickle at its output path, since the pickle can only be left 
+over from an earlier run.
+"""
+def load_kdts( kdts_path ):
+    kdts_path = str( kdts_path )
+    if os.path.isdir( kdts_path ):
+        store_dir = kdts_path
+    else:
+        store_dir = get_kdts_store_dir( kdts_path )
+    manifest_path = os.path.join( store_dir, _manifest_name )
+    if not os.path.isfile( manifest_path ):
+        if os.path.isfile( kdts_path ):
+            with open( kdts_path, "rb" ) as infile:
+                return pkl.load( infile )
+        raise FileNotFoundError( "No KDTS file or finalized KDTS store found for: {}".format( kdts_path ) )
+    with open( manifest_path, "r" ) as infile:
+        manifest = json.load( infile )
+    return { idx : read_slice_chunk( store_dir, idx ) for idx in manifest["slices"] }
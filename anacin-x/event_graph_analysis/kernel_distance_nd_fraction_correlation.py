@@ -1,7 +1,6 @@
 #!/usr/bin/env python3 
 
 import argparse
-import pickle as pkl
 import numpy as np
 from scipy.stats.stats import pearsonr, spearmanr
 import pprint
@@ -11,11 +10,11 @@ sys.path.append(".")
 sys.path.append("..")
 
 from kernel_distance_time_series_postprocessing import get_distances_seq, get_stats_seq
+from kdts_store import load_kdts
 
 def main( kdts_path, drop_zeros ):
     # Read in kdts data
-    with open( kdts_path, "rb" ) as infile:
-        slice_idx_to_data = pkl.load( infile )
+    slice_idx_to_data = load_kdts( kdts_path )
     # Reduce to flat lists of distances
     gk = ('wlst','logical_time', 5)
     slice_indices = sorted( slice_idx_to_data.keys() )
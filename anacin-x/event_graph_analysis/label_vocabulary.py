@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+
+import os
+import json
+
+import numpy as np
+
+import sys
+sys.path.append(".")
+
+from utilities import ( write_atomic,
+                        read_graph_arrays,
+                        get_slice_path
+                      )
+
+"""
+Campaign-wide vocabulary of string-valued vertex labels (e.g., event_type and
+callstack).
+
+Kernels only accept integer labels, so string labels have to be encoded. If
+each graph (or each slice) encoded its own labels, the same string could get
+different codes in different runs and the kernels would compare unrelated
+labels. Instead, one vocabulary per campaign maps every string value of a label
+to a fixed code. It is persisted next to the runs' traces and only ever grows:
+graphs that were not scanned yet (e.g., newly added runs) append their unseen
+values at the end, so existing codes never change.
+
+Each scanned graph is recorded with its size and modification time, so that a
+graph regenerated in place (e.g., a run traced again) is scanned again before
+it is encoded. Only the slices a job is about to read are scanned, and in MPI 
+jobs the scan is split between all processes (see load_label_vocabulary).
+
+Layout of "<traces_root_dir>/label_vocabulary.json":
+    { "labels"  : { <label> : [ <value with code 0>, <value with code 1>, ... ] },
+      "sources" : { <label> : { <path of a scanned graph> : [ <size>, <mtime in ns> ] } } }
+"""
+
+_vocabulary_name = "label_vocabulary.json"
+
+"""
+Vertex labels that hold strings and therefore need a vocabulary
+"""
+string_vertex_labels = [ "event_type", "callstack", "mpi_function" ]
+
+def get_label_vocabulary_path( traces_root_dir ):
+    return os.path.join( str( traces_root_dir ), _vocabulary_name )
+
+"""
+Determines which string-valued labels a list of kernels relabels by
+"""
+def get_vocabulary_labels( kernel_params ):
+    labels = set()
+    for kp in kernel_params:
+        label = kp.get( "params", {} ).get( "label" )
+        if label in string_vertex_labels:
+            labels.add( label )
+    return sorted( labels )
+
+"""
+Determines which graphs to scan for label values: the requested slices of every
+run, i.e., the slices a job will read
+"""
+def get_label_source_paths( slice_dirs, slice_indices ):
+    return [ get_slice_path( sd, slice_idx ) for sd in slice_dirs for slice_idx in slice_indices ]
+
+"""
+Size and modification time of a graph file, which identify the version of the
+graph that was scanned
+"""
+def get_source_fingerprint( graph_path ):
+    stat = os.stat( graph_path )
+    return [ stat.st_size, stat.st_mtime_ns ]
+
+"""
+Returns a dict mapping each requested label to the sorted distinct values it
+takes in a graph file. Binary event graphs already store the vocabulary of each
+string column, so their columns are never decoded.
+"""
+def read_label_values( graph_path, labels ):
+    graph = read_graph_arrays( graph_path )
+    label_to_values = {}
+    for label in labels:
+        if label not in graph.vertex_columns:
+            label_to_values[ label ] = []
+        elif label in graph.vertex_vocabs:
+            label_to_values[ label ] = sorted( str( v ) for v in graph.vertex_vocabs[ label ] )
+        else:
+            label_to_values[ label ] = sorted( set( str( v ) for v in graph.get_vertex_attribute( label ) ) )
+    return label_to_values
+
+class label_vocabulary(object):
+    def __init__(self, label_to_values=None, label_to_sources=None):
+        self._label_to_values = label_to_values if label_to_values is not None else {}
+        self._label_to_sources = label_to_sources if label_to_sources is not None else {}
+        # Per label: ( sorted values, code of each sorted value ) for lookup
+        self._lookup = {}
+
+    @classmethod
+    def load(cls, path):
+        with open( path, "r" ) as infile:
+            data = json.load( infile )
+        # Vocabularies saved before sources were fingerprinted list their paths
+        # only; those graphs are scanned again (which never changes any code)
+        label_to_sources = { label : sources if isinstance( sources, dict ) else dict.fromkeys( sources )
+                             for label, sources in data["sources"].items() }
+        return cls( data["labels"], label_to_sources )
+
+    def save(self, path):
+        data = { "labels"  : self._label_to_values,
+                 "sources" : self._label_to_sources }
+        write_atomic( data, path, lambda d,f: json.dump( d, f, indent=2 ), "w" )
+
+    def __contains__(self, label):
+        return label in self._label_to_values
+
+    def get_values(self, label):
+        return list( self._label_to_values.get( label, [] ) )
+
+    def add_values(self, label, values):
+        """
+        Appends the values not yet in the vocabulary, in sorted order. Returns
+        whether any were added.
+        """
+        known_values = self._label_to_values.setdefault( label, [] )
+        new_values = sorted( set( str( v ) for v in values ) - set( known_values ) )
+        if len( new_values ) == 0:
+            return False
+        known_values += new_values
+        self._lookup.pop( label, None )
+        return True
+
+    def get_stale_sources(self, graph_paths, labels):
+        """
+        Returns the graphs that have to be scanned for the requested labels,
+        i.e., those not scanned yet and those that changed since they were
+        scanned, as a list of ( path, fingerprint, labels to scan for )
+        """
+        stale_sources = []
+        if len( labels ) == 0:
+            return stale_sources
+        for path in dict.fromkeys( str( p ) for p in graph_paths ):
+            fingerprint = get_source_fingerprint( path )
+            stale_labels = [ label for label in labels 
+                             if self._label_to_sources.get( label, {} ).get( path ) != fingerprint ]
+            if len( stale_labels ) > 0:
+                stale_sources.append( ( path, fingerprint, stale_labels ) )
+        return stale_sources
+
+    def add_scanned(self, path, fingerprint, label_to_values):
+        """
+        Adds the label values scanned from a graph and records which version of
+        the graph they were scanned from
+        """
+        for label, values in label_to_values.items():
+            self.add_values( label, values )
+            self._label_to_sources.setdefault( label, {} )[ str( path ) ] = fingerprint
+
+    def update(self, graph_paths, labels):
+        """
+        Adds the values of the requested labels in all graphs that were not
+        scanned yet or changed since they were scanned. Returns whether the 
+        vocabulary changed.
+        """
+        changed = False
+        for label in labels:
+            if label not in self._label_to_values:
+                self._label_to_values[ label ] = []
+                changed = True
+        for path, fingerprint, stale_labels in self.get_stale_sources( graph_paths, labels ):
+            self.add_scanned( path, fingerprint, read_label_values( path, stale_labels ) )
+            changed = True
+        return changed
+
+    def encode(self, label, values):
+        """
+        Maps label values to their integer codes with a binary search over the
+        sorted vocabulary. Raises a KeyError if any value is not in the
+        vocabulary.
+        """
+        if label not in self._lookup:
+            vocab = np.asarray( self._label_to_values[ label ], dtype=str )
+            order = np.argsort( vocab, kind="stable" )
+            self._lookup[ label ] = ( vocab[ order ], order.astype( np.int64 ) )
+        sorted_values, sorted_codes = self._lookup[ label ]
+        values = np.asarray( values ).astype( str )
+        if len( sorted_values ) == 0:
+            if len( values ) > 0:
+                raise KeyError( "No values of label: {} in vocabulary".format( label ) )
+            return np.zeros( 0, dtype=np.int64 )
+        positions = np.searchsorted( sorted_values, values )
+        positions[ positions == len( sorted_values ) ] = 0
+        found = sorted_values[ positions ] == values
+        if not np.all( found ):
+            missing = sorted( set( values[ ~found ].tolist() ) )
+            raise KeyError( "Values of label: {} not in vocabulary: {}".format( label, missing[:10] ) )
+        return sorted_codes[ positions ]
+
+"""
+Loads the campaign's label vocabulary, adding the requested labels' values from
+any graphs it has not scanned yet, or that changed since they were scanned, and
+persisting it if it changed. 
+
+Without comm, this is done by the calling process alone. With an MPI 
+communicator, it is collective: the root process determines which graphs have
+to be scanned, the graphs are scanned by all processes round-robin, and the
+root adds their values in path order, so codes do not depend on the number of 
+processes. graph_paths and labels are only used on the root. Every process 
+returns the vocabulary.
+"""
+def load_label_vocabulary( vocabulary_path, graph_paths, labels, comm=None ):
+    rank = comm.Get_rank() if comm is not None else 0
+    if rank == 0:
+        if os.path.isfile( vocabulary_path ):
+            vocabulary = label_vocabulary.load( vocabulary_path )
+        else:
+            vocabulary = label_vocabulary()
+        if comm is None:
+            if vocabulary.update( graph_paths, labels ):
+                vocabulary.save( vocabulary_path )
+            return vocabulary
+        stale_sources = vocabulary.get_stale_sources( graph_paths, labels )
+    else:
+        stale_sources = None
+    stale_sources = comm.bcast( stale_sources, root=0 )
+    n_procs = comm.Get_size()
+    scanned = { idx : read_label_values( path, stale_labels )
+                for idx, ( path, _, stale_labels ) in enumerate( stale_sources ) 
+                if idx % n_procs == rank }
+    scanned = comm.gather( scanned, root=0 )
+    if rank == 0:
+        idx_to_values = {}
+        for s in scanned:
+            idx_to_values.update( s )
+        changed = False
+        for label in labels:
+            if label not in vocabulary:
+                vocabulary.add_values( label, [] )
+                changed = True
+        for idx, ( path, fingerprint, _ ) in enumerate( stale_sources ):
+            vocabulary.add_scanned( path, fingerprint, idx_to_values[ idx ] )
+            changed = True
+        if changed:
+            vocabulary.save( vocabulary_path )
+    else:
+        vocabulary = None
+    return comm.bcast( vocabulary, root=0 )
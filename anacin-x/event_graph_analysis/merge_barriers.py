@@ -13,7 +13,10 @@ import igraph
 import pprint
 
 from utilities import ( timer,
-                        read_graph
+                        read_graph,
+                        write_graph,
+                        is_binary_graph_path,
+                        binary_graph_format
                       )
 
 # Replaces all sequences of consecutive barrier vertices in all program orders
@@ -74,8 +77,11 @@ def main( graph_path, output_path ):
         output_graph_name = name + "_merged_barriers"
         output_path = output_dir + "/" + output_graph_name + ext
 
-    # Write new graph out to file
-    new_graph.write( output_path, format="graphml" )
+    # Write new graph out to file in the same format as the input graph
+    if is_binary_graph_path( graph_path ):
+        write_graph( new_graph, output_path, binary_graph_format )
+    else:
+        write_graph( new_graph, output_path, "graphml" )
 
 
 
@@ -83,7 +89,7 @@ if __name__ == "__main__":
     desc = "Checks that an event graph is constructed properly"
     parser = argparse.ArgumentParser(description=desc)
     parser.add_argument("graph_path",
-                        help="A GraphML file representing the event graph whose consecutive barriers you want to merge")
+                        help="A GraphML or binary (.egb) file representing the event graph whose consecutive barriers you want to merge")
     parser.add_argument("-o", "--output_path", default=None,
                         action="store", type=str, required=False,
                         help="Path to write transformed graph to. Optional.")
@@ -3,8 +3,7 @@
 import argparse
 
 # Imports for training SVRs
-from sklearn.model_selection import train_test_split, KFold, GridSearchCV
-from sklearn import svm
+from sklearn.model_selection import train_test_split, GridSearchCV
 from sklearn.metrics import accuracy_score, mean_squared_error
 
 import pprint
@@ -21,84 +20,46 @@ sys.path.append(".")
 sys.path.append("..")
 import pickle as pkl
 
+from event_graph_analysis.cross_validation import get_kfold_splits, cross_validate
+
 
 class model_manager(object):
-    def __init__(self, kernel_matrices, graph_labels, target, output_path, n_folds, n_repeats):
+    def __init__(self, kernel_matrices, graph_labels, target, output_path, n_folds, n_repeats, n_workers=None):
         self._kernel_matrices = kernel_matrices
         self._graph_labels = graph_labels
         self._target = target
         self._output_path = output_path
         self._n_folds = n_folds
         self._n_repeats = n_repeats
+        self._n_workers = n_workers
         self._kernel_to_model = {}
 
     def build_models(self):
-        for kernel,mat in self._kernel_matrices.items():
-            self._build_model(kernel, mat)
-
-    def _get_k_train(self, k_mat, train_indices):
-        n = len(train_indices)
-        k_train = np.zeros((n,n))
-        for i in range(n):
-            for j in range(n):
-                k_train[i][j] = k_mat[train_indices[i]][train_indices[j]]
-        return k_train
-
-    def _get_k_test(self, k_mat, train_indices, test_indices):
-        n = len(train_indices)
-        m = len(test_indices)
-        k_test = np.zeros((m,n))
-        for i in range(m):
-            for j in range(n):
-                k_test[i][j] = k_mat[test_indices[i]][train_indices[j]]
-        return k_test
-
-    def _build_model(self, kernel, k_mat):
-        print("Build model for kernel: {}".format(kernel))
+        """
+        Train and evaluate a kernel SVR model for each graph kernel, repeat,
+        and fold. All fits run in parallel (see cross_validation).
+        """
         print("Predicting: {}".format(self._target))
-        target = [ y[self._target] for y in self._graph_labels ]
+        target = np.array([ y[self._target] for y in self._graph_labels ])
         n_graphs = len(self._graph_labels)
-        for repeat_idx in range(self._n_repeats):
-            fold_to_results = {}
-            kf = KFold(n_splits=self._n_folds, random_state=repeat_idx, shuffle=True)
-            for split_idx, (train_indices, test_indices) in enumerate(kf.split(range(n_graphs))):
-                # Get test-train split
-                y_train = [ target[i] for i in train_indices ]
-                y_test = [ target[i] for i in test_indices ]
-                k_train = self._get_k_train(k_mat, train_indices )
-                k_test = self._get_k_test(k_mat, train_indices, test_indices )
-                
-                # Initialize SVR model
-                curr_svr = svm.SVR(kernel="precomputed")
-                
-                # Train SVR model
-                curr_svr.fit(k_train, y_train)
-
-                # Predict
-                y_pred = curr_svr.predict(k_test)
-                
+        splits = get_kfold_splits(n_graphs, self._n_folds, range(self._n_repeats))
+        split_to_pred = cross_validate(self._kernel_matrices, target, splits, "svr", self._n_workers)
+        for kernel in self._kernel_matrices:
+            print("Build model for kernel: {}".format(kernel))
+            for repeat_idx, split_idx, train_indices, test_indices in splits:
+                y_test = target[test_indices]
+                y_pred = split_to_pred[(kernel, repeat_idx, split_idx)]
+
                 # Record model params and perf
-                relative_errors = []
-                for tv,pv in zip(y_test, y_pred):
-                    rel_error = np.abs(tv - pv)/tv
-                    relative_errors.append(rel_error)
-                print("Split: {}".format(split_idx))
+                relative_errors = np.abs(y_test - y_pred)/y_test
+                print("Repeat: {}, Split: {}".format(repeat_idx, split_idx))
                 print("Min Rel. Error: {}".format(min(relative_errors)))
                 print("Median Rel. Error: {}".format(np.median(relative_errors)))
                 print("Max Rel. Error: {}".format(max(relative_errors)))
                 print()
-                
-                results = { "true" : y_test, "pred" : y_pred, "svr_params" : {} }
-                fold_to_results[split_idx] = results
-            exit()
-
-
-    
-
-
 
 
-def main(kernel_matrices_path, graph_labels_path, target, output_path, n_folds, n_repeats):
+def main(kernel_matrices_path, graph_labels_path, target, output_path, n_folds, n_repeats, n_workers=None):
     
     with open(kernel_matrices_path, "rb") as infile:
         kernel_to_matrices = pkl.load(infile)
@@ -106,7 +67,7 @@ def main(kernel_matrices_path, graph_labels_path, target, output_path, n_folds,
     with open(graph_labels_path, "rb") as infile:
         graph_labels = pkl.load(infile)
 
-    mm = model_manager(kernel_to_matrices, graph_labels, target, output_path, n_folds, n_repeats)
+    mm = model_manager(kernel_to_matrices, graph_labels, target, output_path, n_folds, n_repeats, n_workers)
     mm.build_models()
 
     #kernel_to_results = build_models(kernel_to_matrices)
@@ -121,11 +82,13 @@ if __name__ == "__main__":
     parser.add_argument("--output", required=False, default=None, help="Path to write pickled results dict to")
     parser.add_argument("--n_folds", required=False, type=int, default=10, help="Number of folds for k-fold cross-validation")
     parser.add_argument("--n_repeats", required=False, type=int, default=10, help="Number of times to repeat cross-validation")
+    parser.add_argument("--n_workers", required=False, type=int, default=None, help="Number of worker processes that the (kernel x repeat x fold) model fits are spread over. Default: one per CPU.")
     args = parser.parse_args()
     main(args.kernel_matrices,
          args.graph_labels,
          args.predict,
          args.output,
          args.n_folds,
-         args.n_repeats)
+         args.n_repeats,
+         args.n_workers)
 
@@ -11,7 +11,6 @@ import glob
 import pickle as pkl
 import json
 import os
-import numpy as np
 
 from sklearn.model_selection import train_test_split, KFold
 from sklearn import svm
@@ -22,10 +21,14 @@ sys.path.append(".")
 sys.path.append("..")
 
 #from utilities import read_graph, timer
-from event_graph_analysis.utilities import read_graph, timer
+from event_graph_analysis.utilities import timer, list_graph_paths
 
 #from graph_kernel_preprocessing import get_relabeled_graphs, convert_to_grakel_graph
 from event_graph_analysis.graph_kernel_preprocessing import get_relabeled_graphs, convert_to_grakel_graph, relabel_for_vh_kernel, relabel_for_wlst_kernel, compute_extra_labels
+from event_graph_analysis.wl_kernel import compute_wl_kernel_matrices
+from event_graph_analysis.histogram_kernels import compute_vertex_histogram_kernel
+from event_graph_analysis.parallel_graph_loader import get_graph_loader
+from event_graph_analysis.cross_validation import get_kfold_splits, cross_validate
 
 #from mpi4py import MPI
 #comm = MPI.COMM_WORLD
@@ -37,10 +40,6 @@ warnings.simplefilter(action='ignore', category=FutureWarning)
 # Import generic GraKeL graph kernel interface
 from grakel import GraphKernel
 
-# Import Borgwardt Lab graph kernel implementations
-import graphkernels
-import graphkernels.kernels as gk
-
 default_base_kernels_path="config/graph_kernels/grakel_base_kernels.json"
 default_graph_attributes_path="config/graph_kernels/event_graph_attributes.json"
 
@@ -66,7 +65,7 @@ def label_slices( traces_root_dir ):
     slice_dirs = glob.glob( traces_root_dir + "/run*/slices/" )
     slice_path_to_label = {}
     for sd in slice_dirs:
-        slices = sorted( glob.glob( sd + "/*.graphml" ) )
+        slices = list_graph_paths( sd )
         for s in slices:
             nd_fraction = get_label( s, nd_fraction_labels )
             slice_path_to_label[ s ] = nd_fraction
@@ -133,10 +132,11 @@ def load_event_graph_attributes(attributes_path=default_graph_attributes_path):
 
 
 @timer
-def load_graphs( slice_path_to_label ):
+def load_graphs( slice_path_to_label, n_workers=None ):
     """
+    Parses the slices in parallel, in sorted path order
     """
-    return [ read_graph(p) for p in sorted(slice_path_to_label) ]
+    return get_graph_loader( n_workers ).load( sorted(slice_path_to_label) )
 
 @timer
 def convert_graphs( graphs, label_request ):
@@ -261,7 +261,7 @@ def get_name_from_label_request( label_request ):
 
 
 
-def evaluate_vertex_histogram_kernel( graphs, graph_labels, label_requests, n_folds=10, seed=None ):
+def evaluate_vertex_histogram_kernel( graphs, graph_labels, label_requests, n_folds=10, seed=None, n_workers=None ):
     """
     """
 
@@ -272,8 +272,8 @@ def evaluate_vertex_histogram_kernel( graphs, graph_labels, label_requests, n_fo
     # Just a few sanity checks
     assert( len(graphs) == len(graph_labels) )
 
-    # Mapping from vertex labeling to results
-    vertex_labeling_to_results = {}
+    # Mapping from vertex labeling to its kernel matrix
+    vertex_labeling_to_k_mat = {}
     
     # Sweep over vertex label options
     for lr in label_requests:
@@ -288,64 +288,34 @@ def evaluate_vertex_histogram_kernel( graphs, graph_labels, label_requests, n_fo
         # Convert the base graphs into representations with
         # the requested vertex and edge labels, if any.
         relabeled_graphs = [ relabel_for_wlst_kernel(g, label=requested_vertex_label) for g in graphs ]
-        
-        # Define lists to track non-determinism fraction prediction results 
-        # over multiple folds
-        true_nd_vals = []
-        pred_nd_vals = []
-        
-        # Compute kernel matrix
-        k_mat = gk.CalculateVertexHistKernel( relabeled_graphs )
-
-        # Define training and testing sets
-        graph_indices = list(range(len(graph_labels)))
-        kf = KFold(n_splits=n_folds, random_state=seed, shuffle=True)
-        for split_idx, (train_indices, test_indices) in enumerate(kf.split(graph_indices)):
-            
-            # Print progress
-            print("Running split {}/{}".format(split_idx+1, n_folds))
-
-            # Get training and testing graphs
-            g_train = [ relabeled_graphs[i] for i in train_indices ]
-            g_test = [ relabeled_graphs[i] for i in test_indices ]
 
-            # Get the non-determinism fraction values for the training and 
-            # testing graphs
-            y_train = [ graph_labels[i] for i in train_indices ]
-            y_test = [ graph_labels[i] for i in test_indices ]
+        # Compute kernel matrix
+        vertex_labeling_to_k_mat[ requested_vertex_label ] = compute_vertex_histogram_kernel( relabeled_graphs )
 
-            # Retrieve embeddings of training and test graphs
-            k_train = np.zeros((len(train_indices), len(train_indices)))
-            k_test  = np.zeros((len(test_indices), len(train_indices)))
-            for i in range(len(train_indices)):
-                for j in range(len(train_indices)):
-                    k_train[i][j] = k_mat[ train_indices[i] ][ train_indices[j] ]
-            for i in range(len(test_indices)):
-                for j in range(len(train_indices)):
-                    k_test[i][j] = k_mat[ test_indices[i] ][ train_indices[j] ]
+    # Define training and testing sets, shared by all vertex labelings
+    splits = get_kfold_splits( len(graph_labels), n_folds, [ seed ] )
 
-            # Train SVM regressor using precomputed kernel matrix
-            model = svm.SVR("precomputed").fit(k_train, y_train)
-            model.fit(k_train, y_train)
-
-            # Evaluate model against the embeddedings of the test graphs
-            y_pred = model.predict(k_test)
-             
-            # Print progress
-            print("Done with split {}/{}".format(split_idx+1, n_folds))
-            print()
+    # Train an SVM regressor on each vertex labeling's precomputed kernel matrix
+    # for each split, and evaluate it against the test graphs. All fits run in 
+    # parallel.
+    print("Running {} splits for {} vertex labelings".format(len(splits), len(vertex_labeling_to_k_mat)))
+    split_to_pred = cross_validate( vertex_labeling_to_k_mat, graph_labels, splits, "svr", n_workers )
+    print()
 
-            # Aggregate results for this fold
-            true_nd_vals += list(y_test)
-            pred_nd_vals += list(y_pred)
-        
-        # Aggregate results for this vertex labeling
+    # Aggregate results for each vertex labeling over multiple folds
+    vertex_labeling_to_results = {}
+    for requested_vertex_label in vertex_labeling_to_k_mat:
+        true_nd_vals = []
+        pred_nd_vals = []
+        for repeat_idx, split_idx, train_indices, test_indices in splits:
+            true_nd_vals += [ graph_labels[i] for i in test_indices ]
+            pred_nd_vals += list( split_to_pred[ ( requested_vertex_label, repeat_idx, split_idx ) ] )
         vertex_labeling_to_results[ requested_vertex_label ] = { "true" : true_nd_vals, "pred" : pred_nd_vals }
 
     return vertex_labeling_to_results
 
 
-def evaluate_wlst_kernel( graphs, graph_labels, wl_iter_range, label_requests, n_folds=10, seed=None ):
+def evaluate_wlst_kernel( graphs, graph_labels, wl_iter_range, label_requests, n_folds=10, seed=None, n_workers=None ):
     """
     """
 
@@ -356,8 +326,8 @@ def evaluate_wlst_kernel( graphs, graph_labels, wl_iter_range, label_requests, n
     # Just a few sanity checks
     assert( len(graphs) == len(graph_labels) )
     
-    # Mapping from vertex labeling to results
-    vertex_labeling_to_results = {}
+    # Mapping from ( vertex labeling, # WL-iterations ) to its kernel matrix
+    labeling_and_n_iters_to_k_mat = {}
 
     # Sweep over vertex label options
     for lr in label_requests:
@@ -372,77 +342,38 @@ def evaluate_wlst_kernel( graphs, graph_labels, wl_iter_range, label_requests, n
         # Convert the base graphs into representations with
         # the requested vertex and edge labels, if any.
         relabeled_graphs = [ relabel_for_wlst_kernel(g, label=requested_vertex_label) for g in graphs ]
-        
-        # Store results for this vertex labeling
-        n_iters_to_results = {}
 
-        # Sweep over WL-iteration range
+        # Compute the kernel matrices for all WL-iteration counts in the range
+        # in a single refinement pass
+        n_iters_to_k_mat = compute_wl_kernel_matrices( relabeled_graphs, wl_iter_range )
         for n_wl_iters in wl_iter_range:
+            labeling_and_n_iters_to_k_mat[ ( requested_vertex_label, n_wl_iters ) ] = n_iters_to_k_mat[ n_wl_iters ]
 
-            # Print progress
-            print("# WL-Iterations: {}".format(n_wl_iters))
-            print()
-        
-            # Compute kernel matrix
-            k_mat = gk.CalculateWLKernel( relabeled_graphs, n_wl_iters )
+    # Define training and testing sets, shared by all kernel matrices
+    splits = get_kfold_splits( len(graph_labels), n_folds, [ seed ] )
 
-            # Define lists to track non-determinism fraction prediction results 
-            # over multiple folds
-            true_nd_vals = []
-            pred_nd_vals = []
-            
-            # Define training and testing sets
-            graph_indices = list(range(len(graph_labels)))
-            kf = KFold(n_splits=n_folds, random_state=seed, shuffle=True)
-            for split_idx, (train_indices, test_indices) in enumerate(kf.split(graph_indices)):
-                
-                # Print progress
-                print("Running split {}/{}".format(split_idx+1, n_folds))
-
-                # Get training and testing graphs
-                g_train = [ relabeled_graphs[i] for i in train_indices ]
-                g_test = [ relabeled_graphs[i] for i in test_indices ]
-
-                # Get the non-determinism fraction values for the training and 
-                # testing graphs
-                y_train = [ graph_labels[i] for i in train_indices ]
-                y_test = [ graph_labels[i] for i in test_indices ]
-
-                # Retrieve embeddings of training and test graphs
-                k_train = np.zeros((len(train_indices), len(train_indices)))
-                k_test  = np.zeros((len(test_indices), len(train_indices)))
-                for i in range(len(train_indices)):
-                    for j in range(len(train_indices)):
-                        k_train[i][j] = k_mat[ train_indices[i] ][ train_indices[j] ]
-                for i in range(len(test_indices)):
-                    for j in range(len(train_indices)):
-                        k_test[i][j] = k_mat[ test_indices[i] ][ train_indices[j] ]
-                
-                # Train SVM regressor using precomputed kernel matrix
-                model = svm.SVR("precomputed").fit(k_train, y_train)
-                model.fit(k_train, y_train)
-
-                # Evaluate model against the embeddedings of the test graphs
-                y_pred = model.predict(k_test)
-                 
-                # Print progress
-                print("Done with split {}/{}".format(split_idx+1, n_folds))
-                print()
-
-                # Aggregate results for this fold
-                true_nd_vals += list(y_test)
-                pred_nd_vals += list(y_pred)
-            
-            # Aggregate results for this # iterations
-            n_iters_to_results[n_wl_iters] = { "true" : true_nd_vals, "pred" : pred_nd_vals } 
-        
-        # Aggregate results for this vertex labeling
-        vertex_labeling_to_results[ requested_vertex_label ] = n_iters_to_results
+    # Train an SVM regressor on each precomputed kernel matrix for each split,
+    # and evaluate it against the test graphs. All fits run in parallel.
+    print("Running {} splits for {} kernel matrices".format(len(splits), len(labeling_and_n_iters_to_k_mat)))
+    split_to_pred = cross_validate( labeling_and_n_iters_to_k_mat, graph_labels, splits, "svr", n_workers )
+    print()
+
+    # Aggregate results for each vertex labeling and # iterations over 
+    # multiple folds
+    vertex_labeling_to_results = {}
+    for ( requested_vertex_label, n_wl_iters ) in labeling_and_n_iters_to_k_mat:
+        true_nd_vals = []
+        pred_nd_vals = []
+        for repeat_idx, split_idx, train_indices, test_indices in splits:
+            true_nd_vals += [ graph_labels[i] for i in test_indices ]
+            pred_nd_vals += list( split_to_pred[ ( ( requested_vertex_label, n_wl_iters ), repeat_idx, split_idx ) ] )
+        n_iters_to_results = vertex_labeling_to_results.setdefault( requested_vertex_label, {} )
+        n_iters_to_results[ n_wl_iters ] = { "true" : true_nd_vals, "pred" : pred_nd_vals }
 
     return vertex_labeling_to_results
 
 
-def main( traces_root_dir, output_path ):
+def main( traces_root_dir, output_path, loader_workers=None, n_workers=None ):
     #base_kernel_defs = load_base_kernel_defs()
     #wl_kernel_defs = get_wl_kernel_defs(base_kernel_defs)
     #hc_kernel_defs = get_hc_kernel_defs(base_kernel_defs)
@@ -456,7 +387,7 @@ def main( traces_root_dir, output_path ):
     
     # Ingest graphs 
     print("Ingesting graphs...")
-    graphs = load_graphs( slice_path_to_label )
+    graphs = load_graphs( slice_path_to_label, loader_workers )
 
     graphs = [ compute_extra_labels(g) for g in graphs ]
   
@@ -495,14 +426,14 @@ def main( traces_root_dir, output_path ):
         # Train models
         # TODO: Figure out why GraKeL vertex histogram is throwing errors on
         # logical timestamp-labeled event graphs for message race pattern
-        # For now, we substitute the graphkernels package implementation 
+        # For now, we substitute the in-project histogram kernel implementation 
         if kernel_name == "vertex_histogram":
-            results = evaluate_vertex_histogram_kernel( graphs, graph_labels, label_requests )
+            results = evaluate_vertex_histogram_kernel( graphs, graph_labels, label_requests, n_workers=n_workers )
         elif kernel_name == "weisfeiler_lehman_subtree_wl":
             #wl_iter_range = [5, 10, 20, 40]
             wl_iter_range = [ 2, 4, 6, 8, 10 ]
             #wl_iter_range = [60, 80, 100]
-            results = evaluate_wlst_kernel( graphs, graph_labels, wl_iter_range, label_requests )
+            results = evaluate_wlst_kernel( graphs, graph_labels, wl_iter_range, label_requests, n_workers=n_workers )
         else:
             results = evaluate_kernel( graphs, graph_labels, k_def, label_requests )
 
@@ -527,10 +458,14 @@ if __name__ == "__main__":
     parser.add_argument("traces_root_dir",
                         help="The top-level directory containing as subdirectories all the traces of the runs for which this kernel distance time series will be computed")  
     parser.add_argument("-o", "--output_path")
+    parser.add_argument("--loader_workers", type=int, required=False, default=None,
+                        help="Number of worker processes to parse slices with. Default: one per CPU")
+    parser.add_argument("--n_workers", type=int, required=False, default=None,
+                        help="Number of worker processes that the (kernel matrix x fold) SVR fits are spread over. Default: one per CPU")
     #parser.add_argument("kernel_file", 
     #                    help="A JSON file describing the graph kernels that will be computed for each set of slice subgraphs")
     args = parser.parse_args()
 
     #main( args.traces_root_dir, args.kernel_file ) 
-    main( args.traces_root_dir, args.output_path ) 
+    main( args.traces_root_dir, args.output_path, args.loader_workers, args.n_workers ) 
 
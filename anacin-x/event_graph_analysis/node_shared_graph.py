@@ -0,0 +1,128 @@
+import numpy as np
+
+from mpi4py import MPI
+
+import sys
+sys.path.append(".")
+
+from utilities import ( read_graph_arrays,
+                        event_graph_arrays
+                      )
+
+"""
+Node-shared event graphs for MPI jobs.
+
+When every MPI process reads the same event graph, each co-located process
+parses its own copy, so ingest time and resident memory grow with the number
+of processes per node. Instead, one process per node (the lowest rank of the
+node's shared-memory communicator, found with MPI.COMM_TYPE_SHARED) reads the
+graph and copies its arrays into an MPI shared-memory window. Every process on
+the node, including the reader, then uses read-only views of the same window,
+so the graph is parsed and held in memory once per node.
+
+The in-edge CSR that slicing uses to find message endpoints (see
+event_graph_arrays.in_csr) is computed once by the reader and shared as well.
+Other arrays derived from the graph, such as the per-rank timestamp index used
+for slicing, can be shared the same way with share_arrays_node_shared.
+"""
+
+_alignment = 64
+
+def _padding( n_bytes ):
+    return ( -n_bytes ) % _alignment
+
+"""
+Lays out arrays back-to-back, each aligned. Returns the layout, mapping each
+array's key to its dtype, length, and byte offset, and the total size.
+"""
+def _get_layout( key_to_array ):
+    layout = []
+    offset = 0
+    for key, array in key_to_array.items():
+        layout.append( ( key, array.dtype.str, len( array ), offset ) )
+        offset += array.nbytes + _padding( array.nbytes )
+    return layout, offset
+
+def _get_shared_arrays( key_to_array, node_comm ):
+    """
+    Copies the reader's arrays into a window shared by all processes on the
+    node. Returns the window and each array's read-only view into it.
+    """
+    is_reader = node_comm.Get_rank() == 0
+    if is_reader:
+        layout, n_bytes = _get_layout( key_to_array )
+    else:
+        layout, n_bytes = None, None
+    layout, n_bytes = node_comm.bcast( ( layout, n_bytes ), root=0 )
+    # Only the reader allocates; the others attach to its segment
+    window = MPI.Win.Allocate_shared( max( n_bytes, 1 ) if is_reader else 0, 1, comm=node_comm )
+    buf, _ = window.Shared_query( 0 )
+    memory = np.ndarray( buffer=buf, dtype=np.uint8, shape=( max( n_bytes, 1 ), ) )
+    if is_reader:
+        for key, dtype, length, offset in layout:
+            array = np.ascontiguousarray( key_to_array[ key ] )
+            memory[ offset:offset + array.nbytes ] = array.view( np.uint8 )
+    node_comm.Barrier()
+    views = {}
+    for key, dtype, length, offset in layout:
+        dtype = np.dtype( dtype )
+        view = memory[ offset:offset + length * dtype.itemsize ].view( dtype )
+        view.flags.writeable = False
+        views[ key ] = view
+    return window, views
+
+"""
+Computes a dict of arrays once per node, by calling compute_fn in the node's 
+reader only, and returns ( window, views ), where views maps the same keys to
+read-only views of the arrays in memory shared by all processes on the node.
+The window must be kept alive as long as the views are used. Collective over 
+comm.
+"""
+def share_arrays_node_shared( compute_fn, comm=MPI.COMM_WORLD ):
+    node_comm = comm.Split_type( MPI.COMM_TYPE_SHARED )
+    key_to_array = compute_fn() if node_comm.Get_rank() == 0 else None
+    return _get_shared_arrays( key_to_array, node_comm )
+
+"""
+Reads an event graph once per node and returns it as an event_graph_arrays
+object backed by node-shared memory. Collective over comm.
+"""
+def read_graph_arrays_node_shared( graph_path, comm=MPI.COMM_WORLD ):
+    node_comm = comm.Split_type( MPI.COMM_TYPE_SHARED )
+    if node_comm.Get_rank() == 0:
+        graph = read_graph_arrays( graph_path )
+        in_indptr, in_sources, in_edge_ids = graph.in_csr()
+        key_to_array = { ( "topology", "indptr" )   : graph.indptr,
+                         ( "topology", "indices" )  : graph.indices,
+                         ( "in_csr", "indptr" )     : in_indptr,
+                         ( "in_csr", "sources" )    : in_sources,
+                         ( "in_csr", "edge_ids" )   : in_edge_ids }
+        for name, column in graph.vertex_columns.items():
+            key_to_array[ ( "vertex", name ) ] = np.asarray( column )
+        for name, column in graph.edge_columns.items():
+            key_to_array[ ( "edge", name ) ] = np.asarray( column )
+        header = { "n_vertices"    : graph.n_vertices,
+                   "directed"      : graph.directed,
+                   "vertex_vocabs" : graph.vertex_vocabs,
+                   "edge_vocabs"   : graph.edge_vocabs }
+    else:
+        key_to_array, header = None, None
+    header = node_comm.bcast( header, root=0 )
+    window, views = _get_shared_arrays( key_to_array, node_comm )
+    # The reader's private copy is no longer needed
+    del key_to_array
+
+    vertex_columns = { name:v for (section,name),v in views.items() if section == "vertex" }
+    edge_columns = { name:v for (section,name),v in views.items() if section == "edge" }
+    graph = event_graph_arrays( header["n_vertices"],
+                                views[ ( "topology", "indptr" ) ],
+                                views[ ( "topology", "indices" ) ],
+                                vertex_columns, header["vertex_vocabs"],
+                                edge_columns, header["edge_vocabs"],
+                                directed=header["directed"] )
+    graph._in_csr = ( views[ ( "in_csr", "indptr" ) ],
+                      views[ ( "in_csr", "sources" ) ],
+                      views[ ( "in_csr", "edge_ids" ) ] )
+    # The window must outlive the views into it
+    graph._shared_window = window
+    return graph
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+
+import argparse
+import pickle
+import json
+import os
+import numpy as np
+from scipy.special import gammaln, logsumexp
+
+import pprint
+
+import sys
+sys.path.append(".")
+
+from graph_kernel_postprocessing import flatten_distance_matrix
+from utilities import timer
+from kdts_store import load_kdts
+
+"""
+Online change-point detection on a kernel distance time series.
+
+anomaly_detection.py only runs once the whole KDTS exists. The detectors here
+instead consume one slice at a time, in slice index order, while the KDTS is
+being computed (see compute_kernel_distance_time_series --online_detection), so
+nondeterminism hotspots are reported while a long job is still running. Each
+slice is reduced to a few quantiles of its pairwise kernel distances (median
+included), and every detector keeps a bounded amount of state however many
+slices it has seen:
+
+- CUSUM accumulates each quantile's standardized deviations from a baseline
+  estimated on the first slices, and flags a change once the accumulated
+  deviation of any quantile exceeds a threshold.
+- Bayesian online change-point detection (BOCPD; Adams and MacKay, 2007) keeps
+  a posterior over the number of slices since the last change, truncated to a
+  maximum run length. It flags a change at most max_delay slices after it
+  happened, or not at all.
+
+Slices finish out of order when computed in parallel, so results are fed
+through an ordered_slice_feed, which buffers those that arrive early.
+
+Detector policies are given as a JSON file in the same format as the anomaly
+detection policies, optionally with the kernel to monitor and the distance
+quantiles to summarize each slice by:
+
+{ "kernel" : [ "wlst", "logical_time", 2 ],
+  "quantiles" : [ 0.25, 0.5, 0.75 ],
+  "policies" : [ { "name" : "cusum", "params" : { "threshold" : 10 } } ] }
+"""
+
+default_quantile_levels = [ 0.25, 0.5, 0.75 ]
+
+"""
+Summarizes a slice's distance matrix (or sampled distances) by quantiles of its
+pairwise distances. Slices without pairs are summarized by NaN.
+"""
+def get_distance_summary( distance_mat, quantile_levels=default_quantile_levels ):
+    distances = flatten_distance_matrix( distance_mat )
+    if len( distances ) == 0:
+        return np.full( len( quantile_levels ), np.nan )
+    return np.quantile( distances, quantile_levels )
+
+class _feature_baseline(object):
+    """
+    Mean and standard deviation of each summary feature over the first n_slices
+    slices, computed with Welford's algorithm
+    """
+    def __init__(self, n_slices):
+        self._n_slices = n_slices
+        self._n = 0
+        self._mean = None
+        self._m2 = None
+
+    def ready(self):
+        return self._n >= self._n_slices
+
+    def add(self, x):
+        if self._mean is None:
+            self._mean = np.zeros_like( x )
+            self._m2 = np.zeros_like( x )
+        self._n += 1
+        delta = x - self._mean
+        self._mean += delta / self._n
+        self._m2 += delta * ( x - self._mean )
+
+    def standardize(self, x):
+        std = np.sqrt( self._m2 / max( self._n - 1, 1 ) )
+        # Deterministic slices have no spread at all; any change then counts as
+        # a large deviation rather than a division by zero
+        std = np.maximum( std, 1e-9 * np.maximum( 1.0, np.abs( self._mean ) ) )
+        return ( x - self._mean ) / std
+
+class cusum_detector(object):
+    """
+    Two-sided CUSUM on each standardized summary feature. drift is the
+    deviation (in baseline standard deviations) tolerated per slice, and
+    threshold the accumulated deviation that triggers a flag. After a flag, the
+    baseline is re-estimated from the following slices. The flagged slice is
+    the one where the accumulated deviation started to grow.
+    """
+    def __init__(self, warmup=50, drift=0.5, threshold=10.0):
+        self._warmup = warmup
+        self._drift = drift
+        self._threshold = threshold
+        self._reset()
+
+    def _reset(self):
+        self._baseline = _feature_baseline( self._warmup )
+        self._upper = None
+        self._lower = None
+        self._upper_start = None
+        self._lower_start = None
+
+    def update(self, slice_idx, x):
+        if not self._baseline.ready():
+            self._baseline.add( x )
+            return None
+        z = self._baseline.standardize( x )
+        if self._upper is None:
+            self._upper = np.zeros_like( z )
+            self._lower = np.zeros_like( z )
+            self._upper_start = np.full( len( z ), slice_idx )
+            self._lower_start = np.full( len( z ), slice_idx )
+        # Record where each sum leaves zero, as the estimated start of a change
+        self._upper_start[ self._upper == 0 ] = slice_idx
+        self._lower_start[ self._lower == 0 ] = slice_idx
+        self._upper = np.maximum( 0.0, self._upper + z - self._drift )
+        self._lower = np.maximum( 0.0, self._lower - z - self._drift )
+        scores = np.concatenate( ( self._upper, self._lower ) )
+        if not scores.max() > self._threshold:
+            return None
+        change_idx = int( np.concatenate( ( self._upper_start, self._lower_start ) )[ np.argmax( scores ) ] )
+        self._reset()
+        return change_idx
+
+class bocpd_detector(object):
+    """
+    Bayesian online change-point detection with a constant hazard rate. Each
+    standardized summary feature is modeled as independent Gaussian with
+    unknown mean and variance (normal-gamma prior), so each run length's
+    predictive distribution is a product of Student-t's. A change is flagged
+    when the posterior probability that it happened within the last max_delay
+    slices exceeds threshold; each change is flagged once.
+    """
+    def __init__(self, warmup=50, hazard=0.005, max_run_length=100, max_delay=5, threshold=0.8,
+                 prior_mean=0.0, prior_kappa=1.0, prior_alpha=1.0, prior_beta=1.0):
+        self._baseline = _feature_baseline( warmup )
+        self._log_hazard = np.log( hazard )
+        self._log_survival = np.log1p( -hazard )
+        self._max_run_length = max_run_length
+        self._max_delay = max_delay
+        self._threshold = threshold
+        self._prior = ( prior_mean, prior_kappa, prior_alpha, prior_beta )
+        self._log_probs = None
+        self._last_change_idx = None
+
+    def _get_prior_params(self, n_features):
+        return [ np.full( ( 1, n_features ), p, dtype=np.float64 ) for p in self._prior ]
+
+    def _get_log_predictive(self, z):
+        mu, kappa, alpha, beta = self._params
+        scale2 = beta * ( kappa + 1 ) / ( alpha * kappa )
+        dof = 2 * alpha
+        log_pdf = ( gammaln( ( dof + 1 ) / 2 ) - gammaln( dof / 2 )
+                    - 0.5 * np.log( np.pi * dof * scale2 )
+                    - ( dof + 1 ) / 2 * np.log1p( ( z - mu )**2 / ( dof * scale2 ) ) )
+        return log_pdf.sum( axis=1 )
+
+    def update(self, slice_idx, x):
+        if not self._baseline.ready():
+            self._baseline.add( x )
+            return None
+        z = self._baseline.standardize( x )
+        if self._log_probs is None:
+            self._log_probs = np.zeros( 1 )
+            self._params = self._get_prior_params( len( z ) )
+            # The first run starts with this slice, which is not a change
+            self._last_change_idx = slice_idx
+
+        # Grow every run by this slice, or end it with a change before it
+        log_joint = self._log_probs + self._get_log_predictive( z )
+        log_probs = np.concatenate( ( [ logsumexp( log_joint ) + self._log_hazard ],
+                                      log_joint + self._log_survival ) )
+
+        # Update each run's posterior with this slice; a new run starts from
+        # the prior
+        mu, kappa, alpha, beta = self._params
+        updated = [ ( kappa * mu + z ) / ( kappa + 1 ),
+                    kappa + 1,
+                    alpha + 0.5,
+                    beta + kappa * ( z - mu )**2 / ( 2 * ( kappa + 1 ) ) ]
+        prior = self._get_prior_params( len( z ) )
+        self._params = [ np.concatenate( ( p, u ) ) for p,u in zip( prior, updated ) ]
+
+        # Bound the state by dropping the longest runs
+        log_probs = log_probs[ :self._max_run_length+1 ]
+        self._params = [ p[ :self._max_run_length+1 ] for p in self._params ]
+        self._log_probs = log_probs - logsumexp( log_probs )
+
+        # A run of length r started r slices ago, i.e., with slice_idx - r + 1.
+        # Runs of length 0 only carry the prior hazard, so they are excluded.
+        recent = np.exp( self._log_probs[ 1:self._max_delay+1 ] )
+        if not recent.sum() > self._threshold:
+            return None
+        change_idx = slice_idx - int( np.argmax( recent ) )
+        if self._last_change_idx is not None and change_idx <= self._last_change_idx:
+            return None
+        self._last_change_idx = change_idx
+        return change_idx
+
+def get_online_detector( policy ):
+    policy_name = policy["name"]
+    policy_params = policy.get( "params", {} )
+    if policy_name == "cusum":
+        return cusum_detector( **policy_params )
+    elif policy_name == "bocpd":
+        return bocpd_detector( **policy_params )
+    else:
+        raise NotImplementedError("Online change-point detection policy: {} is not implemented".format(policy_name))
+
+"""
+Reads online detection policies. Returns the key of the kernel to monitor (or
+None if not specified), the quantile levels to summarize slices by, and the
+policies.
+"""
+def read_online_detection_policies( policy_file_path ):
+    with open( policy_file_path, "r" ) as infile:
+        config = json.load( infile )
+    kernel_key = tuple( config["kernel"] ) if "kernel" in config else None
+    quantile_levels = config.get( "quantiles", default_quantile_levels )
+    return kernel_key, quantile_levels, config["policies"]
+
+class ordered_slice_feed(object):
+    """
+    Feeds slice summaries to a set of online detectors in the order of
+    slice_indices, as they arrive in any order. Summaries that arrive ahead of
+    their turn are buffered until all earlier slices have arrived. Slices that
+    are not computed in this run (e.g., already in the store) are obtained with
+    read_summary when it is their turn. Flags are passed to on_flag( name,
+    change_idx, slice_idx ) as soon as they are raised, where slice_idx is the
+    slice whose summary raised them.
+    """
+    def __init__(self, slice_indices, policies, read_summary=None, on_flag=None):
+        self._slice_indices = list( slice_indices )
+        self._position = 0
+        self._buffer = {}
+        self._read_summary = read_summary
+        self._on_flag = on_flag
+        self._detectors = { policy["name"] : get_online_detector( policy ) for policy in policies }
+        self.flagged = { name : [] for name in self._detectors }
+
+    def add(self, slice_idx, summary):
+        self._buffer[ slice_idx ] = summary
+        self._drain()
+
+    def skip(self, slice_indices):
+        """
+        Marks slices whose summaries are not going to arrive, so they are read
+        with read_summary instead
+        """
+        for slice_idx in slice_indices:
+            self._buffer.setdefault( slice_idx, None )
+        self._drain()
+
+    def _drain(self):
+        while self._position < len( self._slice_indices ):
+            slice_idx = self._slice_indices[ self._position ]
+            if slice_idx not in self._buffer:
+                return
+            summary = self._buffer.pop( slice_idx )
+            if summary is None and self._read_summary is not None:
+                summary = self._read_summary( slice_idx )
+            self._position += 1
+            if summary is None or np.isnan( summary ).any():
+                continue
+            for name, detector in self._detectors.items():
+                change_idx = detector.update( slice_idx, np.asarray( summary, dtype=np.float64 ) )
+                if change_idx is not None:
+                    self.flagged[ name ].append( change_idx )
+                    if self._on_flag is not None:
+                        self._on_flag( name, change_idx, slice_idx )
+
+    def n_buffered(self):
+        return len( self._buffer )
+
+def print_flag( policy_name, change_idx, slice_idx ):
+    print("Online detection: {} flagged slice: {} (detected at slice: {})".format( policy_name, change_idx, slice_idx ), flush=True)
+
+"""
+Replays an existing kernel distance time series through the online detectors,
+e.g., to tune their parameters
+"""
+@timer
+def main( kernel_distance_data_path, policy_file_path, output_path ):
+    # Read in kernel distance time series data
+    slice_idx_to_data = load_kdts( kernel_distance_data_path )
+
+    # Read in online detection policies, and monitor the first kernel in the
+    # data if none is specified
+    kernel_key, quantile_levels, policies = read_online_detection_policies( policy_file_path )
+    slice_indices = sorted( slice_idx_to_data.keys() )
+    if kernel_key is None:
+        kernel_key = next( iter( slice_idx_to_data[ slice_indices[0] ]["kernel_distance"] ) )
+
+    feed = ordered_slice_feed( slice_indices, policies, on_flag=print_flag )
+    for slice_idx in slice_indices:
+        distance_mat = slice_idx_to_data[ slice_idx ]["kernel_distance"][ kernel_key ]
+        feed.add( slice_idx, get_distance_summary( distance_mat, quantile_levels ) )
+
+    pprint.pprint( feed.flagged )
+
+    # Determine output path
+    kdts_path = os.path.dirname( kernel_distance_data_path )
+    if output_path is None:
+        output_path = kdts_path + "/online_flagged_indices.pkl"
+    else:
+        name,ext = os.path.splitext( output_path )
+        if ext != ".pkl":
+            output_path = kdts_path + "/" + name + ".pkl"
+        else:
+            output_path = kdts_path + "/" + output_path
+
+    # Write output
+    with open( output_path, "wb" ) as outfile:
+        pickle.dump( feed.flagged, outfile, pickle.HIGHEST_PROTOCOL )
+
+if __name__ == "__main__":
+    desc = "Replays a time series of kernel distance data through online change-point detectors"
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument("kernel_distance_data",
+                        help="Path to pickle file or store of kernel distance time series data")
+    parser.add_argument("online_detection_policies",
+                        help="JSON file describing the online change-point detectors to run")
+    parser.add_argument("-o", "--output_path", default=None,
+                        action="store", type=str, required=False,
+                        help="Path to write flagged slice indices to. Optional.")
+    args = parser.parse_args()
+
+    main( args.kernel_distance_data,
+          args.online_detection_policies,
+          args.output_path )
@@ -0,0 +1,194 @@
+import os
+import atexit
+import tempfile
+import multiprocessing as mp
+
+import psutil
+
+import sys
+sys.path.append(".")
+
+from utilities import ( read_graph,
+                        read_graph_arrays,
+                        read_graph_binary,
+                        write_graph_binary,
+                        is_binary_graph_path,
+                        binary_graph_ext
+                      )
+
+"""
+Parallel loading of event graphs with a persistent pool of worker processes.
+
+Parsing GraphML is CPU-bound and dominates ingest when hundreds of full event
+graphs are read, so it is spread over worker processes. Each process creates
+its pool once, on first use, and reuses it for every later load. Workers hand
+parsed graphs back without pickling their arrays: each worker writes its graph
+in the binary columnar format to a file in shared memory (/dev/shm), which the
+caller memory-maps and unlinks right away. The arrays are therefore never
+copied between processes, and their memory is released once the caller drops
+the graph. Binary event graphs need no parsing and are memory-mapped by the
+caller directly.
+
+Callers that work on arrays should use load_arrays: converting the graphs to
+igraph objects in the calling process costs a sizeable fraction of parsing
+them.
+
+Results are always returned in the order of the requested paths.
+"""
+
+_shared_memory_dir = "/dev/shm"
+
+"""
+Returns the directory that files shared between processes are written to:
+/dev/shm if available, so that they are only ever held in memory
+"""
+def get_shared_memory_dir():
+    if os.path.isdir( _shared_memory_dir ) and os.access( _shared_memory_dir, os.W_OK ):
+        return _shared_memory_dir
+    return tempfile.gettempdir()
+
+"""
+Worker task: parses a graph file and writes it to a handoff file in binary
+format. Returns the handoff file's path.
+"""
+def _parse_graph( graph_path, handoff_dir, keep_edge_order ):
+    graph = read_graph_arrays( graph_path, keep_edge_order )
+    fd, handoff_path = tempfile.mkstemp( prefix="event_graph_", suffix=binary_graph_ext, dir=handoff_dir )
+    os.close( fd )
+    try:
+        write_graph_binary( graph, handoff_path )
+    except BaseException:
+        os.remove( handoff_path )
+        raise
+    return handoff_path
+
+"""
+Memory-maps a handoff file and unlinks it. The mapping stays valid until the
+graph's arrays are dropped.
+"""
+def _receive_graph( handoff_path ):
+    try:
+        return read_graph_binary( handoff_path, mmap=True )
+    finally:
+        os.remove( handoff_path )
+
+class parallel_graph_loader(object):
+    def __init__(self, n_workers=None):
+        # With a single worker, graphs are read in the calling process and no
+        # pool is created
+        self._n_workers = n_workers if n_workers is not None else psutil.cpu_count( logical=True )
+        self._pool = None
+
+    def n_workers(self):
+        return self._n_workers
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = mp.Pool( self._n_workers )
+        return self._pool
+
+    def _parse_all(self, graph_paths, keep_edge_order):
+        """
+        Parses the distinct graph files in parallel. Returns a map from paths
+        to handoff file paths. If any file fails to parse, all handoff files
+        are removed and the first error is raised.
+        """
+        pool = self._get_pool()
+        handoff_dir = get_shared_memory_dir()
+        pending = { p : pool.apply_async( _parse_graph, ( p, handoff_dir, keep_edge_order ) )
+                    for p in dict.fromkeys( graph_paths ) }
+        path_to_handoff = {}
+        error = None
+        for path, result in pending.items():
+            try:
+                path_to_handoff[ path ] = result.get()
+            except Exception as e:
+                if error is None:
+                    error = e
+        if error is not None:
+            for handoff_path in path_to_handoff.values():
+                os.remove( handoff_path )
+            raise error
+        return path_to_handoff
+
+    def _use_pool(self, paths_to_parse):
+        return self._n_workers > 1 and len( set( paths_to_parse ) ) > 1
+
+    def load_arrays(self, graph_paths, keep_edge_order=False):
+        """
+        Loads graphs as event_graph_arrays objects, in the order requested. If
+        keep_edge_order is set, parsed graphs record the file order of their
+        edges (see event_graph_arrays.file_order_edge_list).
+        """
+        graph_paths = [ str( p ) for p in graph_paths ]
+        paths_to_parse = [ p for p in graph_paths if not is_binary_graph_path( p ) ]
+        if not self._use_pool( paths_to_parse ):
+            return [ read_graph_arrays( p, keep_edge_order ) for p in graph_paths ]
+        path_to_handoff = self._parse_all( paths_to_parse, keep_edge_order )
+        path_to_graph = { p : _receive_graph( h ) for p,h in path_to_handoff.items() }
+        return [ path_to_graph[ p ] if p in path_to_graph else read_graph_arrays( p, keep_edge_order )
+                 for p in graph_paths ]
+
+    def load(self, graph_paths):
+        """
+        Loads graphs as igraph graphs, in the order requested. Graphs are the
+        same as those read_graph returns, including their edge ids.
+        """
+        graph_paths = [ str( p ) for p in graph_paths ]
+        paths_to_parse = [ p for p in graph_paths if not is_binary_graph_path( p ) ]
+        if not self._use_pool( paths_to_parse ):
+            return [ read_graph( p ) for p in graph_paths ]
+        path_to_handoff = self._parse_all( paths_to_parse, keep_edge_order=True )
+        path_to_graph = { p : _receive_graph( h ).to_igraph()
+                          for p,h in path_to_handoff.items() }
+        # A path requested more than once gets an independent copy each time
+        graphs = []
+        for p in graph_paths:
+            if p in path_to_graph:
+                graphs.append( path_to_graph.pop( p ) )
+            else:
+                graphs.append( read_graph( p ) )
+        return graphs
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+_loader = None
+
+"""
+Returns this process's shared loader, (re)creating it if a different number of
+workers is requested. Without a number of workers, returns the current loader,
+or creates one with a worker per CPU. Its pool is shut down when the process
+exits.
+"""
+def get_graph_loader( n_workers=None ):
+    global _loader
+    if n_workers is None:
+        if _loader is not None:
+            return _loader
+        n_workers = psutil.cpu_count( logical=True )
+    if _loader is None or _loader.n_workers() != n_workers:
+        if _loader is not None:
+            _loader.close()
+        _loader = parallel_graph_loader( n_workers )
+    return _loader
+
+@atexit.register
+def _close_graph_loader():
+    if _loader is not None:
+        _loader.close()
+
+"""
+Reads graph files in parallel with this process's shared loader
+"""
+def read_graphs_parallel( graph_paths, n_workers=None ):
+    return get_graph_loader( n_workers ).load( graph_paths )
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+import os
+import time
+from collections import deque
+
+from mpi4py import MPI
+comm = MPI.COMM_WORLD
+
+import sys
+sys.path.append(".")
+
+from utilities import get_slice_path
+
+"""
+Dynamic master/worker scheduling of per-slice work over MPI.
+
+Slices differ a lot in size (e.g., slices around mesh-refinement steps are
+much larger than the quiet ones), so handing them out round-robin up front
+leaves most ranks idle while a few finish their large slices. Here rank 0 acts
+as the master: it keeps a queue of slice indices and hands the next one to
+whichever worker asks for it. Each worker returns its previous slice's result
+together with its request for more work, so results reach the master
+incrementally rather than in one gather at the end.
+"""
+
+_REQUEST_TAG = 1
+_TASK_TAG = 2
+
+"""
+Estimates the cost of each slice as the total size on disk of that slice's
+subgraphs across all slice directories
+"""
+def get_slice_file_costs( slice_dirs, slice_indices ):
+    slice_to_cost = {}
+    for slice_idx in slice_indices:
+        paths = [ get_slice_path( sd, slice_idx ) for sd in slice_dirs ]
+        slice_to_cost[ slice_idx ] = sum( os.path.getsize( p ) for p in paths )
+    return slice_to_cost
+
+"""
+Orders slice indices for dispatch. If costs are given, the most expensive
+slices are dispatched first so that no large slice is left for the end.
+"""
+def order_slice_indices( slice_indices, slice_to_cost=None ):
+    if slice_to_cost is None:
+        return list( slice_indices )
+    return sorted( slice_indices, key=lambda idx: slice_to_cost[ idx ], reverse=True )
+
+def _run_master( slice_indices, result_fn ):
+    queue = deque( slice_indices )
+    n_active_workers = comm.Get_size() - 1
+    status = MPI.Status()
+    while n_active_workers > 0:
+        message = comm.recv( source=MPI.ANY_SOURCE, tag=_REQUEST_TAG, status=status )
+        worker = status.Get_source()
+        if message is not None:
+            slice_idx, result = message
+            result_fn( slice_idx, result )
+        if len( queue ) > 0:
+            comm.send( queue.popleft(), dest=worker, tag=_TASK_TAG )
+        else:
+            comm.send( None, dest=worker, tag=_TASK_TAG )
+            n_active_workers -= 1
+
+def _run_worker( task_fn ):
+    n_tasks = 0
+    busy_time = 0.0
+    message = None
+    while True:
+        comm.send( message, dest=0, tag=_REQUEST_TAG )
+        slice_idx = comm.recv( source=0, tag=_TASK_TAG )
+        if slice_idx is None:
+            break
+        task_start_time = time.time()
+        result = task_fn( slice_idx )
+        busy_time += time.time() - task_start_time
+        n_tasks += 1
+        message = ( slice_idx, result )
+    return n_tasks, busy_time
+
+def _run_serial( slice_indices, task_fn, result_fn ):
+    n_tasks = 0
+    busy_time = 0.0
+    for slice_idx in slice_indices:
+        task_start_time = time.time()
+        result = task_fn( slice_idx )
+        busy_time += time.time() - task_start_time
+        n_tasks += 1
+        result_fn( slice_idx, result )
+    return n_tasks, busy_time
+
+"""
+Prints, on the root process, how many slices each rank processed and what
+fraction of the scheduling period it spent doing so
+"""
+def report_utilization( n_tasks, busy_time, elapsed_time ):
+    rank_stats = comm.gather( ( n_tasks, busy_time, elapsed_time ), root=0 )
+    if comm.Get_rank() == 0:
+        for rank, stats in enumerate( rank_stats ):
+            n, busy, elapsed = stats
+            if rank == 0 and comm.Get_size() > 1:
+                print("Rank: {} (master) elapsed: {:.3f}s".format( rank, elapsed ))
+                continue
+            utilization = 100.0 * busy / elapsed if elapsed > 0 else 0.0
+            print("Rank: {} slices: {}, busy: {:.3f}s, idle: {:.3f}s, utilization: {:.1f}%".format( rank, n, busy, elapsed - busy, utilization ))
+
+"""
+Runs task_fn( slice_idx ) once for every slice index, dynamically distributed
+over all MPI processes, and reports per-rank utilization when done.
+
+Only the root process needs to provide the slice indices and their costs. If
+result_fn is given, it is called on the root process as result_fn( slice_idx,
+result ) as each result arrives. Otherwise, the results are collected into a
+dict mapping slice indices to results, which is returned on the root process.
+Non-root processes return an empty dict. With a single MPI process, all slices
+are processed in order on that process.
+"""
+def schedule_slices( slice_indices, task_fn, slice_to_cost=None, result_fn=None ):
+    rank = comm.Get_rank()
+    slice_idx_to_result = {}
+    if result_fn is None:
+        def result_fn( slice_idx, result ):
+            slice_idx_to_result[ slice_idx ] = result
+
+    start_time = time.time()
+    n_tasks = 0
+    busy_time = 0.0
+    if rank == 0:
+        ordered_indices = order_slice_indices( slice_indices, slice_to_cost )
+        if comm.Get_size() == 1:
+            n_tasks, busy_time = _run_serial( ordered_indices, task_fn, result_fn )
+        else:
+            _run_master( ordered_indices, result_fn )
+    else:
+        n_tasks, busy_time = _run_worker( task_fn )
+    elapsed_time = time.time() - start_time
+
+    report_utilization( n_tasks, busy_time, elapsed_time )
+    return slice_idx_to_result
@@ -4,7 +4,6 @@ import igraph
 import hashlib
 import argparse
 import pathlib
-import glob
 import os
 
 from mpi4py import MPI
@@ -14,7 +13,14 @@ import sys
 sys.path.append(".")
 sys.path.append("..")
 
-from utilities import timer, read_graph
+from utilities import ( timer, 
+                        read_graph, 
+                        write_graph, 
+                        list_graph_paths, 
+                        get_slice_path,
+                        binary_graph_format,
+                        binary_graph_ext
+                      )
 
 #import pygraphviz as pgv
 
@@ -81,19 +87,19 @@ def assign_slices( slice_dir ):
     comm_size = comm.Get_size()
     # Root process determines number and slices and broadcasts
     if rank == 0:
-        n_slices = len( glob.glob( slice_dir + "/*.graphml" ) )
+        n_slices = len( list_graph_paths( slice_dir, "slice_*" ) )
     else:
         n_slices = 0
     n_slices = comm.bcast( n_slices, root=0 )
     # Slice indices are assigned round-robin
     assigned_slice_indices = list( filter( lambda x : x % comm_size == rank, range( n_slices ) ) )
     # Determine slice graph paths from indices
-    assigned_slice_paths = [ slice_dir + "/slice_" + str(idx) + ".graphml" for idx in assigned_slice_indices ]
+    assigned_slice_paths = [ get_slice_path( slice_dir, idx ) for idx in assigned_slice_indices ]
     assignment = { idx:path for idx,path in zip(assigned_slice_indices, assigned_slice_paths) }
     return assignment
     
 
-def main( slice_dir, transform, output_dir ):
+def main( slice_dir, transform, output_dir, output_format ):
     # Set up transformed slice dir
     if output_dir is None:
         output_dir = str(pathlib.Path(slice_dir).parent) + "/transformed_slices_" + transform + "/"
@@ -109,9 +115,13 @@ def main( slice_dir, transform, output_dir ):
     else:
         raise NotImplementedError("Event Graph Transform: {} is not implemented".format(transform))
     # And writes them out
+    if output_format == binary_graph_format:
+        ext = binary_graph_ext
+    else:
+        ext = ".graphml"
     for idx,ts in idx_to_transformed.items():
-        output_path = output_dir + "/transformed_slice_" + str(idx) + ".graphml"
-        ts.write( output_path, format="graphml" )
+        output_path = output_dir + "/transformed_slice_" + str(idx) + ext
+        write_graph( ts, output_path, output_format )
 
 
 if __name__ == "__main__":
@@ -123,11 +133,14 @@ if __name__ == "__main__":
                         help="Which transformation to apply to each event graph slice. Options: (1) comm_channel")
     parser.add_argument("-o", "--output_dir", required=False, default=None,
                         help="Directory transformed event graphs will be written to. (Optional)")
+    parser.add_argument("-f", "--output_format", required=False, default="graphml",
+                        help="Format to write transformed event graphs as. Options: graphml, egb. (Optional)")
     args = parser.parse_args()
 
     main( args.slice_dir,
           args.transform,
-          args.output_dir
+          args.output_dir,
+          args.output_format
         )
 
     #g = igraph.Graph(directed=True)
@@ -1,8 +1,8 @@
 from functools import wraps
 from time import time
+import os
+import glob
 import json
-import multiprocessing as mp
-import psutil
 import igraph
 import numpy as np
 
@@ -27,28 +27,42 @@ def read_run_params( run_params_path ):
         return json.load(infile)
 
 # A function to read in a single graph file via igraph
+# Binary event graphs are converted to igraph objects after being read
 #@timer
 def read_graph( graph_path ):
+    if is_binary_graph_path( graph_path ):
+        return read_graph_binary( graph_path ).to_igraph()
     graph = igraph.read( graph_path )
     return graph
 
-def read_graphs_serial( graph_paths ):
-    return [ read_graph(p) for p in graph_paths ]
+# Edge column recording each edge's position in the graph file it was parsed
+# from, since event_graph_arrays objects store edges sorted by source vertex
+edge_order_column = "_edge_order"
 
-def read_graph_task( graph_path ):
+# A function to read in a single graph file as an event_graph_arrays object
+# Binary event graphs are memory-mapped rather than parsed. If keep_edge_order
+# is set, parsed graphs also record the file order of their edges (see
+# event_graph_arrays.file_order_edge_list).
+def read_graph_arrays( graph_path, keep_edge_order=False ):
+    if is_binary_graph_path( graph_path ):
+        return read_graph_binary( graph_path )
     graph = igraph.read( graph_path )
-    return (graph_path, graph)
-
-def read_graphs_parallel( graph_paths, return_sorted=False ):
-    n_cpus = psutil.cpu_count( logical=True )
-    workers = mp.Pool( n_cpus )
-    res = workers.map_async( read_graph_task, graph_paths )
-    graphs = res.get()
-    workers.close()
-    if return_sorted:
-        return [ g[1] for g in sorted( graphs, key=lambda x : x[0] ) ]
+    if keep_edge_order:
+        graph.es[ edge_order_column ] = list( range( graph.ecount() ) )
+    return event_graph_arrays.from_igraph( graph )
+
+# A function to write a single graph file. Graphs can be either igraph objects
+# or event_graph_arrays objects if writing in the binary format.
+def write_graph( graph, output_path, output_format="graphml" ):
+    if output_format == binary_graph_format:
+        write_graph_binary( graph, output_path )
     else:
-        return [ g[1] for g in graphs ]
+        if isinstance( graph, event_graph_arrays ):
+            graph = graph.to_igraph()
+        graph.write( output_path, format=output_format )
+
+def read_graphs_serial( graph_paths ):
+    return [ read_graph(p) for p in graph_paths ]
 
 
 # A function to read in a set of graphs whose paths are listed in a text file
@@ -83,4 +97,431 @@ def all_unique_keys( list_of_dicts ):
         return False
     else:
         return True
-        
+
+# Writes data to a file such that the file is either absent or complete, even
+# if the writer is interrupted or other processes read it concurrently: the data
+# is written to a temporary file that is then renamed into place
+def write_atomic( data, path, write_fn, mode="wb" ):
+    tmp_path = "{}.tmp.{}".format( path, os.getpid() )
+    with open( tmp_path, mode ) as outfile:
+        write_fn( data, outfile )
+        outfile.flush()
+        os.fsync( outfile.fileno() )
+    os.replace( tmp_path, path )
+
+
+################################################################################
+################## Binary columnar event graph format ##########################
+################################################################################
+
+# Name and file extension of the binary event graph format
+binary_graph_format = "egb"
+binary_graph_ext = ".egb"
+
+# Extensions of all event graph formats that read_graph understands, in order
+# of preference when the same graph is present in more than one format and
+# both copies are equally recent
+graph_exts = [ binary_graph_ext, ".graphml" ]
+
+# Layout of a binary event graph file:
+# [ magic (8 bytes) | header length (8 bytes, little-endian) | JSON header |
+#   padding | column 0 | padding | column 1 | ... ]
+# The JSON header records the dtype, length, and offset (relative to the start
+# of the data section) of every column, plus the vocabularies of all
+# dictionary-encoded string columns. Columns are aligned so that each one can
+# be memory-mapped directly as a numpy array.
+_binary_graph_magic = b"ANXEGB01"
+_binary_graph_alignment = 64
+
+
+def is_binary_graph_path( graph_path ):
+    return str( graph_path ).endswith( binary_graph_ext )
+
+"""
+Given the paths of the same graph in more than one format, in the order of
+graph_exts, returns the most recently written one, so that a graph re-written
+in one format after being converted to another is never shadowed by the stale
+copy. Ties go to the preferred format.
+"""
+def _select_graph_path( paths ):
+    if len( paths ) == 1:
+        return paths[0]
+    return max( paths, key=lambda p: ( os.path.getmtime( p ), -paths.index( p ) ) )
+
+"""
+Returns the path to the graph with the given path minus its extension. If the
+graph exists in more than one format, the most recently written copy is used,
+preferring the binary format when they are equally recent.
+"""
+def find_graph_path( path_stem ):
+    paths = [ str( path_stem ) + ext for ext in graph_exts ]
+    paths = [ p for p in paths if os.path.isfile( p ) ]
+    if len( paths ) == 0:
+        raise FileNotFoundError("No event graph found for: {}".format( path_stem ))
+    return _select_graph_path( paths )
+
+"""
+Returns the paths to all graphs in a directory whose names match the pattern.
+If a graph is present in more than one format, only the copy find_graph_path
+would choose is listed
+"""
+def list_graph_paths( graph_dir, pattern="*" ):
+    stem_to_paths = {}
+    for ext in graph_exts:
+        for path in glob.glob( str( graph_dir ) + "/" + pattern + ext ):
+            stem_to_paths.setdefault( os.path.splitext( path )[0], [] ).append( path )
+    return sorted( _select_graph_path( paths ) for paths in stem_to_paths.values() )
+
+"""
+Returns the path of slice slice_idx in a slice directory in whichever format it
+was written
+"""
+def get_slice_path( slice_dir, slice_idx ):
+    return find_graph_path( str( slice_dir ) + "/slice_" + str( slice_idx ) )
+
+
+# Converts a list of attribute values into a typed column. Returns the column
+# and, for string-valued attributes, the vocabulary its integer codes index.
+def _encode_column( values ):
+    if len( values ) == 0:
+        return np.zeros( 0, dtype=np.float64 ), None
+    if all( isinstance( v, ( bool, np.bool_ ) ) for v in values ):
+        return np.asarray( values, dtype=np.bool_ ), None
+    if all( isinstance( v, ( int, np.integer ) ) and not isinstance( v, ( bool, np.bool_ ) ) for v in values ):
+        return np.asarray( values, dtype=np.int64 ), None
+    if all( isinstance( v, ( int, float, np.number ) ) for v in values ):
+        return np.asarray( values, dtype=np.float64 ), None
+    strings = [ str( v ) for v in values ]
+    vocab = sorted( set( strings ) )
+    codes = np.searchsorted( np.asarray( vocab, dtype=object ), 
+                             np.asarray( strings, dtype=object ) )
+    return codes.astype( np.int32 ), vocab
+
+# Returns the ids of all edges stored in the CSR rows of the requested vertices
+def _gather_csr_ranges( indptr, rows ):
+    rows = np.asarray( rows, dtype=np.int64 )
+    starts = np.asarray( indptr[ rows ], dtype=np.int64 )
+    counts = np.asarray( indptr[ rows + 1 ], dtype=np.int64 ) - starts
+    total = int( counts.sum() )
+    if total == 0:
+        return np.zeros( 0, dtype=np.int64 ), counts
+    offsets = np.repeat( starts - np.cumsum( counts ) + counts, counts )
+    return offsets + np.arange( total, dtype=np.int64 ), counts
+
+
+class event_graph_arrays(object):
+    """
+    Column-oriented representation of an event graph. Vertex and edge 
+    attributes are stored as typed arrays, string-valued attributes are 
+    dictionary-encoded as integer codes plus a vocabulary, and edges are stored
+    in compressed sparse row (CSR) form, sorted by source vertex. When read 
+    from a binary event graph file, all arrays are read-only memory maps.
+    """
+    def __init__(self, n_vertices, indptr, indices, 
+                 vertex_columns=None, vertex_vocabs=None,
+                 edge_columns=None, edge_vocabs=None, directed=True):
+        self.n_vertices = n_vertices
+        self.indptr = indptr
+        self.indices = indices
+        self.vertex_columns = vertex_columns if vertex_columns is not None else {}
+        self.vertex_vocabs = vertex_vocabs if vertex_vocabs is not None else {}
+        self.edge_columns = edge_columns if edge_columns is not None else {}
+        self.edge_vocabs = edge_vocabs if edge_vocabs is not None else {}
+        self.directed = directed
+        self._in_csr = None
+
+    @classmethod
+    def from_igraph(cls, graph):
+        """
+        Build the columnar representation of an igraph graph. Edges are 
+        reordered by source vertex, so edge ids are not preserved.
+        """
+        n_vertices = graph.vcount()
+        edges = np.asarray( graph.get_edgelist(), dtype=np.int64 ).reshape( -1, 2 )
+        order = np.argsort( edges[:,0], kind="stable" )
+        topology = cls.from_edge_list( n_vertices, edges[:,0], edges[:,1] )
+        vertex_columns = {}
+        vertex_vocabs = {}
+        for name in graph.vs.attributes():
+            column, vocab = _encode_column( graph.vs[ name ] )
+            vertex_columns[ name ] = column
+            if vocab is not None:
+                vertex_vocabs[ name ] = vocab
+        edge_columns = {}
+        edge_vocabs = {}
+        for name in graph.es.attributes():
+            column, vocab = _encode_column( graph.es[ name ] )
+            edge_columns[ name ] = column[ order ]
+            if vocab is not None:
+                edge_vocabs[ name ] = vocab
+        return cls( n_vertices, topology.indptr, topology.indices, 
+                    vertex_columns, vertex_vocabs, 
+                    edge_columns, edge_vocabs, 
+                    directed=graph.is_directed() )
+
+    @classmethod
+    def from_edge_list(cls, n_vertices, sources, targets, directed=True):
+        """
+        Build an attribute-free representation from arrays of edge endpoints
+        """
+        sources = np.asarray( sources, dtype=np.int64 )
+        targets = np.asarray( targets, dtype=np.int64 )
+        order = np.argsort( sources, kind="stable" )
+        indptr = np.zeros( n_vertices + 1, dtype=np.int64 )
+        np.cumsum( np.bincount( sources, minlength=n_vertices ), out=indptr[1:] )
+        return cls( n_vertices, indptr, targets[ order ], directed=directed )
+
+    @property
+    def n_edges(self):
+        return len( self.indices )
+
+    def sources(self):
+        """
+        Source vertex of every edge, in CSR order
+        """
+        return np.repeat( np.arange( self.n_vertices, dtype=np.int64 ), 
+                          np.diff( self.indptr ) )
+
+    def edge_list(self):
+        """
+        Returns a pair of arrays holding the source and target of every edge
+        """
+        return self.sources(), np.asarray( self.indices, dtype=np.int64 )
+
+    def file_order_edge_list(self):
+        """
+        Returns edge_list() in the order of the graph file the graph was parsed
+        from, if it was recorded, and in CSR order otherwise. This is the edge
+        order of the graph read_graph returns for the same file.
+        """
+        sources, targets = self.edge_list()
+        order = self._file_edge_order()
+        if order is None:
+            return sources, targets
+        return sources[ order ], targets[ order ]
+
+    def _file_edge_order(self):
+        if edge_order_column not in self.edge_columns:
+            return None
+        return np.argsort( self.edge_columns[ edge_order_column ], kind="stable" )
+
+    def in_csr(self):
+        """
+        Returns ( indptr, sources, edge_ids ) describing the in-edges of every
+        vertex. Computed on first use.
+        """
+        if self._in_csr is None:
+            sources, targets = self.edge_list()
+            order = np.argsort( targets, kind="stable" )
+            in_indptr = np.zeros( self.n_vertices + 1, dtype=np.int64 )
+            np.cumsum( np.bincount( targets, minlength=self.n_vertices ), out=in_indptr[1:] )
+            self._in_csr = ( in_indptr, sources[ order ], order )
+        return self._in_csr
+
+    def out_edges(self, vertex_ids):
+        """
+        Returns ( sources, targets ) of all edges leaving the requested vertices
+        """
+        vertex_ids = np.asarray( vertex_ids, dtype=np.int64 )
+        edge_ids, counts = _gather_csr_ranges( self.indptr, vertex_ids )
+        return ( np.repeat( vertex_ids, counts ), 
+                 np.asarray( self.indices[ edge_ids ], dtype=np.int64 ) )
+
+    def in_edges(self, vertex_ids):
+        """
+        Returns ( sources, targets ) of all edges entering the requested vertices
+        """
+        vertex_ids = np.asarray( vertex_ids, dtype=np.int64 )
+        in_indptr, in_sources, _ = self.in_csr()
+        edge_ids, counts = _gather_csr_ranges( in_indptr, vertex_ids )
+        return in_sources[ edge_ids ], np.repeat( vertex_ids, counts )
+
+    def vertex_attributes(self):
+        return list( self.vertex_columns.keys() )
+
+    def get_vertex_column(self, name):
+        """
+        Raw column for a vertex attribute. String-valued attributes are 
+        returned as their integer codes.
+        """
+        return self.vertex_columns[ name ]
+
+    def get_vertex_attribute(self, name):
+        """
+        Decoded values of a vertex attribute
+        """
+        column = self.vertex_columns[ name ]
+        if name in self.vertex_vocabs:
+            return np.asarray( self.vertex_vocabs[ name ], dtype=object )[ column ]
+        return column
+
+    def get_edge_attribute(self, name):
+        """
+        Decoded values of an edge attribute, in CSR order
+        """
+        column = self.edge_columns[ name ]
+        if name in self.edge_vocabs:
+            return np.asarray( self.edge_vocabs[ name ], dtype=object )[ column ]
+        return column
+
+    def subgraph(self, vertex_ids):
+        """
+        Returns the subgraph induced by the requested vertices as a new, 
+        in-memory event_graph_arrays object. Vertices keep their relative order.
+        """
+        vertex_ids = np.unique( np.asarray( vertex_ids, dtype=np.int64 ) )
+        n_sub = len( vertex_ids )
+        edge_ids, counts = _gather_csr_ranges( self.indptr, vertex_ids )
+        targets = np.asarray( self.indices[ edge_ids ], dtype=np.int64 )
+        new_sources = np.repeat( np.arange( n_sub, dtype=np.int64 ), counts )
+        # Keep only edges whose target is also in the subgraph
+        positions = np.searchsorted( vertex_ids, targets )
+        positions[ positions == n_sub ] = 0
+        keep = vertex_ids[ positions ] == targets if n_sub > 0 else np.zeros( 0, dtype=bool )
+        edge_ids = edge_ids[ keep ]
+        indptr = np.zeros( n_sub + 1, dtype=np.int64 )
+        np.cumsum( np.bincount( new_sources[ keep ], minlength=n_sub ), out=indptr[1:] )
+        vertex_columns = { k:np.asarray( v[ vertex_ids ] ) for k,v in self.vertex_columns.items() }
+        edge_columns = { k:np.asarray( v[ edge_ids ] ) for k,v in self.edge_columns.items() }
+        return event_graph_arrays( n_sub, indptr, positions[ keep ],
+                                   vertex_columns, dict( self.vertex_vocabs ),
+                                   edge_columns, dict( self.edge_vocabs ),
+                                   directed=self.directed )
+
+    def to_igraph(self):
+        """
+        Materialize as an igraph graph with all vertex and edge attributes.
+        Edges are in file order if it was recorded (see file_order_edge_list).
+        """
+        sources, targets = self.edge_list()
+        order = self._file_edge_order()
+        if order is None:
+            order = slice( None )
+        graph = igraph.Graph( n=self.n_vertices, 
+                              edges=np.column_stack( ( sources[ order ], targets[ order ] ) ),
+                              directed=self.directed )
+        for name in self.vertex_columns:
+            graph.vs[ name ] = self.get_vertex_attribute( name ).tolist()
+        for name in self.edge_columns:
+            if name != edge_order_column:
+                graph.es[ name ] = self.get_edge_attribute( name )[ order ].tolist()
+        return graph
+
+
+def _padding( n_bytes ):
+    return ( -n_bytes ) % _binary_graph_alignment
+
+"""
+Returns the values of a vertex attribute as an array for either an igraph graph
+or an event_graph_arrays object
+"""
+def get_vertex_values( graph, name ):
+    if isinstance( graph, event_graph_arrays ):
+        return graph.get_vertex_attribute( name )
+    return np.asarray( graph.vs[ name ] )
+
+"""
+Sets a vertex attribute from an array of values for either an igraph graph or
+an event_graph_arrays object
+"""
+def set_vertex_values( graph, name, values ):
+    if isinstance( graph, event_graph_arrays ):
+        graph.vertex_columns[ name ] = np.asarray( values )
+        graph.vertex_vocabs.pop( name, None )
+    else:
+        graph.vs[ name ] = np.asarray( values ).tolist()
+
+"""
+Returns the number of vertices of either an igraph graph or an
+event_graph_arrays object
+"""
+def get_vertex_count( graph ):
+    if isinstance( graph, event_graph_arrays ):
+        return graph.n_vertices
+    return graph.vcount()
+
+"""
+Returns a boolean mask of the vertices whose attribute equals the given value.
+For event_graph_arrays objects, string-valued attributes are compared by code
+so the column is never decoded.
+"""
+def vertex_values_equal( graph, name, value ):
+    if isinstance( graph, event_graph_arrays ) and name in graph.vertex_vocabs:
+        vocab = graph.vertex_vocabs[ name ]
+        column = graph.get_vertex_column( name )
+        if value not in vocab:
+            return np.zeros( len( column ), dtype=bool )
+        return np.asarray( column ) == vocab.index( value )
+    return get_vertex_values( graph, name ) == value
+
+"""
+Writes an event graph (either an igraph graph or an event_graph_arrays object)
+in the binary columnar format
+"""
+def write_graph_binary( graph, output_path ):
+    if not isinstance( graph, event_graph_arrays ):
+        graph = event_graph_arrays.from_igraph( graph )
+    sections = [ ( "topology", { "indptr"  : graph.indptr, 
+                                 "indices" : graph.indices } ),
+                 ( "vertex", graph.vertex_columns ),
+                 ( "edge", graph.edge_columns ) ]
+    header = { "n_vertices"    : int( graph.n_vertices ),
+               "directed"      : bool( graph.directed ),
+               "vertex_vocabs" : graph.vertex_vocabs,
+               "edge_vocabs"   : graph.edge_vocabs }
+    # Lay out columns back-to-back, each aligned for memory-mapping
+    arrays = []
+    offset = 0
+    for section, columns in sections:
+        header[ section ] = {}
+        for name, column in columns.items():
+            column = np.ascontiguousarray( column )
+            header[ section ][ name ] = { "dtype"  : column.dtype.str,
+                                          "length" : int( len( column ) ),
+                                          "offset" : offset }
+            arrays.append( column )
+            offset += column.nbytes + _padding( column.nbytes )
+    header_bytes = json.dumps( header ).encode( "utf-8" )
+    preamble_len = len( _binary_graph_magic ) + 8 + len( header_bytes )
+    with open( output_path, "wb" ) as outfile:
+        outfile.write( _binary_graph_magic )
+        outfile.write( np.uint64( len( header_bytes ) ).astype( "<u8" ).tobytes() )
+        outfile.write( header_bytes )
+        outfile.write( b"\0" * _padding( preamble_len ) )
+        for column in arrays:
+            outfile.write( column.tobytes() )
+            outfile.write( b"\0" * _padding( column.nbytes ) )
+
+"""
+Reads a binary event graph. Columns are memory-mapped read-only unless mmap is
+False, in which case they are read into memory.
+"""
+def read_graph_binary( graph_path, mmap=True ):
+    with open( graph_path, "rb" ) as infile:
+        magic = infile.read( len( _binary_graph_magic ) )
+        if magic != _binary_graph_magic:
+            raise ValueError("Not a binary event graph: {}".format( graph_path ))
+        header_len = int( np.frombuffer( infile.read( 8 ), dtype="<u8" )[0] )
+        header = json.loads( infile.read( header_len ).decode( "utf-8" ) )
+    preamble_len = len( _binary_graph_magic ) + 8 + header_len
+    data_start = preamble_len + _padding( preamble_len )
+
+    def load_column( desc ):
+        dtype = np.dtype( desc["dtype"] )
+        if desc["length"] == 0:
+            return np.zeros( 0, dtype=dtype )
+        column = np.memmap( graph_path, dtype=dtype, mode="r", 
+                            offset=data_start + desc["offset"], 
+                            shape=( desc["length"], ) )
+        if not mmap:
+            column = np.array( column )
+        return column
+
+    sections = { s:{ name:load_column( desc ) for name,desc in header[ s ].items() } 
+                 for s in [ "topology", "vertex", "edge" ] }
+    return event_graph_arrays( header["n_vertices"],
+                               sections["topology"]["indptr"],
+                               sections["topology"]["indices"],
+                               sections["vertex"], header["vertex_vocabs"],
+                               sections["edge"], header["edge_vocabs"],
+                               directed=header["directed"] )
@@ -21,6 +21,8 @@ from callstack_analysis import ( get_callstack_to_count,
                                  get_caller_callee_pairs
                                )
 
+from kdts_store import load_kdts
+
 
 
 
@@ -29,9 +31,8 @@ def normalize_counts( pair_to_count ):
     return { pair:count/max_count for pair,count in pair_to_count.items() }
 
 def main( kdts_data_path, executable_path, flagged_slices_path, flagging_policy ):
-    with open( kdts_data_path, "rb" ) as kdts_infile:
-        kdts = pkl.load( kdts_infile )
-        slice_to_callstacks = { k:v["callstack"] for k,v in kdts.items() }
+    kdts = load_kdts( kdts_data_path )
+    slice_to_callstacks = { k:v["callstack"] for k,v in kdts.items() }
 
     with open( executable_path, "rb" ) as executable_infile:
         elf_file = ELFFile( executable_infile )
@@ -2,7 +2,6 @@
 
 import os
 import pprint
-import pickle as pkl
 import json
 import argparse
 import numpy as np
@@ -20,6 +19,7 @@ sys.path.append("/g/g12/chapp1/ANACIN-X/anacin-x/event_graph_analysis/visualizat
 
 from graph_kernel_postprocessing import flatten_distance_matrix
 from kernel_distance_time_series_postprocessing import get_distances_seq
+from kdts_store import load_kdts
 
 
 def kernel_json_to_key( kernel_json ):
@@ -53,8 +53,7 @@ def get_scatter_plot_points( kernel_distances ):
 def main( kdts_path, kernel_path, pattern, ymax ):
     
     # Load kernel distance time series 
-    with open( kdts_path, "rb" ) as infile:
-        slice_idx_to_data = pkl.load( infile )
+    slice_idx_to_data = load_kdts( kdts_path )
 
     # Load kernel definition
     with open( kernel_path, "r" ) as infile:
@@ -25,6 +25,7 @@ sys.path.append("..")
 sys.path.append(".")
 
 from graph_kernel_postprocessing import flatten_distance_matrix
+from kdts_store import load_kdts
 
 
 def kernel_json_to_key( kernel_json ):
@@ -44,8 +45,7 @@ def kernel_json_to_key( kernel_json ):
 def main( kdts_data_path, kernel_file_path, block_traffic_data_path=None, flagged_slices=None, kdts_ymax=None, mre_ymax=None, output="mini_amr_kdts.png"):
 
     # Read in kernel distance time series data
-    with open( kdts_data_path, "rb" ) as infile:
-        slice_idx_to_data = pkl.load( infile )
+    slice_idx_to_data = load_kdts( kdts_data_path )
 
     # Read in kernel definition file
     with open( kernel_file_path, "r" ) as infile:
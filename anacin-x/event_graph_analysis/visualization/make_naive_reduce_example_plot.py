@@ -2,7 +2,6 @@
 
 import os
 import pprint
-import pickle as pkl
 import argparse
 import numpy as np
 import matplotlib
@@ -19,6 +18,7 @@ sys.path.append("/g/g12/chapp1/ANACIN-X/anacin-x/event_graph_analysis/visualizat
 
 from graph_kernel_postprocessing import flatten_distance_matrix
 from kernel_distance_time_series_postprocessing import get_distances_seq
+from kdts_store import load_kdts
 
 def get_scatter_plot_points( idx_to_distances ):
     x_vals = []
@@ -34,8 +34,7 @@ def get_scatter_plot_points( idx_to_distances ):
 
 def main( kdts_path ):
     # Read in kdts data
-    with open( kdts_path, "rb" ) as infile:
-        slice_idx_to_data = pkl.load( infile )
+    slice_idx_to_data = load_kdts( kdts_path )
     
     kernel = ('wlst','logical_time', 5)
     idx_to_distances = { k:flatten_distance_matrix(v["kernel_distance"][kernel]) for k,v in slice_idx_to_data.items() }
@@ -24,8 +24,9 @@ sys.path.append(".")
 sys.path.append("..")
 sys.path.append("/g/g12/chapp1/ANACIN-X/anacin-x/event_graph_analysis/")
 
-from graph_kernel_postprocessing import flatten_distance_matrix
+from graph_kernel_postprocessing import flatten_distance_matrix, get_distance_pairs
 from kernel_distance_time_series_postprocessing import get_distances_seq, get_stats_seq
+from kdts_store import load_kdts
 
 def make_pairwise_scatter_plot( slice_idx_to_data ):
     # Unpack kernel distance stuff
@@ -35,16 +36,14 @@ def make_pairwise_scatter_plot( slice_idx_to_data ):
         # Get kernel distance data for this slice
         kernel_distance_data = data["kernel_distance"]
         for k,dist_mat in kernel_distance_data.items():
-            # Extract all pairwise distances at this slice, for this kernel
-            for i in range(len(dist_mat)):
-                for j in range(len(dist_mat[0])):
-                    if i > j:
-                        graph_pair = (i,j)
-                        distance = dist_mat[i][j]
-                        if graph_pair not in graph_pair_to_distance_seq:
-                            graph_pair_to_distance_seq[ graph_pair ] = [ distance ]
-                        else:
-                            graph_pair_to_distance_seq[ graph_pair ].append( distance )
+            # Extract all pairwise distances at this slice, for this kernel, in
+            # the same order as flatten_distance_matrix
+            graph_pairs = get_distance_pairs( dist_mat )
+            for graph_pair,distance in zip( graph_pairs, flatten_distance_matrix( dist_mat ) ):
+                if graph_pair not in graph_pair_to_distance_seq:
+                    graph_pair_to_distance_seq[ graph_pair ] = [ distance ]
+                else:
+                    graph_pair_to_distance_seq[ graph_pair ].append( distance )
 
 
     # Scale kernel distances
@@ -173,11 +172,7 @@ def make_violin_plots( slice_idx_to_data ):
         kernel_distance_data = data["kernel_distance"]
         for k,dist_mat in kernel_distance_data.items():
             # Extract all pairwise distances at this slice, for this kernel
-            distances = []
-            for i in range(len(dist_mat)):
-                for j in range(len(dist_mat[0])):
-                    if i > j:
-                        distances.append( dist_mat[i][j] )
+            distances = flatten_distance_matrix( dist_mat )
             if k not in kernel_to_distance_data_seq:
                 kernel_to_distance_data_seq[k] = [ distances ]
             else:
@@ -335,11 +330,7 @@ def make_box_plots( slice_idx_to_data, slice_idx_lower, slice_idx_upper, wall_ti
         kernel_distance_data = data["kernel_distance"]
         for k,dist_mat in kernel_distance_data.items():
             # Extract all pairwise distances at this slice, for this kernel
-            distances = []
-            for i in range(len(dist_mat)):
-                for j in range(len(dist_mat[0])):
-                    if i > j:
-                        distances.append( dist_mat[i][j] )
+            distances = flatten_distance_matrix( dist_mat )
             if k not in kernel_to_distance_data_seq:
                 kernel_to_distance_data_seq[k] = [ distances ]
             else:
@@ -475,8 +466,7 @@ def make_box_plots( slice_idx_to_data, slice_idx_lower, slice_idx_upper, wall_ti
 def main( kdts_path, plot_type, slice_idx_lower, slice_idx_upper, flagged_slices, wall_time_layout, application_events ):
 
     # Read in kdts data
-    with open( kdts_path, "rb" ) as infile:
-        slice_idx_to_data = pkl.load( infile )
+    slice_idx_to_data = load_kdts( kdts_path )
 
     # if available, load and unpack application-level events
     if application_events is not None:
@@ -0,0 +1,178 @@
+import numpy as np
+import scipy.sparse
+
+"""
+Weisfeiler-Lehman subtree pattern kernel computed in-project.
+
+All graphs being compared are refined together as one disjoint union, so a
+single label-compression dictionary is shared between them and every
+iteration's labels are directly comparable across graphs. For each iteration
+h, the graphs' label counts form a sparse feature matrix X_h, whose Gram
+matrix K_h = X_h X_h^T is that iteration's contribution to the kernel. The
+kernel with n WL iterations is the sum of K_0 ... K_n, so all requested
+iteration counts for the same labels come out of one refinement pass as prefix
+sums.
+
+Follows the graphkernels implementation: vertices' initial labels are read from
+the "label" vertex attribute (or the label array of a relabeled view), and the neighborhood refined over is the
+undirected one (each edge contributes to both of its endpoints).
+"""
+
+"""
+Concatenates the graphs into a single vertex and edge numbering. Accepts either
+a list of igraph graphs or a relabeled view of a set of graphs (see
+graph_kernel_preprocessing.relabeled_graph_set), which already holds its union
+arrays.
+"""
+def _get_union_arrays( graphs, label ):
+    if hasattr( graphs, "get_union_arrays" ):
+        return graphs.get_union_arrays()
+    n_vertices = np.array( [ g.vcount() for g in graphs ], dtype=np.int64 )
+    offsets = np.zeros( len( graphs ) + 1, dtype=np.int64 )
+    np.cumsum( n_vertices, out=offsets[1:] )
+    graph_ids = np.repeat( np.arange( len( graphs ), dtype=np.int64 ), n_vertices )
+    labels = np.concatenate( [ np.asarray( g.vs[ label ] ) for g in graphs if g.vcount() > 0 ]
+                             or [ np.zeros( 0, dtype=np.int64 ) ] )
+    edges = [ np.asarray( g.get_edgelist(), dtype=np.int64 ).reshape( -1, 2 ) + offsets[i]
+              for i,g in enumerate( graphs ) ]
+    edges = np.concatenate( edges ) if len( edges ) > 0 else np.zeros( ( 0, 2 ), dtype=np.int64 )
+    return offsets[-1], graph_ids, labels, edges[:,0], edges[:,1]
+
+class _neighborhood_groups(object):
+    """
+    Vertices grouped by degree, with the positions of each vertex's neighbors
+    laid out as one row per vertex. Built once, since the topology does not
+    change between WL iterations.
+    """
+    def __init__(self, n_vertices, sources, targets):
+        # Each edge contributes to the neighborhood of both of its endpoints
+        centers = np.concatenate( ( sources, targets ) )
+        self.neighbors = np.concatenate( ( targets, sources ) )
+        self.order = np.argsort( centers, kind="stable" )
+        degrees = np.bincount( centers, minlength=n_vertices )
+        indptr = np.zeros( n_vertices + 1, dtype=np.int64 )
+        np.cumsum( degrees, out=indptr[1:] )
+        self.groups = []
+        for degree in np.unique( degrees ):
+            vertices = np.flatnonzero( degrees == degree )
+            positions = indptr[ vertices ][:,None] + np.arange( degree, dtype=np.int64 )
+            self.groups.append( ( vertices, positions ) )
+
+    def refine(self, codes):
+        """
+        Compresses each vertex's label together with the sorted multiset of its
+        neighbors' labels into a new label. Returns the new labels and the
+        number of distinct labels.
+        """
+        # Neighbor labels grouped by center vertex, sorted within each group
+        neighbor_codes = codes[ self.neighbors[ self.order ] ]
+        new_codes = np.empty_like( codes )
+        n_codes = 0
+        for vertices, positions in self.groups:
+            signatures = np.empty( ( len( vertices ), positions.shape[1] + 1 ), dtype=codes.dtype )
+            signatures[:,0] = codes[ vertices ]
+            signatures[:,1:] = np.sort( neighbor_codes[ positions ], axis=1 )
+            # Signatures of different lengths can never be equal, so each
+            # degree group is compressed separately into its own id range
+            unique_signatures, inverse = np.unique( signatures, axis=0, return_inverse=True )
+            new_codes[ vertices ] = n_codes + inverse.ravel()
+            n_codes += len( unique_signatures )
+        return new_codes, n_codes
+
+def _get_feature_matrix( graph_ids, codes, n_graphs, n_codes ):
+    counts = np.ones( len( codes ), dtype=np.float64 )
+    return scipy.sparse.csr_matrix( ( counts, ( graph_ids, codes ) ), shape=( n_graphs, n_codes ) )
+
+"""
+Computes the WL feature matrices X_0 ... X_n for all graphs in one refinement
+pass. Row i of X_h holds graph i's counts of the labels produced by WL
+iteration h.
+"""
+def compute_wl_feature_matrices( graphs, n_iters, label="label" ):
+    n_vertices, graph_ids, labels, sources, targets = _get_union_arrays( graphs, label )
+    _, codes = np.unique( labels, return_inverse=True )
+    codes = codes.ravel().astype( np.int64 )
+    n_codes = int( codes.max() ) + 1 if len( codes ) > 0 else 0
+    feature_matrices = [ _get_feature_matrix( graph_ids, codes, len( graphs ), n_codes ) ]
+    if n_iters > 0:
+        neighborhoods = _neighborhood_groups( n_vertices, sources, targets )
+        for _ in range( n_iters ):
+            codes, n_codes = neighborhoods.refine( codes )
+            feature_matrices.append( _get_feature_matrix( graph_ids, codes, len( graphs ), n_codes ) )
+    return feature_matrices
+
+"""
+Scrambles 64-bit values (one splitmix64 step), so that sums of hashes behave
+like hashes of multisets. The increment keeps 0 from mapping to 0, which would
+make such neighbors invisible in the sums.
+"""
+def _mix_hashes( x ):
+    x = np.asarray( x, dtype=np.uint64 )
+    with np.errstate( over="ignore" ):
+        x = x + np.uint64( 0x9E3779B97F4A7C15 )
+        x = ( x ^ ( x >> np.uint64( 30 ) ) ) * np.uint64( 0xBF58476D1CE4E5B9 )
+        x = ( x ^ ( x >> np.uint64( 27 ) ) ) * np.uint64( 0x94D049BB133111EB )
+        return x ^ ( x >> np.uint64( 31 ) )
+
+"""
+Computes content-based WL labels for all graphs: 64-bit hashes of each vertex's
+subtree pattern after 0 ... n iterations. A vertex's new hash combines its own
+hash with the (order-independent) sum of its neighbors' scrambled hashes.
+Unlike the compressed labels of compute_wl_feature_matrices, which depend on
+which other graphs are refined in the same pass, these hashes are the same in
+every pass, so features of graphs refined separately (e.g., of runs added later)
+can be compared. Returns the graph id of every vertex and one array of vertex
+hashes per iteration.
+"""
+def compute_wl_label_hashes( graphs, n_iters, label="label" ):
+    n_vertices, graph_ids, labels, sources, targets = _get_union_arrays( graphs, label )
+    hashes = _mix_hashes( np.asarray( labels ).astype( np.int64 ).view( np.uint64 ) )
+    hashes_seq = [ hashes ]
+    if n_iters > 0:
+        # Each edge contributes to the neighborhood of both of its endpoints
+        centers = np.concatenate( ( sources, targets ) )
+        neighbors = np.concatenate( ( targets, sources ) )[ np.argsort( centers, kind="stable" ) ]
+        degrees = np.bincount( centers, minlength=n_vertices )
+        has_neighbors = degrees > 0
+        starts = ( np.cumsum( degrees ) - degrees )[ has_neighbors ]
+        for _ in range( n_iters ):
+            neighbor_sums = np.zeros( n_vertices, dtype=np.uint64 )
+            if len( neighbors ) > 0:
+                neighbor_sums[ has_neighbors ] = np.add.reduceat( _mix_hashes( hashes[ neighbors ] ), starts )
+            with np.errstate( over="ignore" ):
+                hashes = _mix_hashes( hashes * np.uint64( 0xD6E8FEB86659FD93 ) + neighbor_sums )
+            hashes_seq.append( hashes )
+    return graph_ids, hashes_seq
+
+"""
+Computes the WL kernel matrix for each requested number of WL iterations.
+Returns a dict mapping each number of iterations to its (dense) kernel matrix.
+"""
+def compute_wl_kernel_matrices( graphs, iters_seq, label="label" ):
+    feature_matrices = compute_wl_feature_matrices( graphs, max( iters_seq ), label )
+    return get_wl_kernel_matrices_from_features( feature_matrices, iters_seq )
+
+"""
+Computes the WL kernel matrix for each requested number of WL iterations from
+previously computed feature matrices X_0 ... X_n, where n is at least the
+largest number of iterations requested
+"""
+def get_wl_kernel_matrices_from_features( feature_matrices, iters_seq ):
+    iters_seq = set( iters_seq )
+    if max( iters_seq ) >= len( feature_matrices ):
+        raise ValueError( "Feature matrices for {} WL iterations requested, but only {} available".format( max( iters_seq ), len( feature_matrices ) - 1 ) )
+    n_graphs = feature_matrices[0].shape[0]
+    n_iters_to_kernel_mat = {}
+    kernel_mat = np.zeros( ( n_graphs, n_graphs ), dtype=np.float64 )
+    for h, X in enumerate( feature_matrices[ :max( iters_seq ) + 1 ] ):
+        kernel_mat = kernel_mat + ( X @ X.T ).toarray()
+        if h in iters_seq:
+            n_iters_to_kernel_mat[ h ] = kernel_mat
+    return n_iters_to_kernel_mat
+
+"""
+Computes the WL kernel matrix for a single number of WL iterations. Drop-in
+replacement for graphkernels' CalculateWLKernel.
+"""
+def compute_wl_kernel_matrix( graphs, n_iters, label="label" ):
+    return compute_wl_kernel_matrices( graphs, [ n_iters ], label )[ n_iters ]